@@ -1,5 +1,6 @@
 from accounts.models import UserProfile
 from django.contrib.auth.models import User
+from friendships.services import FriendshipService
 from rest_framework import serializers, exceptions
 
 
@@ -23,6 +24,35 @@ class UserSerializerWithProfile(UserSerializer):
         fields = ('id', 'username', 'nickname', 'avatar_url')
 
 
+class UserSerializerWithSocialCounts(UserSerializerWithProfile):
+    followers_count = serializers.SerializerMethodField()
+    followings_count = serializers.SerializerMethodField()
+
+    class Meta:
+        model = User
+        fields = (
+            'id',
+            'username',
+            'nickname',
+            'avatar_url',
+            'followers_count',
+            'followings_count',
+        )
+
+    def _get_social_counts(self, obj):
+        # set by the views for a whole page, see FriendshipService.get_social_counts
+        social_counts = self.context.get('social_counts')
+        if social_counts is None or obj.id not in social_counts:
+            social_counts = FriendshipService.get_social_counts([obj.id])
+        return social_counts[obj.id]
+
+    def get_followers_count(self, obj):
+        return self._get_social_counts(obj)['followers_count']
+
+    def get_followings_count(self, obj):
+        return self._get_social_counts(obj)['followings_count']
+
+
 class UserSerializerForTweet(UserSerializerWithProfile):
     pass
 
@@ -31,7 +61,7 @@ class UserSerializerForComment(UserSerializerWithProfile):
     pass
 
 
-class UserSerializerForFriendship(UserSerializerWithProfile):
+class UserSerializerForFriendship(UserSerializerWithSocialCounts):
     pass
 
 
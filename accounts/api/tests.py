@@ -1,7 +1,9 @@
 from accounts.models import UserProfile
 from django.core.files.uploadedfile import SimpleUploadedFile
+from friendships.services import FriendshipService
 from rest_framework.test import APIClient
 from testing.testcases import TestCase
+from unittest import mock
 
 
 LOGIN_URL = '/api/accounts/login/'
@@ -9,6 +11,7 @@ LOGOUT_URL = '/api/accounts/logout/'
 SIGNUP_URL = '/api/accounts/signup/'
 LOGIN_STATUS_URL = '/api/accounts/login_status/'
 USER_PROFILE_DETAIL_URL = '/api/profiles/{}/'
+USERS_URL = '/api/users/'
 
 
 class AccountApiTests(TestCase):
@@ -163,4 +166,26 @@ class UserProfileAPITests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual('my-avatar' in response.data['avatar'], True)
         p.refresh_from_db()
-        self.assertIsNotNone(p.avatar)
\ No newline at end of file
+        self.assertIsNotNone(p.avatar)
+
+    def test_list_users(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_authenticate(self.user)
+        eliza = self.create_user('eliza')
+        self.create_friendship(eliza, self.user)
+
+        # the counters of the page are read in one batch
+        with mock.patch.object(
+            FriendshipService,
+            'get_social_counts',
+            wraps=FriendshipService.get_social_counts,
+        ) as get_social_counts:
+            response = self.client.get(USERS_URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_social_counts.call_count, 1)
+        counts = {
+            user['username']: (user['followers_count'], user['followings_count'])
+            for user in response.data['results']
+        }
+        self.assertEqual(counts, {'admin': (1, 0), 'eliza': (0, 1)})
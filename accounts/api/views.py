@@ -3,10 +3,11 @@ from accounts.api.serializers import (
     SignupSerializer,
     UserProfileSerializerForUpdate,
     UserSerializer,
-    UserSerializerWithProfile,
+    UserSerializerWithSocialCounts,
 )
 from accounts.models import UserProfile
 from django.contrib.auth.models import User
+from friendships.services import FriendshipService
 from rest_framework import permissions
 from rest_framework import viewsets
 from rest_framework.response import Response
@@ -25,9 +26,22 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
     API endpoint that allows users to be viewed or edited.
     """
     queryset = User.objects.all().order_by('-date_joined')
-    serializer_class = UserSerializerWithProfile
+    serializer_class = UserSerializerWithSocialCounts
     permission_classes = (permissions.IsAdminUser,)
 
+    def list(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        users = list(queryset) if page is None else page
+        context = self.get_serializer_context()
+        # the counters of the whole page with one MGET
+        context['social_counts'] = FriendshipService.get_social_counts([user.id for user in users])
+        serializer = self.get_serializer(users, many=True, context=context)
+        if page is None:
+            return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
+
+
 class AccountViewSet(viewsets.ViewSet):
     permission_classes = (AllowAny,)
     serializer_class = SignupSerializer
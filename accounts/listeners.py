@@ -1,3 +1,9 @@
 def profile_changed(sender, instance, **kwargs):
     from accounts.services import UserService
     UserService.invalidate_profile(instance.user_id)
+    UserService.invalidate_user_fragment(instance.user_id)
+
+
+def user_changed(sender, instance, **kwargs):
+    from accounts.services import UserService
+    UserService.invalidate_user_fragment(instance.id)
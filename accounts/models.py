@@ -1,4 +1,4 @@
-from accounts.listeners import profile_changed
+from accounts.listeners import profile_changed, user_changed
 from django.contrib.auth.models import User
 from django.db import models
 from django.db.models.signals import post_save, pre_delete
@@ -9,6 +9,12 @@ class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.SET_NULL, null=True)
     avatar = models.FileField(null=True)
     nickname = models.CharField(null=True, max_length=200)
+
+    # written back periodically from the redis counters, see
+    # FriendshipService.get_social_counts. null means never counted.
+    followers_count = models.IntegerField(null=True)
+    followings_count = models.IntegerField(null=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -31,6 +37,8 @@ User.profile = property(get_profile)
 
 pre_delete.connect(invalidate_object_cache, sender=User)
 post_save.connect(invalidate_object_cache, sender=User)
+pre_delete.connect(user_changed, sender=User)
+post_save.connect(user_changed, sender=User)
 
 pre_delete.connect(profile_changed, sender=UserProfile)
 post_save.connect(profile_changed, sender=UserProfile)
@@ -2,7 +2,8 @@ from accounts.models import UserProfile
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.cache import caches
-from twitter.cache import USER_PROFILE_PATTERN
+from tweets.constants import TWEET_FRAGMENT_VERSION
+from twitter.cache import USER_FRAGMENT_PATTERN, USER_PROFILE_PATTERN
 from utils.memcached_helper import MemcachedHelper
 
 cache = caches['testing'] if settings.TESTING else caches['default']
@@ -29,7 +30,79 @@ class UserService:
         cache.set(key, profile)
         return profile
 
+    @classmethod
+    def get_users_through_cache(cls, user_ids):
+        return MemcachedHelper.get_objects_through_cache(User, user_ids)
+
+    @classmethod
+    def get_users_with_profiles_through_cache(cls, user_ids):
+        """
+        returns {user_id: user} with the profiles attached, so that
+        user.profile does not hit the cache again for every user
+        """
+        users = cls.get_users_through_cache(user_ids)
+        profiles = cls.get_profiles_through_cache(users.keys())
+        for user_id, user in users.items():
+            setattr(user, '_cached_user_profile', profiles[user_id])
+        return users
+
+    @classmethod
+    def get_profiles_through_cache(cls, user_ids):
+        """
+        batch version of get_profile_through_cache, returns {user_id: profile}
+        """
+        keys = {
+            USER_PROFILE_PATTERN.format(user_id=user_id): user_id
+            for user_id in user_ids
+        }
+        profiles = {
+            keys[key]: profile
+            for key, profile in cache.get_many(list(keys)).items()
+        }
+
+        # cache miss, read from db
+        missing_user_ids = [user_id for user_id in keys.values() if user_id not in profiles]
+        if not missing_user_ids:
+            return profiles
+        for profile in UserProfile.objects.filter(user_id__in=missing_user_ids):
+            profiles[profile.user_id] = profile
+        for user_id in missing_user_ids:
+            if user_id not in profiles:
+                profiles[user_id], _ = UserProfile.objects.get_or_create(user_id=user_id)
+        cache.set_many({
+            USER_PROFILE_PATTERN.format(user_id=user_id): profiles[user_id]
+            for user_id in missing_user_ids
+        })
+        return profiles
+
     @classmethod
     def invalidate_profile(cls, user_id):
         key = USER_PROFILE_PATTERN.format(user_id=user_id)
         cache.delete(key)
+
+    @classmethod
+    def get_user_fragment_key(cls, user_id):
+        return USER_FRAGMENT_PATTERN.format(
+            version=TWEET_FRAGMENT_VERSION,
+            user_id=user_id,
+        )
+
+    @classmethod
+    def get_user_fragments(cls, user_ids):
+        """
+        rendered user blocks of tweets, returns {user_id: fragment}
+        for the users that have been cached
+        """
+        keys = {cls.get_user_fragment_key(user_id): user_id for user_id in user_ids}
+        return {
+            keys[key]: fragment
+            for key, fragment in cache.get_many(list(keys)).items()
+        }
+
+    @classmethod
+    def set_user_fragment(cls, user_id, fragment):
+        cache.set(cls.get_user_fragment_key(user_id), fragment)
+
+    @classmethod
+    def invalidate_user_fragment(cls, user_id):
+        cache.delete(cls.get_user_fragment_key(user_id))
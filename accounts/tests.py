@@ -1,4 +1,5 @@
 from accounts.models import UserProfile
+from accounts.services import UserService
 from testing.testcases import TestCase
 
 
@@ -13,3 +14,25 @@ class UserProfileTests(TestCase):
         p = chiaki.profile
         self.assertEqual(isinstance(p, UserProfile), True)
         self.assertEqual(UserProfile.objects.count(), 1)
+
+    def test_get_users_with_profiles_through_cache(self):
+        users = [self.create_user('user{}'.format(i)) for i in range(3)]
+        for user in users:
+            user.profile.nickname = '{} nickname'.format(user.username)
+            user.profile.save()
+        user_ids = [user.id for user in users]
+        self.clear_cache()
+
+        # cache miss, one query for the users and one for the profiles
+        with self.assertNumQueries(2):
+            cached_users = UserService.get_users_with_profiles_through_cache(user_ids)
+        self.assertEqual(set(cached_users.keys()), set(user_ids))
+
+        # cache hit
+        with self.assertNumQueries(0):
+            cached_users = UserService.get_users_with_profiles_through_cache(user_ids)
+            for user in users:
+                self.assertEqual(
+                    cached_users[user.id].profile.nickname,
+                    '{} nickname'.format(user.username),
+                )
@@ -24,9 +24,16 @@ class CommentSerializer(serializers.ModelSerializer):
         )
 
     def get_likes_count(self, obj):
-        return obj.like_set.count()
+        likes_counts = self.context.get('comment_likes_counts')
+        if likes_counts is not None and obj.id in likes_counts:
+            return likes_counts[obj.id]
+        return LikeService.get_likes_count(obj)
 
     def get_has_liked(self, obj):
+        # list views resolve the whole page with LikeService.has_liked_many
+        liked_comment_ids = self.context.get('liked_comment_ids')
+        if liked_comment_ids is not None:
+            return obj.id in liked_comment_ids
         return LikeService.has_liked(self.context['request'].user, obj)
 
 
@@ -5,7 +5,7 @@ from comments.api.serializers import (
 )
 from comments.models import Comment
 from django.utils.decorators import method_decorator
-from inbox.services import NotificationService
+from likes.services import LikeService
 from ratelimit.decorators import ratelimit
 from rest_framework import viewsets, status
 from rest_framework.permissions import IsAuthenticated, AllowAny
@@ -31,10 +31,14 @@ class CommentViewSet(viewsets.GenericViewSet):
     @method_decorator(ratelimit(key='user', rate='10/s', method='GET', block=True))
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
-        comments = self.filter_queryset(queryset).order_by('created_at')
+        comments = list(self.filter_queryset(queryset).order_by('created_at'))
         serializer = CommentSerializer(
             comments,
-            context={'request': request},
+            context={
+                'request': request,
+                'liked_comment_ids': LikeService.has_liked_many(request.user, comments),
+                'comment_likes_counts': LikeService.get_likes_counts(comments),
+            },
             many=True,
         )
         return Response(
@@ -57,7 +61,6 @@ class CommentViewSet(viewsets.GenericViewSet):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         comment = serializer.save()
-        NotificationService.send_comment_notification(comment)
         return Response(
             CommentSerializer(comment, context={'request': request}).data,
             status=status.HTTP_201_CREATED,
@@ -1,25 +1,15 @@
 from utils.listeners import invalidate_object_cache
-from utils.redis_helper import RedisHelper
 
 
 def incr_comments_count(sender, instance, created, **kwargs):
-    from tweets.models import Tweet
-    from django.db.models import F
-
     if not created:
         return
 
-    # handle new comment
-    Tweet.objects.filter(id=instance.tweet_id)\
-        .update(comments_count=F('comments_count') + 1)
-    RedisHelper.incr_count(instance.tweet, 'comments_count')
+    # counters, ranked newsfeeds and notifications are updated asynchronously
+    from tweets.services import EngagementService
+    EngagementService.push_event('tweet', instance.tweet_id, 'comment', instance.user_id)
 
 
 def decr_comments_count(sender, instance, **kwargs):
-    from tweets.models import Tweet
-    from django.db.models import F
-
-    # handle comment deletion
-    Tweet.objects.filter(id=instance.tweet_id)\
-        .update(comments_count=F('comments_count') - 1)
-    RedisHelper.decr_count(instance.tweet, 'comments_count')
\ No newline at end of file
+    from tweets.services import EngagementService
+    EngagementService.push_event('tweet', instance.tweet_id, 'uncomment', instance.user_id)
@@ -3,12 +3,20 @@ from django_hbase.client import HBaseClient
 from django_hbase.models import HBaseField, IntegerField, TimestampField
 from django_hbase.models.exceptions import BadRowKeyError, EmptyColumnError
 
+INDEX_COLUMN_FAMILY = 'index'
+INDEX_ROW_KEY_COLUMN = '{}:row_key'.format(INDEX_COLUMN_FAMILY)
+
 
 class HBaseModel:
 
     class Meta:
         table_name = None
         row_key = ()
+        # secondary indexes, {index_name: (field, ...)}. every index is kept
+        # in its own table keyed by the index fields, each index row stores
+        # the primary row key and a copy of the columns so that get_by_index
+        # is a single rpc.
+        indexes = {}
 
     @classmethod
     def get_table(cls):
@@ -32,6 +40,8 @@ class HBaseModel:
         for key, field in self.get_field_hash().items():
             value = kwargs.get(key)
             setattr(self, key, value)
+        # index row keys this instance was saved or loaded with
+        self._index_row_keys = {}
 
     @classmethod
     def init_from_row(cls, row_key, row_data):
@@ -43,7 +53,13 @@ class HBaseModel:
             column_key = column_key.decode('utf-8')
             key = column_key[column_key.find(':') + 1:]
             data[key] = cls.deserialize_field(key, column_value)
-        return cls(**data)
+        instance = cls(**data)
+        for index_name in cls.get_indexes():
+            try:
+                instance._index_row_keys[index_name] = cls.serialize_index_key(index_name, data)
+            except BadRowKeyError:
+                continue
+        return instance
 
     @classmethod
     def serialize_row_key(cls, data, is_prefix=False):
@@ -123,7 +139,7 @@ class HBaseModel:
             row_data[column_key] = cls.serialize_field(field, column_value)
         return row_data
 
-    def save(self, batch=None):
+    def save(self, batch=None, index_batches=None):
         row_data = self.serialize_row_data(self.__dict__)
         if len(row_data) == 0:
             raise EmptyColumnError()
@@ -132,6 +148,23 @@ class HBaseModel:
         else:
             table = self.get_table()
             table.put(self.row_key, row_data)
+        self._save_index_rows(row_data, index_batches)
+
+    def _save_index_rows(self, row_data, index_batches=None):
+        index_row_data = dict(row_data)
+        index_row_data[INDEX_ROW_KEY_COLUMN] = self.row_key
+        index_row_keys = {}
+        for index_name in self.get_indexes():
+            index_row_key = self.serialize_index_key(index_name, self.__dict__)
+            index_row_keys[index_name] = index_row_key
+            batch = index_batches and index_batches.get(index_name)
+            target = batch or self.get_index_table(index_name)
+            # an indexed field has been changed, drop the stale index row
+            old_index_row_key = self._index_row_keys.get(index_name)
+            if old_index_row_key is not None and old_index_row_key != index_row_key:
+                target.delete(old_index_row_key)
+            target.put(index_row_key, index_row_data)
+        self._index_row_keys = index_row_keys
 
     @classmethod
     def get(cls, **kwargs):
@@ -141,21 +174,91 @@ class HBaseModel:
         return cls.init_from_row(row_key, row)
 
     @classmethod
-    def create(cls, batch=None, **kwargs):
+    def create(cls, batch=None, index_batches=None, **kwargs):
         instance = cls(**kwargs)
-        instance.save(batch=batch)
+        instance.save(batch=batch, index_batches=index_batches)
         return instance
 
     @classmethod
     def batch_create(cls, batch_data):
         table = cls.get_table()
         batch = table.batch()
+        index_batches = cls.get_index_batches()
         results = []
         for data in batch_data:
-            results.append(cls.create(batch=batch, **data))
+            results.append(cls.create(batch=batch, index_batches=index_batches, **data))
         batch.send()
+        for index_batch in index_batches.values():
+            index_batch.send()
         return results
 
+    @classmethod
+    def get_indexes(cls):
+        return getattr(cls.Meta, 'indexes', {})
+
+    @classmethod
+    def get_index_table_name(cls, index_name):
+        return '{}_index_{}'.format(cls.get_table_name(), index_name)
+
+    @classmethod
+    def get_index_table(cls, index_name):
+        conn = HBaseClient.get_connection()
+        return conn.table(cls.get_index_table_name(index_name))
+
+    @classmethod
+    def get_index_batches(cls):
+        return {
+            index_name: cls.get_index_table(index_name).batch()
+            for index_name in cls.get_indexes()
+        }
+
+    @classmethod
+    def rebuild_indexes(cls, batch_size=1000):
+        """
+        write the index rows of every row in the table, for the rows saved
+        before an index was added. returns the number of rows scanned
+        """
+        index_batches = {
+            index_name: cls.get_index_table(index_name).batch(batch_size=batch_size)
+            for index_name in cls.get_indexes()
+        }
+        total = 0
+        for row_key, row_data in cls.get_table().scan(batch_size=batch_size):
+            instance = cls.init_from_row(row_key, row_data)
+            instance._save_index_rows(cls.serialize_row_data(instance.__dict__), index_batches)
+            total += 1
+        for index_batch in index_batches.values():
+            index_batch.send()
+        return total
+
+    @classmethod
+    def serialize_index_key(cls, index_name, data):
+        """
+        same format as the row key, in the order of the index fields
+        {key1: val1, key2: val2} => b"val1:val2"
+        """
+        field_hash = cls.get_field_hash()
+        values = []
+        for key in cls.get_indexes()[index_name]:
+            value = data.get(key)
+            if value is None:
+                raise BadRowKeyError(f"{key} is missing in index {index_name}")
+            values.append(cls.serialize_field(field_hash[key], value))
+        return bytes(':'.join(values), encoding='utf-8')
+
+    @classmethod
+    def get_by_index(cls, index_name, **kwargs):
+        """
+        HBaseFollowing.get_by_index('to_user', from_user_id=1, to_user_id=2)
+        returns None if there is no such row
+        """
+        index_row_key = cls.serialize_index_key(index_name, kwargs)
+        row = dict(cls.get_index_table(index_name).row(index_row_key))
+        row_key = row.pop(INDEX_ROW_KEY_COLUMN.encode('utf-8'), None)
+        if row_key is None:
+            return None
+        return cls.init_from_row(row_key, row)
+
     @classmethod
     def get_table_name(cls):
         if not cls.Meta.table_name:
@@ -170,6 +273,8 @@ class HBaseModel:
             raise Exception('You can not drop table outside of unit tests')
         conn = HBaseClient.get_connection()
         conn.delete_table(cls.get_table_name(), True)
+        for index_name in cls.get_indexes():
+            conn.delete_table(cls.get_index_table_name(index_name), True)
 
     @classmethod
     def create_table(cls):
@@ -177,15 +282,20 @@ class HBaseModel:
             raise Exception('You can not create table outside of unit tests')
         conn = HBaseClient.get_connection()
         tables = [table.decode('utf-8') for table in conn.tables()]
-        if cls.get_table_name() in tables:
-            return
         column_families = {
             field.column_family: dict()
             for key, field in cls.get_field_hash().items()
             if field.column_family is not None
         }
-        conn.create_table(cls.get_table_name(), column_families)
+        if cls.get_table_name() not in tables:
+            conn.create_table(cls.get_table_name(), column_families)
 
+        index_column_families = dict(column_families)
+        index_column_families[INDEX_COLUMN_FAMILY] = dict()
+        for index_name in cls.get_indexes():
+            if cls.get_index_table_name(index_name) in tables:
+                continue
+            conn.create_table(cls.get_index_table_name(index_name), index_column_families)
 
     @classmethod
     def serialize_row_key_from_tuple(cls, row_key_tuple):
@@ -216,7 +326,43 @@ class HBaseModel:
         return results
 
     @classmethod
-    def delete(cls, **kwargs):
+    def delete(cls, batch=None, index_batches=None, **kwargs):
+        """
+        for models with indexes pass the indexed fields as well,
+        otherwise the row is read first to find its index rows
+        """
         row_key = cls.serialize_row_key(kwargs)
+        cls._delete_index_rows(row_key, kwargs, index_batches)
+        if batch:
+            return batch.delete(row_key)
         table = cls.get_table()
         return table.delete(row_key)
+
+    @classmethod
+    def _delete_index_rows(cls, row_key, data, index_batches=None):
+        indexes = cls.get_indexes()
+        if not indexes:
+            return
+        fields = set(field for index_fields in indexes.values() for field in index_fields)
+        if any(data.get(field) is None for field in fields):
+            instance = cls.init_from_row(row_key, cls.get_table().row(row_key))
+            if instance is None:
+                return
+            data = instance.__dict__
+        for index_name in indexes:
+            batch = index_batches and index_batches.get(index_name)
+            target = batch or cls.get_index_table(index_name)
+            target.delete(cls.serialize_index_key(index_name, data))
+
+    @classmethod
+    def batch_delete(cls, batch_data):
+        table = cls.get_table()
+        batch = table.batch()
+        index_batches = cls.get_index_batches()
+        for data in batch_data:
+            cls.delete(batch=batch, index_batches=index_batches, **data)
+        # drop the index rows first so that they never point to a deleted row
+        for index_batch in index_batches.values():
+            index_batch.send()
+        batch.send()
+        return len(batch_data)
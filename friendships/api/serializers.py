@@ -1,5 +1,6 @@
 from accounts.api.serializers import UserSerializerForFriendship
 from accounts.services import UserService
+from friendships.constants import BATCH_FOLLOW_LIMIT
 from friendships.models import Friendship
 from friendships.services import FriendshipService
 from rest_framework import serializers
@@ -32,16 +33,40 @@ class BaseFriendshipSerializer(serializers.Serializer):
         return user_id_set
 
     def get_has_followed(self, obj):
+        # set by the views for the whole page, see FriendshipService.get_followed_user_ids
+        followed_user_ids = self.context.get('followed_user_ids')
+        if followed_user_ids is not None:
+            return self.get_user_id(obj) in followed_user_ids
         return self.get_user_id(obj) in self._get_following_user_id_set()
 
     def get_user(self, obj):
-        user = UserService.get_user_by_id(self.get_user_id(obj))
-        return UserSerializerForFriendship(user).data
+        # prefetched by the views for the whole page
+        users = self.context.get('users', {})
+        user_id = self.get_user_id(obj)
+        if user_id in users:
+            user = users[user_id]
+        else:
+            user = UserService.get_user_by_id(user_id)
+        return UserSerializerForFriendship(user, context=self.context).data
 
     def get_created_at(self, obj):
         return obj.created_at
 
 
+class FollowRecommendationSerializer(serializers.Serializer):
+    """
+    serializes (user, mutual_count) pairs from FriendshipRecommendationService
+    """
+    user = serializers.SerializerMethodField()
+    mutual_count = serializers.SerializerMethodField()
+
+    def get_user(self, obj):
+        return UserSerializerForFriendship(obj[0], context=self.context).data
+
+    def get_mutual_count(self, obj):
+        return obj[1]
+
+
 class FriendshipSerializerForCreate(serializers.ModelSerializer):
     from_user_id = serializers.IntegerField()
     to_user_id = serializers.IntegerField()
@@ -66,6 +91,14 @@ class FriendshipSerializerForCreate(serializers.ModelSerializer):
         )
 
 
+class FriendshipSerializerForBatch(serializers.Serializer):
+    user_ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=BATCH_FOLLOW_LIMIT,
+    )
+
+
 class FollowerSerializer(BaseFriendshipSerializer):
     def get_user_id(self, obj):
         return obj.from_user_id
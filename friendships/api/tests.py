@@ -1,4 +1,5 @@
-from friendships.services import FriendshipService
+from friendships.services import FriendshipRecommendationService, FriendshipService
+from newsfeeds.services import NewsFeedService
 from rest_framework.test import APIClient
 from testing.testcases import TestCase
 from utils.paginations import EndlessPagination
@@ -8,6 +9,10 @@ FOLLOW_URL = '/api/friendships/{}/follow/'
 UNFOLLOW_URL = '/api/friendships/{}/unfollow/'
 FOLLOWERS_URL = '/api/friendships/{}/followers/'
 FOLLOWINGS_URL = '/api/friendships/{}/followings/'
+BATCH_FOLLOW_URL = '/api/friendships/batch_follow/'
+BATCH_UNFOLLOW_URL = '/api/friendships/batch_unfollow/'
+RECOMMENDATIONS_URL = '/api/friendships/recommendations/'
+MUTUAL_FOLLOWERS_URL = '/api/friendships/{}/mutual_followers/'
 
 
 class FriendshipApiTests(TestCase):
@@ -133,6 +138,8 @@ class FriendshipApiTests(TestCase):
             response.data['results'][1]['user']['username'],
             'eliza_follower0',
         )
+        self.assertEqual(response.data['results'][0]['user']['followers_count'], 0)
+        self.assertEqual(response.data['results'][0]['user']['followings_count'], 1)
 
     def test_followers_pagination(self):
         page_size = EndlessPagination.page_size
@@ -202,6 +209,106 @@ class FriendshipApiTests(TestCase):
         for result, friendship in zip(response.data['results'], reversed(new_friendships)):
             self.assertEqual(result['created_at'], friendship.created_at)
 
+    def test_batch_follow_and_unfollow(self):
+        users = [self.create_user('user{}'.format(i)) for i in range(3)]
+        user_ids = [user.id for user in users]
+        self.create_friendship(self.jesse, users[0])
+        tweet = self.create_tweet(users[1])
+
+        response = self.anonymous_client.post(BATCH_FOLLOW_URL, {'user_ids': user_ids})
+        self.assertEqual(response.status_code, 403)
+        response = self.jesse_client.post(BATCH_FOLLOW_URL, {'user_ids': []})
+        self.assertEqual(response.status_code, 400)
+
+        # self, unknown and already followed users are skipped
+        response = self.jesse_client.post(BATCH_FOLLOW_URL, {
+            'user_ids': user_ids + [self.jesse.id, 0],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['followed'], user_ids[1:])
+        self.assertEqual(
+            FriendshipService.get_following_user_id_set(self.jesse.id),
+            set(user_ids),
+        )
+        self.assertEqual(FriendshipService.get_follower_ids(users[1].id), [self.jesse.id])
+        # tweets of the new followings are backfilled
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.jesse.id)
+        self.assertEqual([newsfeed.tweet_id for newsfeed in newsfeeds], [tweet.id])
+
+        response = self.jesse_client.post(BATCH_UNFOLLOW_URL, {
+            'user_ids': [users[0].id, users[1].id, self.eliza.id],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['unfollowed'], [users[0].id, users[1].id])
+        self.assertEqual(
+            FriendshipService.get_following_user_id_set(self.jesse.id),
+            {users[2].id},
+        )
+        self.assertEqual(FriendshipService.get_follower_ids(users[1].id), [])
+        self.assertEqual(NewsFeedService.get_cached_newsfeeds(self.jesse.id), [])
+
+    def test_recommendations(self):
+        response = self.anonymous_client.get(RECOMMENDATIONS_URL)
+        self.assertEqual(response.status_code, 403)
+
+        # nothing to recommend before following anyone
+        response = self.jesse_client.get(RECOMMENDATIONS_URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+
+        # jesse follows eliza and one of eliza's followings
+        followings = [self.create_user('following{}'.format(i)) for i in range(2)]
+        self.create_friendship(self.jesse, self.eliza)
+        self.create_friendship(self.jesse, followings[0])
+        for following in followings:
+            self.create_friendship(self.eliza, following)
+        self.create_friendship(followings[0], followings[1])
+        FriendshipRecommendationService.refresh_dirty_recommendations()
+
+        response = self.jesse_client.get(RECOMMENDATIONS_URL)
+        results = response.data['results']
+        self.assertEqual(results[0]['user']['id'], followings[1].id)
+        self.assertEqual(results[0]['mutual_count'], 2)
+        self.assertEqual(len(results), 4)
+        user_ids = set(result['user']['id'] for result in results)
+        self.assertNotIn(self.jesse.id, user_ids)
+        self.assertNotIn(self.eliza.id, user_ids)
+        self.assertNotIn(followings[0].id, user_ids)
+
+        # followed since the last refresh
+        self.create_friendship(self.jesse, followings[1])
+        response = self.jesse_client.get(RECOMMENDATIONS_URL)
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_mutual_followers(self):
+        url = MUTUAL_FOLLOWERS_URL.format(self.eliza.id)
+        response = self.anonymous_client.get(url)
+        self.assertEqual(response.status_code, 403)
+
+        response = self.jesse_client.get(url)
+        self.assertEqual(response.data['count'], 0)
+
+        followers = [self.create_user('follower{}'.format(i)) for i in range(3)]
+        for follower in followers:
+            self.create_friendship(follower, self.eliza)
+        self.create_friendship(self.jesse, followers[0])
+        self.create_friendship(self.jesse, followers[2])
+
+        response = self.jesse_client.get(url)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(
+            [user['id'] for user in response.data['results']],
+            [followers[0].id, followers[2].id],
+        )
+
+        self.create_friendship(self.jesse, followers[1])
+        FriendshipService.unfollow(followers[0].id, self.eliza.id)
+        response = self.jesse_client.get(url)
+        self.assertEqual(
+            [user['id'] for user in response.data['results']],
+            [followers[1].id, followers[2].id],
+        )
+
     def _paginate_until_the_end(self, url, expect_pages, friendships):
         results, pages = [], 0
         response = self.anonymous_client.get(url)
@@ -1,13 +1,16 @@
 from django.contrib.auth.models import User
 from django.utils.decorators import method_decorator
+from accounts.api.serializers import UserSerializerForFriendship
+from accounts.services import UserService
 from friendships.api.serializers import (
     FollowerSerializer,
+    FollowRecommendationSerializer,
+    FriendshipSerializerForBatch,
     FollowingSerializer,
     FriendshipSerializerForCreate,
 )
 from friendships.models import HBaseFollowing, HBaseFollower, Friendship
-from friendships.services import FriendshipService
-from gatekeeper.models import GateKeeper
+from friendships.services import FriendshipRecommendationService, FriendshipService
 from ratelimit.decorators import ratelimit
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
@@ -15,33 +18,57 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from utils.paginations import EndlessPagination
 
+RECOMMENDATIONS_LIMIT = 20
+
 
 class FriendshipViewSet(viewsets.GenericViewSet):
     queryset = User.objects.all()
     pagination_class = EndlessPagination
 
+    def _get_page_context(self, request, user_ids):
+        """
+        everything the serializers need for the users of a page,
+        loaded in batch instead of once per user
+        """
+        if request.user.is_anonymous:
+            followed_user_ids = set()
+        else:
+            followed_user_ids = FriendshipService.get_followed_user_ids(request.user.id, user_ids)
+        return {
+            'request': request,
+            'users': UserService.get_users_with_profiles_through_cache(user_ids),
+            'followed_user_ids': followed_user_ids,
+            'social_counts': FriendshipService.get_social_counts(user_ids),
+        }
+
     @action(methods=['GET'], detail=True, permission_classes=[AllowAny])
     @method_decorator(ratelimit(key='user_or_ip', rate='3/s', method='GET', block=True))
     def followers(self, request, pk):
-        if GateKeeper.is_switch_on('switch_friendship_to_hbase'):
+        if FriendshipService.reads_from_hbase(pk):
             page = self.paginator.paginate_hbase(HBaseFollower, (pk,), request)
         else:
             friendships = Friendship.objects.filter(to_user_id=pk).order_by('-created_at')
             page = self.paginate_queryset(friendships)
 
-        serializer = FollowerSerializer(page, many=True, context={'request': request})
+        serializer = FollowerSerializer(page, many=True, context=self._get_page_context(
+            request,
+            [friendship.from_user_id for friendship in page],
+        ))
         return self.paginator.get_paginated_response(serializer.data)
 
     @action(methods=['GET'], detail=True, permission_classes=[AllowAny])
     @method_decorator(ratelimit(key='user_or_ip', rate='3/s', method='GET', block=True))
     def followings(self, request, pk):
-        if GateKeeper.is_switch_on('switch_friendship_to_hbase'):
+        if FriendshipService.reads_from_hbase(pk):
             page = self.paginator.paginate_hbase(HBaseFollowing, (pk,), request)
         else:
             friendships = Friendship.objects.filter(from_user_id=pk).order_by('-created_at')
             page = self.paginate_queryset(friendships)
 
-        serializer = FollowingSerializer(page, many=True, context={'request': request})
+        serializer = FollowingSerializer(page, many=True, context=self._get_page_context(
+            request,
+            [friendship.to_user_id for friendship in page],
+        ))
         return self.paginator.get_paginated_response(serializer.data)
 
     @action(methods=['POST'], detail=True, permission_classes=[IsAuthenticated])
@@ -74,3 +101,74 @@ class FriendshipViewSet(viewsets.GenericViewSet):
             }, status=status.HTTP_400_BAD_REQUEST)
         deleted = FriendshipService.unfollow(request.user.id, int(pk))
         return Response({'success': True, 'deleted': deleted})
+
+    @action(methods=['POST'], detail=False, permission_classes=[IsAuthenticated])
+    @method_decorator(ratelimit(key='user', rate='1/s', method='POST', block=True))
+    def batch_follow(self, request):
+        serializer = FriendshipSerializerForBatch(data=request.data)
+        if not serializer.is_valid():
+            return Response({
+                'success': False,
+                'errors': serializer.errors,
+            }, status=status.HTTP_400_BAD_REQUEST)
+        followed = FriendshipService.batch_follow(
+            request.user.id,
+            serializer.validated_data['user_ids'],
+        )
+        return Response({
+            'success': True,
+            'followed': followed,
+        }, status=status.HTTP_201_CREATED)
+
+    @action(methods=['POST'], detail=False, permission_classes=[IsAuthenticated])
+    @method_decorator(ratelimit(key='user', rate='1/s', method='POST', block=True))
+    def batch_unfollow(self, request):
+        serializer = FriendshipSerializerForBatch(data=request.data)
+        if not serializer.is_valid():
+            return Response({
+                'success': False,
+                'errors': serializer.errors,
+            }, status=status.HTTP_400_BAD_REQUEST)
+        unfollowed = FriendshipService.batch_unfollow(
+            request.user.id,
+            serializer.validated_data['user_ids'],
+        )
+        return Response({'success': True, 'unfollowed': unfollowed})
+
+    @action(methods=['GET'], detail=False, permission_classes=[IsAuthenticated])
+    @method_decorator(ratelimit(key='user', rate='3/s', method='GET', block=True))
+    def recommendations(self, request):
+        recommendations = FriendshipRecommendationService.get_recommendations(
+            request.user.id,
+            RECOMMENDATIONS_LIMIT,
+        )
+        context = self._get_page_context(
+            request,
+            [user_id for user_id, _ in recommendations],
+        )
+        users = context['users']
+        serializer = FollowRecommendationSerializer([
+            (users[user_id], mutual_count)
+            for user_id, mutual_count in recommendations
+            if user_id in users
+        ], many=True, context=context)
+        return Response({'results': serializer.data})
+
+    @action(methods=['GET'], detail=True, permission_classes=[IsAuthenticated])
+    @method_decorator(ratelimit(key='user', rate='3/s', method='GET', block=True))
+    def mutual_followers(self, request, pk):
+        user_ids = FriendshipRecommendationService.get_mutual_follower_ids(
+            request.user.id,
+            int(pk),
+        )
+        context = self._get_page_context(request, user_ids[:RECOMMENDATIONS_LIMIT])
+        users = context['users']
+        serializer = UserSerializerForFriendship(
+            [users[user_id] for user_id in user_ids if user_id in users],
+            many=True,
+            context=context,
+        )
+        return Response({
+            'count': len(user_ids),
+            'results': serializer.data,
+        })
@@ -0,0 +1,27 @@
+from django.conf import settings
+
+# followings bloom filter, 64k bits (8KB) per user keeps the false positive
+# rate around 1% up to ~6000 followings with 7 hash functions
+FOLLOWINGS_BLOOM_FILTER_BITS = 2 ** 16 if not settings.TESTING else 2 ** 10
+FOLLOWINGS_BLOOM_FILTER_HASHES = 7
+
+# friends of friends recommendations, see FriendshipRecommendationService
+RECOMMENDATION_FOLLOWINGS_SAMPLE_SIZE = 200 if not settings.TESTING else 5
+RECOMMENDATION_LIST_LENGTH = 100 if not settings.TESTING else 10
+RECOMMENDATION_REFRESH_BATCH_SIZE = 1000
+# a missing list is refreshed at most once per this many seconds, users
+# following nobody have no list at all
+RECOMMENDATION_REFRESHING_TIMEOUT = 60
+
+BATCH_FOLLOW_LIMIT = 500
+
+# followings checked against the database for mutual followers while the
+# followers set of the other user is being loaded
+MUTUAL_FOLLOWERS_FALLBACK_LIMIT = 1000
+
+# follower/following counters, see FriendshipService.get_social_counts
+SOCIAL_COUNT_ATTRS = ('followers_count', 'followings_count')
+SOCIAL_COUNTS_WRITE_BACK_BATCH_SIZE = 1000
+
+# friendships read from mysql per query by the graph export
+GRAPH_EXPORT_BATCH_SIZE = 10000
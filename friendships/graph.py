@@ -0,0 +1,224 @@
+"""
+compact CSR (compressed sparse row) snapshot of the friendship graph
+
+file layout, little endian:
+    magic       8 bytes  b'FGRAPH01'
+    num_nodes   int64    max user id + 1, users are indexed by id
+    num_edges   int64
+    offsets     int64 * (num_nodes + 1)
+    neighbors   int32 * num_edges, sorted for every node
+
+the neighbors of user u are neighbors[offsets[u]:offsets[u + 1]]. the file
+is memory-mapped by FriendshipGraph, so a graph with tens of millions of
+edges costs no python object per edge.
+"""
+from array import array
+from bisect import bisect_left
+from django.contrib.auth.models import User
+from django.db.models import Max
+from friendships.constants import GRAPH_EXPORT_BATCH_SIZE
+from friendships.models import Friendship, HBaseFollowing
+from gatekeeper.models import GateKeeper
+
+import mmap
+import os
+import struct
+import sys
+
+MAGIC = b'FGRAPH01'
+HEADER = struct.Struct('<8sqq')
+OFFSET_SIZE = 8
+NEIGHBOR_SIZE = 4
+
+
+def _iter_mysql_friendships():
+    # paged by primary key, mysqlclient buffers the whole result set of a
+    # query even with iterator()
+    last_id = 0
+    while True:
+        rows = list(Friendship.objects.filter(
+            id__gt=last_id,
+        ).order_by('id').values_list('id', 'from_user_id', 'to_user_id')[:GRAPH_EXPORT_BATCH_SIZE])
+        if not rows:
+            return
+        for _, from_user_id, to_user_id in rows:
+            yield from_user_id, to_user_id
+        last_id = rows[-1][0]
+
+
+def iter_friendship_edges(direction='followings'):
+    """
+    stream every (node, neighbor) pair from mysql or hbase,
+    followings: from_user_id -> to_user_id, followers: to_user_id -> from_user_id
+    """
+    if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
+        rows = _iter_mysql_friendships()
+    else:
+        rows = (
+            (following.from_user_id, following.to_user_id)
+            for following in (
+                HBaseFollowing.init_from_row(row_key, row_data)
+                for row_key, row_data in HBaseFollowing.get_table().scan(batch_size=10000)
+            )
+        )
+    for from_user_id, to_user_id in rows:
+        if direction == 'followings':
+            yield from_user_id, to_user_id
+        else:
+            yield to_user_id, from_user_id
+
+
+def iter_exported_edges(num_nodes, direction):
+    # users who signed up after num_nodes was read are left out of the snapshot
+    # and the friendships of deleted users have a null id
+    for node, neighbor in iter_friendship_edges(direction):
+        if node is None or neighbor is None:
+            continue
+        if node < num_nodes and neighbor < num_nodes:
+            yield node, neighbor
+
+
+def export_friendship_graph(path, direction='followings'):
+    """
+    write the graph to path in two streaming passes over the edges, the
+    first one counts the degrees and the second one fills the neighbors in
+    place through mmap. returns (num_nodes, num_edges).
+
+    the snapshot is only as consistent as the underlying scans. edges of
+    users created during the export are skipped, edges created between the
+    passes are dropped when their node is full, and the slots of edges
+    deleted between the passes are compacted away at the end.
+    """
+    if sys.byteorder != 'little':
+        raise ValueError('friendship graph files can only be written on little endian hosts')
+    num_nodes = (User.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+
+    # pass 1, degrees
+    degrees = array('q', bytes(OFFSET_SIZE * num_nodes))
+    num_edges = 0
+    for node, _ in iter_exported_edges(num_nodes, direction):
+        degrees[node] += 1
+        num_edges += 1
+
+    offsets = array('q', bytes(OFFSET_SIZE * (num_nodes + 1)))
+    for node in range(num_nodes):
+        offsets[node + 1] = offsets[node] + degrees[node]
+    del degrees
+
+    neighbors_start = HEADER.size + OFFSET_SIZE * (num_nodes + 1)
+    file_size = neighbors_start + NEIGHBOR_SIZE * num_edges
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, num_nodes, num_edges))
+        f.write(offsets.tobytes())
+        f.truncate(file_size)
+
+    # pass 2, neighbors
+    if num_edges:
+        with open(tmp_path, 'r+b') as f:
+            with mmap.mmap(f.fileno(), 0) as mm:
+                neighbors = memoryview(mm)[neighbors_start:].cast('i')
+                filled = array('q', offsets)
+                for node, neighbor in iter_exported_edges(num_nodes, direction):
+                    if filled[node] >= offsets[node + 1]:
+                        continue
+                    neighbors[filled[node]] = neighbor
+                    filled[node] += 1
+
+                # sort every node and move it down over the unfilled slots
+                # of the nodes before it, offsets become the compacted ones
+                written = 0
+                for node in range(num_nodes):
+                    start, end = offsets[node], filled[node]
+                    node_neighbors = array('i', sorted(neighbors[start:end]))
+                    offsets[node] = written
+                    neighbors[written:written + len(node_neighbors)] = node_neighbors
+                    written += len(node_neighbors)
+                offsets[num_nodes] = written
+                neighbors.release()
+                mm.flush()
+
+            if written != num_edges:
+                num_edges = written
+                f.seek(0)
+                f.write(HEADER.pack(MAGIC, num_nodes, num_edges))
+                f.write(offsets.tobytes())
+                f.truncate(neighbors_start + NEIGHBOR_SIZE * num_edges)
+
+    os.replace(tmp_path, path)
+    return num_nodes, num_edges
+
+
+class FriendshipGraph:
+    """
+    read only view of a file written by export_friendship_graph
+
+        with FriendshipGraph(path) as graph:
+            graph.neighbors(user_id)
+            graph.intersection(user_id, other_user_id)
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.num_nodes, self.num_edges = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('{} is not a friendship graph file'.format(path))
+        if sys.byteorder != 'little':
+            self.close()
+            raise ValueError('friendship graph files can only be mapped on little endian hosts')
+
+        view = memoryview(self._mmap)
+        neighbors_start = HEADER.size + OFFSET_SIZE * (self.num_nodes + 1)
+        self._offsets = view[HEADER.size:neighbors_start].cast('q')
+        self._neighbors = view[neighbors_start:].cast('i')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        for view in ['_offsets', '_neighbors']:
+            if hasattr(self, view):
+                getattr(self, view).release()
+        self._mmap.close()
+        self._file.close()
+
+    def neighbors(self, user_id):
+        """
+        sorted neighbor ids as a memoryview into the mapped file
+        """
+        if user_id < 0 or user_id >= self.num_nodes:
+            return self._neighbors[0:0]
+        return self._neighbors[self._offsets[user_id]:self._offsets[user_id + 1]]
+
+    def degree(self, user_id):
+        return len(self.neighbors(user_id))
+
+    def has_edge(self, user_id, neighbor_id):
+        neighbors = self.neighbors(user_id)
+        index = bisect_left(neighbors, neighbor_id)
+        return index < len(neighbors) and neighbors[index] == neighbor_id
+
+    def intersection(self, user_id, other_user_id):
+        """
+        common neighbors of two users, merged from the sorted neighbor lists
+        """
+        a, b = self.neighbors(user_id), self.neighbors(other_user_id)
+        i, j, common = 0, 0, []
+        while i < len(a) and j < len(b):
+            if a[i] < b[j]:
+                i += 1
+            elif a[i] > b[j]:
+                j += 1
+            else:
+                common.append(a[i])
+                i += 1
+                j += 1
+        return common
+
+    def intersection_count(self, user_id, other_user_id):
+        return len(self.intersection(user_id, other_user_id))
@@ -0,0 +1,20 @@
+from friendships.models import Friendship, HBaseFollower, HBaseFollowing
+from utils.hbase_backfill import HBaseBackfill
+from utils.time_helpers import to_timestamp
+
+
+class FriendshipBackfill(HBaseBackfill):
+    name = 'friendships'
+    model_class = Friendship
+    fields = ('from_user_id', 'to_user_id', 'created_at')
+    required_fields = ('from_user_id', 'to_user_id')
+    hbase_model_classes = (HBaseFollowing, HBaseFollower)
+
+    @classmethod
+    def to_hbase_data(cls, row):
+        # the same created_at as FriendshipService uses for dual writes
+        return {
+            'from_user_id': row['from_user_id'],
+            'to_user_id': row['to_user_id'],
+            'created_at': to_timestamp(row['created_at']),
+        }
@@ -0,0 +1,7 @@
+from friendships.hbase_backfill import FriendshipBackfill
+from utils.hbase_backfill import HBaseBackfillCommand
+
+
+class Command(HBaseBackfillCommand):
+    help = 'Copy the mysql friendships into HBaseFollowing and HBaseFollower'
+    backfill_class = FriendshipBackfill
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from friendships.constants import SOCIAL_COUNTS_WRITE_BACK_BATCH_SIZE
+from friendships.services import FriendshipService
+
+
+class Command(BaseCommand):
+    help = 'Count the followers and followings of the profiles never counted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SOCIAL_COUNTS_WRITE_BACK_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        total = FriendshipService.backfill_social_counts(options['batch_size'])
+        self.stdout.write('{} profiles backfilled'.format(total))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from friendships.graph import export_friendship_graph
+
+
+class Command(BaseCommand):
+    help = 'Export the friendship graph into a memory-mappable CSR file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument(
+            '--direction',
+            choices=['followings', 'followers'],
+            default='followings',
+        )
+
+    def handle(self, *args, **options):
+        num_nodes, num_edges = export_friendship_graph(
+            options['path'],
+            direction=options['direction'],
+        )
+        self.stdout.write('{} nodes and {} edges written to {}'.format(
+            num_nodes,
+            num_edges,
+            options['path'],
+        ))
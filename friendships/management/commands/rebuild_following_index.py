@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from friendships.models import HBaseFollowing
+
+
+class Command(BaseCommand):
+    help = 'Write the to_user index rows of the HBaseFollowing rows saved before the index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = HBaseFollowing.rebuild_indexes(options['batch_size'])
+        self.stdout.write('{} rows indexed'.format(total))
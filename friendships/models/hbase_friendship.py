@@ -0,0 +1,38 @@
+from django_hbase import models
+
+
+class HBaseFollowing(models.HBaseModel):
+    """
+    store the users that from_user_id followed,
+    row_key sorted by from_user_id + created_at
+    """
+    from_user_id = models.IntegerField(reverse=True)
+    created_at = models.TimestampField()
+    to_user_id = models.IntegerField(column_family='cf')
+
+    class Meta:
+        table_name = 'twitter_followings'
+        row_key = ('from_user_id', 'created_at')
+        indexes = {
+            'to_user': ('from_user_id', 'to_user_id'),
+        }
+
+    def __str__(self):
+        return '{} followed {}'.format(self.from_user_id, self.to_user_id)
+
+
+class HBaseFollower(models.HBaseModel):
+    """
+    store the followers of to_user_id,
+    row_key sorted by to_user_id + created_at
+    """
+    to_user_id = models.IntegerField(reverse=True)
+    created_at = models.TimestampField()
+    from_user_id = models.IntegerField(column_family='cf')
+
+    class Meta:
+        table_name = 'twitter_followers'
+        row_key = ('to_user_id', 'created_at')
+
+    def __str__(self):
+        return '{} followed {}'.format(self.from_user_id, self.to_user_id)
@@ -1,37 +1,263 @@
+from accounts.models import UserProfile
+from accounts.services import UserService
 from django.conf import settings
+from django.contrib.auth.models import User
 from django.core.cache import caches
+from django.db.models import F, Q
+from friendships.constants import (
+    FOLLOWINGS_BLOOM_FILTER_BITS,
+    FOLLOWINGS_BLOOM_FILTER_HASHES,
+    MUTUAL_FOLLOWERS_FALLBACK_LIMIT,
+    RECOMMENDATION_FOLLOWINGS_SAMPLE_SIZE,
+    RECOMMENDATION_LIST_LENGTH,
+    RECOMMENDATION_REFRESH_BATCH_SIZE,
+    RECOMMENDATION_REFRESHING_TIMEOUT,
+    SOCIAL_COUNT_ATTRS,
+    SOCIAL_COUNTS_WRITE_BACK_BATCH_SIZE,
+)
 from friendships.models import HBaseFollowing, HBaseFollower, Friendship
+from friendships.tasks import (
+    load_followers_key_task,
+    rebuild_followings_bloom_filter_task,
+    refresh_follow_recommendations_task,
+)
 from gatekeeper.models import GateKeeper
-from twitter.cache import FOLLOWINGS_PATTERN
+from gatekeeper.shadow_reads import ShadowRead
+from twitter.cache import (
+    FOLLOW_RECOMMENDATIONS_DIRTY_USERS_KEY,
+    FOLLOWINGS_PATTERN,
+    SOCIAL_COUNTS_DIRTY_USERS_KEY,
+    USER_FOLLOW_RECOMMENDATIONS_PATTERN,
+    USER_FOLLOWERS_PATTERN,
+    USER_FOLLOWINGS_BLOOM_FILTER_PATTERN,
+    USER_FOLLOWINGS_PATTERN,
+    USER_SOCIAL_COUNT_PATTERN,
+)
+from utils.bloom_filter import RedisBloomFilter
+from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
+from utils.time_constants import ONE_HOUR
+from utils.time_helpers import to_timestamp
 
 import time
 
 cache = caches['testing'] if settings.TESTING else caches['default']
 
+# redis drops empty sets, so every loaded followings/followers set keeps this
+# member to tell "follows nobody" apart from "not cached yet". no user has id 0.
+USER_ID_SET_SENTINEL = 0
+
 
 class FriendshipService(object):
 
+    @classmethod
+    def reads_from_hbase(cls, user_id):
+        """
+        reads move to hbase user by user with the percent of the switch once
+        the dual writes keep hbase in sync, writes only move at 100
+        """
+        return ShadowRead.reads_from_hbase('friendship', user_id)
+
     @classmethod
     def get_follower_ids(cls, to_user_id):
-        if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
-            friendships = Friendship.objects.filter(to_user_id=to_user_id)
-        else:
-            friendships = HBaseFollower.filter(prefix=(to_user_id, None))
-        return [friendship.from_user_id for friendship in friendships]
+        return ShadowRead.read(
+            'friendship',
+            to_user_id,
+            lambda: [
+                friendship.from_user_id
+                for friendship in Friendship.objects.filter(to_user_id=to_user_id)
+            ],
+            lambda: [
+                friendship.from_user_id
+                for friendship in HBaseFollower.filter(prefix=(to_user_id, None))
+            ],
+            normalize=sorted,
+        )
+
+    @classmethod
+    def _load_following_user_ids(cls, from_user_id):
+        return ShadowRead.read(
+            'friendship',
+            from_user_id,
+            lambda: [fs.to_user_id for fs in Friendship.objects.filter(from_user_id=from_user_id)],
+            lambda: [fs.to_user_id for fs in HBaseFollowing.filter(prefix=(from_user_id, None))],
+            normalize=sorted,
+        )
+
+    @classmethod
+    def _load_user_id_set(cls, key, load_user_ids):
+        """
+        make sure the redis set of user ids at key is cached,
+        load_user_ids is only called if it is not
+        """
+        return RedisHelper.load_set(
+            key,
+            lambda: [USER_ID_SET_SENTINEL] + list(load_user_ids()),
+        )
+
+    @classmethod
+    def get_followings_key(cls, from_user_id):
+        """
+        key of the redis set holding the ids from_user_id follows,
+        the set is loaded from the database if it is not cached yet
+        """
+        return cls._load_user_id_set(
+            USER_FOLLOWINGS_PATTERN.format(user_id=from_user_id),
+            lambda: cls._load_following_user_ids(from_user_id),
+        )
+
+    @classmethod
+    def get_followers_key(cls, to_user_id):
+        return cls._load_user_id_set(
+            USER_FOLLOWERS_PATTERN.format(user_id=to_user_id),
+            lambda: cls.get_follower_ids(to_user_id),
+        )
+
+    @classmethod
+    def warm_followers_key(cls, to_user_id):
+        """
+        load the followers set of to_user_id in the background,
+        one task at a time per user
+        """
+        conn = RedisClient.get_connection()
+        warming_key = USER_FOLLOWERS_PATTERN.format(user_id=to_user_id) + ':warming'
+        if conn.set(warming_key, 1, nx=True, ex=ONE_HOUR):
+            load_followers_key_task.delay(to_user_id)
+
+    @classmethod
+    def load_followers_key(cls, to_user_id):
+        key = cls.get_followers_key(to_user_id)
+        RedisClient.get_connection().delete(key + ':warming')
+        return key
+
+    @classmethod
+    def get_follower_ids_among(cls, to_user_id, from_user_ids):
+        """
+        the ids among from_user_ids who follow to_user_id, looked up in the
+        database with one query (or one index get per id in hbase)
+        """
+        from_user_ids = list(from_user_ids)
+        if not from_user_ids:
+            return []
+        return ShadowRead.read(
+            'friendship',
+            to_user_id,
+            lambda: list(Friendship.objects.filter(
+                to_user_id=to_user_id,
+                from_user_id__in=from_user_ids,
+            ).values_list('from_user_id', flat=True)),
+            lambda: [
+                from_user_id
+                for from_user_id in from_user_ids
+                if HBaseFollowing.get_by_index(
+                    'to_user',
+                    from_user_id=from_user_id,
+                    to_user_id=to_user_id,
+                ) is not None
+            ],
+            normalize=sorted,
+        )
 
     @classmethod
     def get_following_user_id_set(cls, from_user_id):
-        # <TODO> cache in redis set
-        if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
-            friendships = Friendship.objects.filter(from_user_id=from_user_id)
-        else:
-            friendships = HBaseFollowing.filter(prefix=(from_user_id, None))
-        user_id_set = set([
-            fs.to_user_id
-            for fs in friendships
-        ])
+        conn = RedisClient.get_connection()
+        key = cls.get_followings_key(from_user_id)
+        user_id_set = set(int(user_id) for user_id in conn.smembers(key))
+        user_id_set.discard(USER_ID_SET_SENTINEL)
         return user_id_set
 
+    @classmethod
+    def get_followings_bloom_filter(cls, from_user_id):
+        return RedisBloomFilter(
+            USER_FOLLOWINGS_BLOOM_FILTER_PATTERN.format(user_id=from_user_id),
+            FOLLOWINGS_BLOOM_FILTER_BITS,
+            FOLLOWINGS_BLOOM_FILTER_HASHES,
+        )
+
+    @classmethod
+    def rebuild_followings_bloom_filter(cls, from_user_id, building_key=None):
+        bloom_filter = cls.get_followings_bloom_filter(from_user_id)
+        return bloom_filter.rebuild(
+            lambda: cls._load_following_user_ids(from_user_id),
+            building_key=building_key,
+        )
+
+    @classmethod
+    def _filter_possibly_followed(cls, from_user_id, to_user_ids):
+        """
+        drop the ids the bloom filter says from_user_id definitely does not
+        follow, only used when the followings set has to be loaded from the
+        database. a missing filter is rebuilt in the background by a single
+        task and every id is kept until then. unfollowed ids stay in the
+        filter until the next rebuild, they are sorted out by the exact check.
+        """
+        bloom_filter = cls.get_followings_bloom_filter(from_user_id)
+        might_contain = bloom_filter.might_contain_many(to_user_ids)
+        if might_contain is None:
+            building_key = bloom_filter.start_rebuild()
+            if building_key is not None:
+                rebuild_followings_bloom_filter_task.delay(from_user_id, building_key)
+            return to_user_ids
+        return [to_user_id for to_user_id in to_user_ids if might_contain[to_user_id]]
+
+    @classmethod
+    def get_followed_user_ids(cls, from_user_id, to_user_ids):
+        """
+        the ids among to_user_ids that from_user_id follows, checked with
+        one round trip of SISMEMBER if the followings set is cached. if it
+        is not, the ids the bloom filter rules out skip loading it.
+        """
+        to_user_ids = [
+            to_user_id
+            for to_user_id in set(to_user_ids)
+            if to_user_id != from_user_id
+        ]
+        if not to_user_ids:
+            return set()
+
+        conn = RedisClient.get_connection()
+        key = USER_FOLLOWINGS_PATTERN.format(user_id=from_user_id)
+        pipe = conn.pipeline()
+        pipe.exists(key)
+        for to_user_id in to_user_ids:
+            pipe.sismember(key, to_user_id)
+        exists, *followed = pipe.execute()
+
+        if not exists:
+            to_user_ids = cls._filter_possibly_followed(from_user_id, to_user_ids)
+            if not to_user_ids:
+                return set()
+            key = cls.get_followings_key(from_user_id)
+            pipe = conn.pipeline()
+            for to_user_id in to_user_ids:
+                pipe.sismember(key, to_user_id)
+            followed = pipe.execute()
+
+        return set(
+            to_user_id
+            for to_user_id, is_followed in zip(to_user_ids, followed)
+            if is_followed
+        )
+
+    @classmethod
+    def _update_following_caches(cls, from_user_id, to_user_ids, followed):
+        """
+        add or remove the friendships in the cached followings/followers sets,
+        the sets that are not cached are left alone and will be lazy loaded.
+        one pipelined round trip whatever the number of friendships.
+        """
+        conn = RedisClient.get_connection()
+        followings_key = USER_FOLLOWINGS_PATTERN.format(user_id=from_user_id)
+        updates = [(followings_key, to_user_ids)] + [
+            (USER_FOLLOWERS_PATTERN.format(user_id=to_user_id), [from_user_id])
+            for to_user_id in to_user_ids
+        ]
+
+        pipe = conn.pipeline()
+        for key, user_ids in updates:
+            RedisHelper.update_set(key, 'SADD' if followed else 'SREM', user_ids, pipe)
+        pipe.execute()
+
     @classmethod
     def invalidate_following_cache(cls, from_user_id):
         key = FOLLOWINGS_PATTERN.format(user_id=from_user_id)
@@ -39,25 +265,55 @@ class FriendshipService(object):
 
     @classmethod
     def get_follow_instance(cls, from_user_id, to_user_id):
-        followings = HBaseFollowing.filter(prefix=(from_user_id, None))
-        for follow in followings:
-            if follow.to_user_id == to_user_id:
-                return follow
-        return None
+        # rows written before the index existed are indexed by the
+        # rebuild_following_index command
+        return HBaseFollowing.get_by_index(
+            'to_user',
+            from_user_id=from_user_id,
+            to_user_id=to_user_id,
+        )
 
     @classmethod
     def has_followed(cls, from_user_id, to_user_id):
-        if from_user_id == to_user_id:
-            return False
+        return to_user_id in cls.get_followed_user_ids(from_user_id, [to_user_id])
 
-        if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
-            return Friendship.objects.filter(
-                from_user_id=from_user_id,
-                to_user_id=to_user_id,
-            ).exists()
+    @classmethod
+    def is_dual_write_on(cls):
+        """
+        while friendships are still read from mysql, also write them to hbase
+        so that the tables stay in sync with the backfill until the switch
+        """
+        return GateKeeper.is_switch_on('dual_write_friendship_to_hbase')
 
-        instance = cls.get_follow_instance(from_user_id, to_user_id)
-        return instance is not None
+    @classmethod
+    def _create_hbase_friendships(cls, from_user_id, to_user_ids_with_created_at):
+        batch_data = [
+            {'from_user_id': from_user_id, 'to_user_id': to_user_id, 'created_at': created_at}
+            for to_user_id, created_at in to_user_ids_with_created_at
+        ]
+        HBaseFollower.batch_create(batch_data)
+        return HBaseFollowing.batch_create(batch_data)
+
+    @classmethod
+    def _delete_hbase_friendships(cls, from_user_id, to_user_ids):
+        instances = [
+            cls.get_follow_instance(from_user_id, to_user_id)
+            for to_user_id in to_user_ids
+        ]
+        instances = [instance for instance in instances if instance is not None]
+        HBaseFollowing.batch_delete([
+            {
+                'from_user_id': from_user_id,
+                'created_at': instance.created_at,
+                'to_user_id': instance.to_user_id,
+            }
+            for instance in instances
+        ])
+        HBaseFollower.batch_delete([
+            {'to_user_id': instance.to_user_id, 'created_at': instance.created_at}
+            for instance in instances
+        ])
+        return len(instances)
 
     @classmethod
     def follow(cls, from_user_id, to_user_id):
@@ -66,23 +322,27 @@ class FriendshipService(object):
 
         if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
             # create data in mysql
-            return Friendship.objects.create(
+            friendship = Friendship.objects.create(
                 from_user_id=from_user_id,
                 to_user_id=to_user_id,
             )
+            if cls.is_dual_write_on():
+                cls._create_hbase_friendships(from_user_id, [
+                    (to_user_id, to_timestamp(friendship.created_at)),
+                ])
+        else:
+            # create data in hbase
+            now = int(time.time() * 1000000)
+            friendship = cls._create_hbase_friendships(from_user_id, [(to_user_id, now)])[0]
 
-        # create data in hbase
-        now = int(time.time() * 1000000)
-        HBaseFollower.create(
-            from_user_id=from_user_id,
-            to_user_id=to_user_id,
-            created_at=now,
-        )
-        return HBaseFollowing.create(
-            from_user_id=from_user_id,
-            to_user_id=to_user_id,
-            created_at=now,
-        )
+        cls._update_following_caches(from_user_id, [to_user_id], followed=True)
+        cls._incr_social_counts(from_user_id, [to_user_id], 1)
+        cls.get_followings_bloom_filter(from_user_id).add([to_user_id])
+        FriendshipRecommendationService.mark_dirty(from_user_id)
+
+        from newsfeeds.tasks import backfill_newsfeeds_task
+        backfill_newsfeeds_task.delay(from_user_id, to_user_id)
+        return friendship
 
     @classmethod
     def unfollow(cls, from_user_id, to_user_id):
@@ -94,19 +354,413 @@ class FriendshipService(object):
                 from_user_id=from_user_id,
                 to_user_id=to_user_id,
             ).delete()
-            return deleted
+            if deleted and cls.is_dual_write_on():
+                cls._delete_hbase_friendships(from_user_id, [to_user_id])
+        else:
+            # cheap membership check before looking up the row in hbase
+            if not cls.has_followed(from_user_id, to_user_id):
+                return 0
+            deleted = cls._delete_hbase_friendships(from_user_id, [to_user_id])
 
-        instance = cls.get_follow_instance(from_user_id, to_user_id)
-        if instance is None:
-            return 0
+        if deleted:
+            cls._update_following_caches(from_user_id, [to_user_id], followed=False)
+            cls._incr_social_counts(from_user_id, [to_user_id], -1)
+            FriendshipRecommendationService.mark_dirty(from_user_id)
+            from newsfeeds.tasks import purge_newsfeeds_task
+            purge_newsfeeds_task.delay(from_user_id, to_user_id)
+        return deleted
+
+    @classmethod
+    def batch_follow(cls, from_user_id, to_user_ids):
+        """
+        follow many users at once, returns the ids that have been followed.
+        ids of unknown users, of users already followed and from_user_id
+        itself are skipped. every table is written with a single batch.
+        """
+        to_user_ids = set(to_user_ids)
+        to_user_ids.discard(from_user_id)
+        to_user_ids = set(User.objects.filter(
+            id__in=to_user_ids,
+        ).values_list('id', flat=True))
+        to_user_ids -= cls.get_followed_user_ids(from_user_id, to_user_ids)
+        to_user_ids = sorted(to_user_ids)
+        if not to_user_ids:
+            return []
+
+        if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
+            friendships = [
+                Friendship(from_user_id=from_user_id, to_user_id=to_user_id)
+                for to_user_id in to_user_ids
+            ]
+            Friendship.objects.bulk_create(friendships, ignore_conflicts=True)
+            # rows inserted meanwhile by another request were skipped, only
+            # the ones carrying our created_at have been followed by this call
+            created_at = {
+                friendship.to_user_id: friendship.created_at
+                for friendship in friendships
+            }
+            created_user_ids = set(
+                to_user_id
+                for to_user_id, friendship_created_at in Friendship.objects.filter(
+                    from_user_id=from_user_id,
+                    to_user_id__in=to_user_ids,
+                ).values_list('to_user_id', 'created_at')
+                if friendship_created_at == created_at[to_user_id]
+            )
+            friendships = [
+                friendship
+                for friendship in friendships
+                if friendship.to_user_id in created_user_ids
+            ]
+            to_user_ids = [friendship.to_user_id for friendship in friendships]
+            if not to_user_ids:
+                return []
+            if cls.is_dual_write_on():
+                cls._create_hbase_friendships(from_user_id, [
+                    (friendship.to_user_id, to_timestamp(friendship.created_at))
+                    for friendship in friendships
+                ])
+        else:
+            now = int(time.time() * 1000000)
+            # distinct created_at so that the row keys do not collide
+            cls._create_hbase_friendships(from_user_id, [
+                (to_user_id, now + index)
+                for index, to_user_id in enumerate(to_user_ids)
+            ])
+
+        cls._update_following_caches(from_user_id, to_user_ids, followed=True)
+        cls._incr_social_counts(from_user_id, to_user_ids, 1)
+        cls.get_followings_bloom_filter(from_user_id).add(to_user_ids)
+        FriendshipRecommendationService.mark_dirty(from_user_id)
 
-        HBaseFollowing.delete(from_user_id=from_user_id, created_at=instance.created_at)
-        HBaseFollower.delete(to_user_id=to_user_id, created_at=instance.created_at)
-        return 1
+        from newsfeeds.tasks import backfill_newsfeeds_batch_task
+        backfill_newsfeeds_batch_task.delay(from_user_id, to_user_ids)
+        return to_user_ids
 
     @classmethod
-    def get_following_count(cls, from_user_id):
+    def batch_unfollow(cls, from_user_id, to_user_ids):
+        """
+        unfollow many users at once, returns the ids that have been unfollowed
+        """
+        to_user_ids = sorted(cls.get_followed_user_ids(from_user_id, to_user_ids))
+        if not to_user_ids:
+            return []
+
         if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
-            return Friendship.objects.filter(from_user_id=from_user_id).count()
-        followings = HBaseFollowing.filter(prefix=(from_user_id, None))
-        return len(followings)
+            Friendship.objects.filter(
+                from_user_id=from_user_id,
+                to_user_id__in=to_user_ids,
+            ).delete()
+            if cls.is_dual_write_on():
+                cls._delete_hbase_friendships(from_user_id, to_user_ids)
+        else:
+            cls._delete_hbase_friendships(from_user_id, to_user_ids)
+
+        cls._update_following_caches(from_user_id, to_user_ids, followed=False)
+        cls._incr_social_counts(from_user_id, to_user_ids, -1)
+        FriendshipRecommendationService.mark_dirty(from_user_id)
+
+        from newsfeeds.tasks import purge_newsfeeds_batch_task
+        purge_newsfeeds_batch_task.delay(from_user_id, to_user_ids)
+        return to_user_ids
+
+    @classmethod
+    def get_follower_count(cls, to_user_id):
+        return ShadowRead.read(
+            'friendship',
+            to_user_id,
+            lambda: Friendship.objects.filter(to_user_id=to_user_id).count(),
+            lambda: len(HBaseFollower.filter(prefix=(to_user_id, None))),
+        )
+
+    @classmethod
+    def get_social_count_key(cls, user_id, attr):
+        return USER_SOCIAL_COUNT_PATTERN.format(attr=attr, user_id=user_id)
+
+    @classmethod
+    def get_social_counts(cls, user_ids):
+        """
+        returns {user_id: {'followers_count': n, 'followings_count': m}}
+        from the redis counters with one MGET. missing counters are loaded
+        from UserProfile, and counted in MySQL/HBase if never counted, see
+        backfill_social_counts. a load is not cached if a follow changed the
+        count meanwhile.
+        """
+        user_ids = list(set(user_ids))
+        keys = [
+            cls.get_social_count_key(user_id, attr)
+            for user_id in user_ids
+            for attr in SOCIAL_COUNT_ATTRS
+        ]
+        if not keys:
+            return {}
+        conn = RedisClient.get_connection()
+        pipe = conn.pipeline()
+        pipe.mget(keys)
+        pipe.mget([RedisHelper.get_version_key(key) for key in keys])
+        values, versions = pipe.execute()
+        values, versions = iter(values), iter(versions)
+        counts, count_versions = {}, {}
+        for user_id in user_ids:
+            counts[user_id], count_versions[user_id] = {}, {}
+            for attr in SOCIAL_COUNT_ATTRS:
+                counts[user_id][attr] = next(values)
+                version = next(versions)
+                count_versions[user_id][attr] = version.decode('utf-8') if version is not None else ''
+
+        missing_user_ids = [
+            user_id
+            for user_id, user_counts in counts.items()
+            if None in user_counts.values()
+        ]
+        profiles = UserService.get_profiles_through_cache(missing_user_ids)
+        pipe = conn.pipeline()
+        for user_id in missing_user_ids:
+            for attr, count in counts[user_id].items():
+                if count is not None:
+                    continue
+                count = getattr(profiles[user_id], attr)
+                if count is None:
+                    if attr == 'followers_count':
+                        count = cls.get_follower_count(user_id)
+                    else:
+                        count = cls.get_following_count(user_id)
+                counts[user_id][attr] = count
+                key = cls.get_social_count_key(user_id, attr)
+                RedisHelper.run_script(
+                    RedisHelper.SET_COUNT_SCRIPT,
+                    keys=[key, RedisHelper.get_version_key(key)],
+                    args=[count_versions[user_id][attr], count, settings.REDIS_KEY_EXPIRE_TIME],
+                    client=pipe,
+                )
+        pipe.execute()
+
+        return {
+            user_id: {attr: int(count) for attr, count in user_counts.items()}
+            for user_id, user_counts in counts.items()
+        }
+
+    @classmethod
+    def _incr_social_counts(cls, from_user_id, to_user_ids, delta):
+        """
+        increment the counters that are cached, they are not recreated from
+        0 when they expired. the delta of a missing counter goes to the
+        UserProfile column it is loaded from instead, and the load running
+        meanwhile is discarded by the version bumps.
+        """
+        updates = [(from_user_id, 'followings_count', delta * len(to_user_ids))] + [
+            (to_user_id, 'followers_count', delta)
+            for to_user_id in to_user_ids
+        ]
+        conn = RedisClient.get_connection()
+        pipe = conn.pipeline()
+        for user_id, attr, user_delta in updates:
+            key = cls.get_social_count_key(user_id, attr)
+            RedisHelper.update_set(key, 'INCRBY', [user_delta], pipe)
+            # a counter only expires long after its last change was written back
+            pipe.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+        pipe.sadd(SOCIAL_COUNTS_DIRTY_USERS_KEY, from_user_id, *to_user_ids)
+        cached = pipe.execute()[0:-1:2]
+
+        missed = [update for update, is_cached in zip(updates, cached) if not is_cached]
+        if not missed:
+            return
+        for attr in SOCIAL_COUNT_ATTRS:
+            # a null column is counted when loaded, the friendship is in already
+            UserProfile.objects.filter(
+                user_id__in=[user_id for user_id, missed_attr, _ in missed if missed_attr == attr],
+                **{'{}__isnull'.format(attr): False}
+            ).update(**{attr: F(attr) + (delta * len(to_user_ids) if attr == 'followings_count' else delta)})
+        pipe = conn.pipeline()
+        for user_id, attr, _ in missed:
+            UserService.invalidate_profile(user_id)
+            version_key = RedisHelper.get_version_key(cls.get_social_count_key(user_id, attr))
+            pipe.incr(version_key)
+            pipe.expire(version_key, ONE_HOUR)
+        pipe.execute()
+
+    @classmethod
+    def write_back_social_counts(cls):
+        """
+        persist the counters of the users changed since the last run
+        into UserProfile, called periodically by celery beat
+        """
+        conn = RedisClient.get_connection()
+        user_ids = [
+            int(user_id)
+            for user_id in conn.spop(
+                SOCIAL_COUNTS_DIRTY_USERS_KEY,
+                SOCIAL_COUNTS_WRITE_BACK_BATCH_SIZE,
+            ) or []
+        ]
+        for user_id in user_ids:
+            counts = dict(zip(SOCIAL_COUNT_ATTRS, conn.mget([
+                cls.get_social_count_key(user_id, attr)
+                for attr in SOCIAL_COUNT_ATTRS
+            ])))
+            # an expired counter had its changes applied to the profile already
+            counts = {attr: int(count) for attr, count in counts.items() if count is not None}
+            if not counts:
+                continue
+            UserProfile.objects.filter(user_id=user_id).update(**counts)
+            UserService.invalidate_profile(user_id)
+        return len(user_ids)
+
+    @classmethod
+    def backfill_social_counts(cls, batch_size=SOCIAL_COUNTS_WRITE_BACK_BATCH_SIZE):
+        """
+        count the friendships of the users whose counters were never
+        persisted, so that a cold get_social_counts only reads UserProfile.
+        returns the number of profiles backfilled.
+        """
+        queryset = UserProfile.objects.filter(
+            Q(followers_count__isnull=True) | Q(followings_count__isnull=True),
+            user_id__isnull=False,
+        ).order_by('user_id')
+        total, last_user_id = 0, 0
+        while True:
+            user_ids = list(queryset.filter(
+                user_id__gt=last_user_id,
+            ).values_list('user_id', flat=True)[:batch_size])
+            if not user_ids:
+                return total
+            counts = cls.get_social_counts(user_ids)
+            for user_id in user_ids:
+                for attr, count in counts[user_id].items():
+                    # do not overwrite a count written back meanwhile
+                    UserProfile.objects.filter(
+                        user_id=user_id,
+                        **{'{}__isnull'.format(attr): True}
+                    ).update(**{attr: count})
+                UserService.invalidate_profile(user_id)
+            total += len(user_ids)
+            last_user_id = user_ids[-1]
+
+    @classmethod
+    def get_following_count(cls, from_user_id):
+        return ShadowRead.read(
+            'friendship',
+            from_user_id,
+            lambda: Friendship.objects.filter(from_user_id=from_user_id).count(),
+            lambda: len(HBaseFollowing.filter(prefix=(from_user_id, None))),
+        )
+
+
+class FriendshipRecommendationService(object):
+    """
+    friends of friends recommendations and mutual followers, computed with
+    set operations over the cached followings/followers sets in redis
+    """
+
+    @classmethod
+    def mark_dirty(cls, user_id):
+        conn = RedisClient.get_connection()
+        conn.sadd(FOLLOW_RECOMMENDATIONS_DIRTY_USERS_KEY, user_id)
+
+    @classmethod
+    def refresh_recommendations(cls, user_id):
+        """
+        score every user followed by a sample of the followings of user_id
+        by how many of them follow it, with one ZUNIONSTORE. the followings
+        of user_id get a weight low enough to drop them, and the list is
+        trimmed to the best RECOMMENDATION_LIST_LENGTH candidates.
+        """
+        conn = RedisClient.get_connection()
+        key = USER_FOLLOW_RECOMMENDATIONS_PATTERN.format(user_id=user_id)
+        followings_key = FriendshipService.get_followings_key(user_id)
+        sample_user_ids = [
+            int(following_id)
+            for following_id in conn.srandmember(
+                followings_key,
+                RECOMMENDATION_FOLLOWINGS_SAMPLE_SIZE + 1,
+            )
+            if int(following_id) != USER_ID_SET_SENTINEL
+        ][:RECOMMENDATION_FOLLOWINGS_SAMPLE_SIZE]
+        if not sample_user_ids:
+            conn.delete(key)
+            return 0
+
+        weights = {
+            FriendshipService.get_followings_key(following_id): 1
+            for following_id in sample_user_ids
+        }
+        weights[followings_key] = -len(weights) - 1
+
+        pipe = conn.pipeline()
+        pipe.zunionstore(key, weights, aggregate='SUM')
+        pipe.zremrangebyscore(key, '-inf', 0)
+        pipe.zrem(key, user_id, USER_ID_SET_SENTINEL)
+        pipe.zremrangebyrank(key, 0, -RECOMMENDATION_LIST_LENGTH - 1)
+        pipe.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+        pipe.zcard(key)
+        return pipe.execute()[-1]
+
+    @classmethod
+    def refresh_dirty_recommendations(cls):
+        conn = RedisClient.get_connection()
+        user_ids = conn.spop(
+            FOLLOW_RECOMMENDATIONS_DIRTY_USERS_KEY,
+            RECOMMENDATION_REFRESH_BATCH_SIZE,
+        ) or []
+        for user_id in user_ids:
+            cls.refresh_recommendations(int(user_id))
+        return len(user_ids)
+
+    @classmethod
+    def get_recommendations(cls, user_id, limit):
+        """
+        returns [(user_id, number of followings who follow it)], best first
+        """
+        conn = RedisClient.get_connection()
+        key = USER_FOLLOW_RECOMMENDATIONS_PATTERN.format(user_id=user_id)
+        if not conn.exists(key) and conn.set(
+            key + ':refreshing',
+            1,
+            nx=True,
+            ex=RECOMMENDATION_REFRESHING_TIMEOUT,
+        ):
+            refresh_follow_recommendations_task.delay(user_id)
+
+        recommendations = [
+            (int(candidate_id), int(score))
+            for candidate_id, score in conn.zrevrange(key, 0, limit - 1, withscores=True)
+        ]
+        # users followed since the last refresh
+        followed_user_ids = FriendshipService.get_followed_user_ids(
+            user_id,
+            [candidate_id for candidate_id, _ in recommendations],
+        )
+        return [
+            (candidate_id, score)
+            for candidate_id, score in recommendations
+            if candidate_id not in followed_user_ids
+        ]
+
+    @classmethod
+    def get_mutual_follower_ids(cls, user_id, to_user_id):
+        """
+        the users user_id follows who also follow to_user_id, with one SINTER
+        if the followers of to_user_id are cached. loading them takes long
+        for a popular user, so on a miss they are loaded in the background
+        and meanwhile at most MUTUAL_FOLLOWERS_FALLBACK_LIMIT followings of
+        user_id are checked against the database.
+        """
+        conn = RedisClient.get_connection()
+        followings_key = FriendshipService.get_followings_key(user_id)
+        followers_key = USER_FOLLOWERS_PATTERN.format(user_id=to_user_id)
+        pipe = conn.pipeline()
+        pipe.exists(followers_key)
+        pipe.sinter(followings_key, followers_key)
+        exists, user_ids = pipe.execute()
+        if not exists:
+            FriendshipService.warm_followers_key(to_user_id)
+            following_ids = sorted(FriendshipService.get_following_user_id_set(user_id))
+            user_ids = FriendshipService.get_follower_ids_among(
+                to_user_id,
+                following_ids[:MUTUAL_FOLLOWERS_FALLBACK_LIMIT],
+            )
+        return sorted(
+            int(mutual_id)
+            for mutual_id in user_ids
+            if int(mutual_id) != USER_ID_SET_SENTINEL
+        )
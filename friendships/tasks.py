@@ -0,0 +1,37 @@
+from celery import shared_task
+from utils.time_constants import ONE_HOUR
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def rebuild_followings_bloom_filter_task(from_user_id, building_key=None):
+    from friendships.services import FriendshipService
+    FriendshipService.rebuild_followings_bloom_filter(from_user_id, building_key)
+    return 'followings bloom filter of user {} rebuilt.'.format(from_user_id)
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def load_followers_key_task(to_user_id):
+    from friendships.services import FriendshipService
+    FriendshipService.load_followers_key(to_user_id)
+    return 'followers set of user {} loaded.'.format(to_user_id)
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def refresh_follow_recommendations_task(user_id):
+    from friendships.services import FriendshipRecommendationService
+    count = FriendshipRecommendationService.refresh_recommendations(user_id)
+    return '{} follow recommendations for user {}.'.format(count, user_id)
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def refresh_dirty_follow_recommendations_task():
+    from friendships.services import FriendshipRecommendationService
+    count = FriendshipRecommendationService.refresh_dirty_recommendations()
+    return 'follow recommendations of {} users refreshed.'.format(count)
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def write_back_social_counts_task():
+    from friendships.services import FriendshipService
+    count = FriendshipService.write_back_social_counts()
+    return 'social counts of {} users written back.'.format(count)
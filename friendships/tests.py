@@ -1,8 +1,19 @@
+from accounts.models import UserProfile
 from django_hbase.models import EmptyColumnError, BadRowKeyError
-from friendships.models import HBaseFollowing, HBaseFollower
-from friendships.services import FriendshipService
+from friendships.graph import FriendshipGraph, export_friendship_graph, iter_friendship_edges
+from friendships.hbase_backfill import FriendshipBackfill
+from friendships.models import Friendship, HBaseFollowing, HBaseFollower
+from friendships.services import FriendshipRecommendationService, FriendshipService
+from gatekeeper.models import GateKeeper
+from gatekeeper.shadow_reads import ShadowRead
 from testing.testcases import TestCase
+from twitter.cache import USER_FOLLOWERS_PATTERN, USER_FOLLOWINGS_PATTERN
+from unittest import mock
+from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
 
+import os
+import tempfile
 import time
 
 
@@ -26,6 +37,287 @@ class FriendshipServiceTests(TestCase):
         user_id_set = FriendshipService.get_following_user_id_set(self.jesse.id)
         self.assertSetEqual(user_id_set, {user1.id, user2.id})
 
+    def test_has_followed(self):
+        user1 = self.create_user('user1')
+        self.assertEqual(FriendshipService.has_followed(self.jesse.id, self.eliza.id), False)
+        self.assertEqual(FriendshipService.get_following_user_id_set(self.jesse.id), set())
+
+        # the cached set is kept up to date by follow and unfollow
+        self.create_friendship(self.jesse, self.eliza)
+        self.assertEqual(FriendshipService.has_followed(self.jesse.id, self.eliza.id), True)
+        self.assertEqual(
+            FriendshipService.get_followed_user_ids(
+                self.jesse.id,
+                [self.jesse.id, self.eliza.id, user1.id],
+            ),
+            {self.eliza.id},
+        )
+
+        FriendshipService.unfollow(self.jesse.id, self.eliza.id)
+        self.assertEqual(FriendshipService.has_followed(self.jesse.id, self.eliza.id), False)
+        self.assertEqual(FriendshipService.unfollow(self.jesse.id, self.eliza.id), 0)
+
+        # lazy loaded from the database after the cache is gone
+        self.create_friendship(self.jesse, user1)
+        self.clear_cache()
+        self.assertEqual(FriendshipService.has_followed(self.jesse.id, user1.id), True)
+        self.assertEqual(FriendshipService.get_following_user_id_set(self.jesse.id), {user1.id})
+
+    def test_followings_set_races(self):
+        user1 = self.create_user('user1')
+        conn = RedisClient.get_connection()
+        key = USER_FOLLOWINGS_PATTERN.format(user_id=self.jesse.id)
+
+        # an update of a set that is not cached does not create it
+        FriendshipService.follow(self.jesse.id, self.eliza.id)
+        self.assertEqual(conn.exists(key), 0)
+
+        loads = []
+
+        def _load_user_ids():
+            user_ids = FriendshipService._load_following_user_ids(self.jesse.id)
+            if not loads:
+                # a follow committed after the database was read
+                FriendshipService.follow(self.jesse.id, user1.id)
+            loads.append(user_ids)
+            return [0] + user_ids
+
+        # the first load is discarded and done again
+        RedisHelper.load_set(key, _load_user_ids)
+        self.assertEqual(len(loads), 2)
+        self.assertEqual(
+            FriendshipService.get_following_user_id_set(self.jesse.id),
+            {self.eliza.id, user1.id},
+        )
+
+    def test_mutual_followers_on_a_miss(self):
+        user1 = self.create_user('user1')
+        user2 = self.create_user('user2')
+        for to_user in [user1, user2]:
+            self.create_friendship(from_user=self.jesse, to_user=to_user)
+        self.create_friendship(from_user=user1, to_user=self.eliza)
+        self.clear_cache()
+
+        conn = RedisClient.get_connection()
+        followers_key = USER_FOLLOWERS_PATTERN.format(user_id=self.eliza.id)
+        # the followers set is not loaded in the request, only in the task
+        with mock.patch('friendships.services.load_followers_key_task') as task:
+            self.assertEqual(
+                FriendshipRecommendationService.get_mutual_follower_ids(self.jesse.id, self.eliza.id),
+                [user1.id],
+            )
+            self.assertEqual(
+                FriendshipRecommendationService.get_mutual_follower_ids(self.jesse.id, self.eliza.id),
+                [user1.id],
+            )
+        self.assertEqual(conn.exists(followers_key), 0)
+        # scheduled once while the first load is in progress
+        task.delay.assert_called_once_with(self.eliza.id)
+
+        FriendshipService.load_followers_key(self.eliza.id)
+        self.assertEqual(conn.exists(followers_key), 1)
+        self.create_friendship(from_user=user2, to_user=self.eliza)
+        self.assertEqual(
+            FriendshipRecommendationService.get_mutual_follower_ids(self.jesse.id, self.eliza.id),
+            [user1.id, user2.id],
+        )
+
+    def test_followings_bloom_filter(self):
+        user1 = self.create_user('user1')
+        bloom_filter = FriendshipService.get_followings_bloom_filter(self.jesse.id)
+        self.assertEqual(bloom_filter.exists(), False)
+
+        # built on first use
+        self.create_friendship(self.jesse, self.eliza)
+        self.assertEqual(FriendshipService.has_followed(self.jesse.id, self.eliza.id), True)
+        self.assertEqual(bloom_filter.exists(), True)
+        self.assertEqual(bloom_filter.might_contain(self.eliza.id), True)
+
+        # kept up to date by follow
+        self.create_friendship(self.jesse, user1)
+        self.assertEqual(bloom_filter.might_contain(user1.id), True)
+
+        # unfollowed users stay in the filter, the exact check sorts them out
+        FriendshipService.unfollow(self.jesse.id, user1.id)
+        self.assertEqual(bloom_filter.might_contain(user1.id), True)
+        self.assertEqual(FriendshipService.has_followed(self.jesse.id, user1.id), False)
+
+        self.assertEqual(FriendshipService.rebuild_followings_bloom_filter(self.jesse.id), True)
+        self.assertEqual(bloom_filter.might_contain(self.eliza.id), True)
+        self.assertEqual(
+            FriendshipService.get_followed_user_ids(self.jesse.id, [self.eliza.id, user1.id]),
+            {self.eliza.id},
+        )
+
+        # only one rebuild at a time
+        building_key = bloom_filter.start_rebuild()
+        self.assertNotEqual(building_key, None)
+        self.assertEqual(bloom_filter.start_rebuild(), None)
+        self.assertEqual(FriendshipService.rebuild_followings_bloom_filter(self.jesse.id), False)
+        self.assertEqual(
+            FriendshipService.rebuild_followings_bloom_filter(self.jesse.id, building_key),
+            True,
+        )
+
+        # the filter is only consulted when the followings set is not cached,
+        # ids it rules out do not load the set from the database
+        RedisClient.get_connection().delete(USER_FOLLOWINGS_PATTERN.format(user_id=self.jesse.id))
+        with self.assertNumQueries(0):
+            self.assertEqual(FriendshipService.has_followed(self.jesse.id, user1.id), False)
+        self.assertEqual(FriendshipService.has_followed(self.jesse.id, self.eliza.id), True)
+
+    def test_social_counts(self):
+        user1 = self.create_user('user1')
+        self.assertEqual(FriendshipService.get_social_counts([self.jesse.id]), {
+            self.jesse.id: {'followers_count': 0, 'followings_count': 0},
+        })
+
+        self.create_friendship(self.jesse, self.eliza)
+        FriendshipService.batch_follow(self.jesse.id, [self.eliza.id, user1.id])
+        self.create_friendship(user1, self.jesse)
+        FriendshipService.unfollow(self.jesse.id, self.eliza.id)
+        counts = FriendshipService.get_social_counts([self.jesse.id, self.eliza.id, user1.id])
+        self.assertEqual(counts[self.jesse.id], {'followers_count': 1, 'followings_count': 1})
+        self.assertEqual(counts[self.eliza.id], {'followers_count': 0, 'followings_count': 0})
+        self.assertEqual(counts[user1.id], {'followers_count': 1, 'followings_count': 1})
+
+        # written back to the profiles and reloaded from there
+        self.assertEqual(FriendshipService.write_back_social_counts(), 3)
+        self.jesse.profile.refresh_from_db()
+        self.assertEqual(self.jesse.profile.followers_count, 1)
+        self.assertEqual(self.jesse.profile.followings_count, 1)
+        self.clear_cache()
+        counts = FriendshipService.get_social_counts([self.jesse.id])
+        self.assertEqual(counts[self.jesse.id], {'followers_count': 1, 'followings_count': 1})
+
+    def test_social_counts_expired(self):
+        user1 = self.create_user('user1')
+        self.jesse.profile
+        self.eliza.profile
+        FriendshipService.follow(self.jesse.id, self.eliza.id)
+        FriendshipService.get_social_counts([self.jesse.id, self.eliza.id])
+        self.assertEqual(FriendshipService.write_back_social_counts(), 2)
+
+        # follows after the counters expired go to the profiles, they do
+        # not restart the counters from 0
+        conn = RedisClient.get_connection()
+        conn.delete(*[
+            FriendshipService.get_social_count_key(user_id, attr)
+            for user_id in [self.jesse.id, self.eliza.id]
+            for attr in ['followers_count', 'followings_count']
+        ])
+        FriendshipService.batch_follow(self.jesse.id, [user1.id])
+        FriendshipService.follow(user1.id, self.eliza.id)
+        self.assertEqual(conn.get(FriendshipService.get_social_count_key(self.jesse.id, 'followings_count')), None)
+        self.assertEqual(FriendshipService.write_back_social_counts(), 3)
+        self.jesse.profile.refresh_from_db()
+        self.assertEqual(self.jesse.profile.followings_count, 2)
+
+        counts = FriendshipService.get_social_counts([self.jesse.id, self.eliza.id, user1.id])
+        self.assertEqual(counts[self.jesse.id], {'followers_count': 0, 'followings_count': 2})
+        self.assertEqual(counts[self.eliza.id], {'followers_count': 2, 'followings_count': 0})
+        self.assertEqual(counts[user1.id], {'followers_count': 1, 'followings_count': 1})
+
+    def test_batch_follow_skips_concurrent_inserts(self):
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 0)
+        user1 = self.create_user('user1')
+        # inserted by another request after the followed ids were checked
+        Friendship.objects.create(from_user=self.jesse, to_user=self.eliza)
+        with mock.patch.object(FriendshipService, 'get_followed_user_ids', return_value=set()):
+            to_user_ids = FriendshipService.batch_follow(self.jesse.id, [self.eliza.id, user1.id])
+        self.assertEqual(to_user_ids, [user1.id])
+        self.assertEqual(Friendship.objects.filter(from_user=self.jesse).count(), 2)
+        counts = FriendshipService.get_social_counts([self.jesse.id, self.eliza.id])
+        self.assertEqual(counts[self.jesse.id]['followings_count'], 2)
+        self.assertEqual(counts[self.eliza.id]['followers_count'], 1)
+
+    def test_recommendations_refreshed_once(self):
+        with mock.patch('friendships.services.refresh_follow_recommendations_task') as task:
+            for _ in range(3):
+                self.assertEqual(FriendshipRecommendationService.get_recommendations(self.jesse.id, 10), [])
+        self.assertEqual(task.delay.call_count, 1)
+
+    def test_backfill_social_counts(self):
+        self.create_friendship(self.jesse, self.eliza)
+        self.jesse.profile
+        self.eliza.profile
+        UserProfile.objects.filter(user=self.eliza).update(followings_count=5)
+        self.clear_cache()
+
+        # only the counts never persisted are filled in
+        self.assertEqual(FriendshipService.backfill_social_counts(batch_size=1), 2)
+        self.assertEqual(
+            list(UserProfile.objects.order_by('user_id').values_list(
+                'followers_count',
+                'followings_count',
+            )),
+            [(0, 1), (1, 5)],
+        )
+        self.assertEqual(FriendshipService.backfill_social_counts(), 0)
+
+        # a cold read no longer counts the friendships
+        self.clear_cache()
+        with self.assertNumQueries(1):
+            counts = FriendshipService.get_social_counts([self.jesse.id, self.eliza.id])
+        self.assertEqual(counts[self.jesse.id], {'followers_count': 0, 'followings_count': 1})
+
+    def test_dual_write_and_backfill(self):
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 0)
+        user1 = self.create_user('user1')
+        self.create_friendship(self.jesse, self.eliza)
+
+        # dual writes mirror follow and unfollow into hbase
+        GateKeeper.turn_on('dual_write_friendship_to_hbase')
+        self.create_friendship(self.jesse, user1)
+        self.create_friendship(self.eliza, user1)
+        self.assertEqual(len(HBaseFollowing.filter(prefix=(self.jesse.id, None))), 1)
+        self.assertEqual(len(HBaseFollower.filter(prefix=(user1.id, None))), 2)
+        FriendshipService.unfollow(self.eliza.id, user1.id)
+        self.assertEqual(len(HBaseFollower.filter(prefix=(user1.id, None))), 1)
+
+        # the friendship created before the dual writes is backfilled
+        total_rows, _ = FriendshipBackfill.run(chunk_size=2, workers=0)
+        self.assertEqual(total_rows, 2)
+        self.assertEqual(len(HBaseFollowing.filter(prefix=(self.jesse.id, None))), 2)
+        self.assertEqual(len(HBaseFollower.filter(prefix=(self.eliza.id, None))), 1)
+        total_rows, mismatched_chunks = FriendshipBackfill.run(chunk_size=2, workers=0, verify=True)
+        self.assertEqual(total_rows, 2)
+        self.assertEqual(mismatched_chunks, [])
+
+        # finished chunks are skipped when the backfill resumes
+        self.assertEqual(FriendshipBackfill.run(chunk_size=2, workers=0), (0, []))
+        FriendshipBackfill.reset(chunk_size=2)
+        self.assertEqual(FriendshipBackfill.run(chunk_size=2, workers=0), (2, []))
+
+        # a friendship whose user was deleted has no row key and is skipped
+        Friendship.objects.filter(from_user=self.jesse, to_user=self.eliza).update(from_user=None)
+        FriendshipBackfill.reset(chunk_size=2)
+        self.assertEqual(FriendshipBackfill.run(chunk_size=2, workers=0), (1, []))
+        self.assertEqual(FriendshipBackfill.run(chunk_size=2, workers=0, verify=True), (1, []))
+
+    def test_read_routing(self):
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 0)
+        self.create_friendship(self.jesse, self.eliza)
+        self.assertEqual(FriendshipService.get_follower_ids(self.eliza.id), [self.jesse.id])
+
+        # reads stay on mysql until the dual writes keep hbase in sync
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', self.eliza.id % 100 + 1)
+        self.assertEqual(FriendshipService.reads_from_hbase(self.eliza.id), False)
+        self.assertEqual(FriendshipService.get_follower_ids(self.eliza.id), [self.jesse.id])
+
+        # hbase misses the friendship created before the dual writes
+        GateKeeper.turn_on('dual_write_friendship_to_hbase')
+        self.assertEqual(FriendshipService.reads_from_hbase(self.eliza.id), True)
+        self.assertEqual(FriendshipService.get_follower_ids(self.eliza.id), [])
+
+        GateKeeper.turn_on('shadow_read_friendship')
+        FriendshipService.get_follower_ids(self.eliza.id)
+        FriendshipBackfill.run(chunk_size=100, workers=0)
+        self.assertEqual(FriendshipService.get_follower_ids(self.eliza.id), [self.jesse.id])
+        stats = ShadowRead.get_stats('friendship')
+        self.assertEqual(stats['reads'], 2)
+        self.assertEqual(stats['mismatches'], 1)
+
 
 class HBaseTests(TestCase):
 
@@ -132,3 +424,118 @@ class HBaseTests(TestCase):
         self.assertEqual(len(results), 2)
         self.assertEqual(results[0].to_user_id, 3)
         self.assertEqual(results[1].to_user_id, 2)
+
+    def test_get_by_index(self):
+        ts = self.ts_now
+        HBaseFollowing.create(from_user_id=1, to_user_id=2, created_at=ts)
+        instance = HBaseFollowing.get_by_index('to_user', from_user_id=1, to_user_id=2)
+        self.assertEqual(instance.from_user_id, 1)
+        self.assertEqual(instance.to_user_id, 2)
+        self.assertEqual(instance.created_at, ts)
+        self.assertEqual(HBaseFollowing.get_by_index('to_user', from_user_id=1, to_user_id=3), None)
+
+        # index row moves with the indexed field
+        instance.to_user_id = 3
+        instance.save()
+        self.assertEqual(HBaseFollowing.get_by_index('to_user', from_user_id=1, to_user_id=2), None)
+        instance = HBaseFollowing.get_by_index('to_user', from_user_id=1, to_user_id=3)
+        self.assertEqual(instance.created_at, ts)
+
+        # batch create and delete keep the index in sync
+        HBaseFollowing.batch_create([
+            {'from_user_id': 1, 'to_user_id': 4, 'created_at': self.ts_now},
+            {'from_user_id': 1, 'to_user_id': 5, 'created_at': self.ts_now},
+        ])
+        instance = HBaseFollowing.get_by_index('to_user', from_user_id=1, to_user_id=4)
+        self.assertEqual(instance.to_user_id, 4)
+
+        HBaseFollowing.batch_delete([
+            {'from_user_id': 1, 'created_at': instance.created_at},
+        ])
+        self.assertEqual(HBaseFollowing.get_by_index('to_user', from_user_id=1, to_user_id=4), None)
+        self.assertEqual(HBaseFollowing.get(from_user_id=1, created_at=instance.created_at), None)
+
+        HBaseFollowing.delete(from_user_id=1, created_at=ts, to_user_id=3)
+        self.assertEqual(HBaseFollowing.get_by_index('to_user', from_user_id=1, to_user_id=3), None)
+
+        # rows saved before the index are indexed by a rebuild
+        HBaseFollowing.get_table().put(
+            HBaseFollowing.serialize_row_key({'from_user_id': 1, 'created_at': ts}),
+            HBaseFollowing.serialize_row_data({'to_user_id': 6}),
+        )
+        self.assertEqual(HBaseFollowing.get_by_index('to_user', from_user_id=1, to_user_id=6), None)
+        self.assertEqual(
+            HBaseFollowing.rebuild_indexes(batch_size=1),
+            len(HBaseFollowing.filter(prefix=(1, None))),
+        )
+        instance = HBaseFollowing.get_by_index('to_user', from_user_id=1, to_user_id=6)
+        self.assertEqual(instance.created_at, ts)
+
+
+class FriendshipGraphTests(TestCase):
+
+    def test_export_and_load(self):
+        jesse = self.create_user('jesse')
+        eliza = self.create_user('eliza')
+        lucy = self.create_user('lucy')
+        self.create_friendship(jesse, eliza)
+        self.create_friendship(jesse, lucy)
+        self.create_friendship(eliza, lucy)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'followings.graph')
+            num_nodes, num_edges = export_friendship_graph(path)
+            self.assertEqual(num_nodes, lucy.id + 1)
+            self.assertEqual(num_edges, 3)
+
+            with FriendshipGraph(path) as graph:
+                self.assertEqual(list(graph.neighbors(jesse.id)), sorted([eliza.id, lucy.id]))
+                self.assertEqual(list(graph.neighbors(lucy.id)), [])
+                self.assertEqual(list(graph.neighbors(lucy.id + 100)), [])
+                self.assertEqual(graph.degree(eliza.id), 1)
+                self.assertEqual(graph.has_edge(jesse.id, lucy.id), True)
+                self.assertEqual(graph.has_edge(lucy.id, jesse.id), False)
+                self.assertEqual(graph.intersection(jesse.id, eliza.id), [lucy.id])
+
+            export_friendship_graph(path, direction='followers')
+            with FriendshipGraph(path) as graph:
+                self.assertEqual(list(graph.neighbors(lucy.id)), sorted([jesse.id, eliza.id]))
+
+    def test_export_while_edges_change(self):
+        jesse = self.create_user('jesse')
+        eliza = self.create_user('eliza')
+        lucy = self.create_user('lucy')
+        signed_up_id = lucy.id + 1
+        passes = [
+            [(jesse.id, eliza.id), (jesse.id, lucy.id), (eliza.id, lucy.id), (signed_up_id, jesse.id)],
+            # jesse unfollowed eliza and a new user followed in between,
+            # a deleted user left a friendship with a null id
+            [(jesse.id, lucy.id), (eliza.id, lucy.id), (lucy.id, signed_up_id), (signed_up_id, eliza.id),
+             (None, lucy.id)],
+        ]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'followings.graph')
+            with mock.patch('friendships.graph.iter_friendship_edges', side_effect=passes):
+                num_nodes, num_edges = export_friendship_graph(path)
+            self.assertEqual((num_nodes, num_edges), (lucy.id + 1, 2))
+
+            with FriendshipGraph(path) as graph:
+                self.assertEqual(list(graph.neighbors(jesse.id)), [lucy.id])
+                self.assertEqual(list(graph.neighbors(eliza.id)), [lucy.id])
+                self.assertEqual(list(graph.neighbors(lucy.id)), [])
+
+    def test_iter_mysql_edges(self):
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 0)
+        jesse = self.create_user('jesse')
+        eliza = self.create_user('eliza')
+        lucy = self.create_user('lucy')
+        for from_user, to_user in [(jesse, eliza), (jesse, lucy), (eliza, lucy)]:
+            self.create_friendship(from_user, to_user)
+
+        # paged by primary key
+        with mock.patch('friendships.graph.GRAPH_EXPORT_BATCH_SIZE', 2):
+            self.assertEqual(
+                sorted(iter_friendship_edges('followers')),
+                sorted([(eliza.id, jesse.id), (lucy.id, jesse.id), (lucy.id, eliza.id)]),
+            )
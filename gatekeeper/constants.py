@@ -0,0 +1,7 @@
+from django.conf import settings
+
+# how long a process trusts its gatekeeper snapshot in seconds, changes are
+# also pushed through redis pub/sub so this only bounds a missed message
+GATEKEEPER_SNAPSHOT_TTL = 30 if not settings.TESTING else 0
+# how long the pub/sub listener waits before reconnecting after an error
+GATEKEEPER_LISTENER_RETRY_DELAY = 1
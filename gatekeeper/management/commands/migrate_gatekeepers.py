@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from gatekeeper.models import GateKeeper
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the gatekeeper:<gk_name> hashes into the single gatekeepers hash, '
+        'also done by the first snapshot load after the deploy'
+    )
+
+    def handle(self, *args, **options):
+        for gk_name in GateKeeper.migrate_legacy_gatekeepers():
+            self.stdout.write('migrated {}'.format(gk_name))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from gatekeeper.models import GateKeeper
+from gatekeeper.shadow_reads import STORES, ShadowRead
+
+
+class Command(BaseCommand):
+    help = 'Print the shadow read comparison between mysql and hbase'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='+', help='e.g. friendship newsfeed')
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='clear the stats after printing them, e.g. after a ramp',
+        )
+
+    def handle(self, *args, **options):
+        for name in options['names']:
+            stats = ShadowRead.get_stats(name)
+            self.stdout.write('{}: {}% on hbase, {}% shadow read'.format(
+                name,
+                GateKeeper.get('switch_{}_to_hbase'.format(name))['percent'],
+                GateKeeper.get('shadow_read_{}'.format(name))['percent'],
+            ))
+            self.stdout.write('  {} reads, {} mismatches, {} errors'.format(
+                stats['reads'],
+                stats['mismatches'],
+                stats['errors'],
+            ))
+            for store in STORES:
+                self.stdout.write('  {}: p50 <= {}ms, p99 <= {}ms'.format(
+                    store,
+                    stats[store]['p50'],
+                    stats[store]['p99'],
+                ))
+            if options['reset']:
+                ShadowRead.reset_stats(name)
@@ -0,0 +1,17 @@
+from gatekeeper.models import GateKeeper
+
+
+class GateKeeperSnapshotMiddleware:
+    """
+    evaluate the gatekeepers once per request, see GateKeeper.pin_snapshot
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = GateKeeper.pin_snapshot()
+        try:
+            return self.get_response(request)
+        finally:
+            GateKeeper.unpin_snapshot(token)
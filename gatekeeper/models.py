@@ -1,26 +1,153 @@
+from asgiref.local import Local
+from gatekeeper.constants import GATEKEEPER_LISTENER_RETRY_DELAY, GATEKEEPER_SNAPSHOT_TTL
+from twitter.cache import (
+    GATEKEEPERS_CHANNEL,
+    GATEKEEPERS_KEY,
+    GATEKEEPERS_MIGRATED_KEY,
+    LEGACY_GATEKEEPER_PATTERN,
+)
 from utils.redis_client import RedisClient
 
+import os
+import threading
+import time
+
+# the snapshots pinned by the current request or celery task, innermost last,
+# asgiref's Local is thread local and also works on python 3.6
+_pinned = Local()
+
 
 class GateKeeper(object):
+    """
+    all gatekeepers live in one redis hash with a '<gk_name>:<key>' field per
+    value, every process keeps a snapshot of it loaded with one HGETALL.
+    set_kv publishes the change so the other processes drop their snapshot,
+    the snapshot ttl covers a message lost while reconnecting.
+
+    a request or celery task pins the snapshot when it starts, every check in
+    it then sees the same flags even if they are flipped halfway through.
+    """
+    _snapshot = None
+    _snapshot_loaded_at = 0
+    # bumped by every invalidation, a load started before is not kept
+    _generation = 0
+    _listener_pid = None
 
     @classmethod
-    def get(cls, gk_name):
+    def migrate_legacy_gatekeepers(cls):
+        """
+        copy the gatekeeper:<gk_name> hashes written before the single hash,
+        HSETNX keeps the values already set in the new hash
+        """
         conn = RedisClient.get_connection()
-        name = f'gatekeeper:{gk_name}'
-        if not conn.exists(name):
-            return {'percent': 0, 'description': ''}
+        migrated = []
+        for name in conn.scan_iter(match=LEGACY_GATEKEEPER_PATTERN.format(gk_name='*')):
+            gk_name = name.decode('utf-8').split(':', 1)[1]
+            pipe = conn.pipeline()
+            for key, value in conn.hgetall(name).items():
+                pipe.hsetnx(GATEKEEPERS_KEY, '{}:{}'.format(gk_name, key.decode('utf-8')), value)
+            pipe.execute()
+            migrated.append(gk_name)
+        pipe = conn.pipeline()
+        pipe.set(GATEKEEPERS_MIGRATED_KEY, 1)
+        pipe.publish(GATEKEEPERS_CHANNEL, GATEKEEPERS_MIGRATED_KEY)
+        pipe.execute()
+        return migrated
+
+    @classmethod
+    def load_snapshot(cls):
+        conn = RedisClient.get_connection()
+        pipe = conn.pipeline()
+        pipe.exists(GATEKEEPERS_MIGRATED_KEY)
+        pipe.hgetall(GATEKEEPERS_KEY)
+        migrated, fields = pipe.execute()
+        if not migrated:
+            # the first process running this code migrates the legacy hashes
+            cls.migrate_legacy_gatekeepers()
+            fields = conn.hgetall(GATEKEEPERS_KEY)
+
+        snapshot = {}
+        for field, value in fields.items():
+            gk_name, key = field.decode('utf-8').rsplit(':', 1)
+            snapshot.setdefault(gk_name, {})[key] = value.decode('utf-8')
+        return snapshot
+
+    @classmethod
+    def get_snapshot(cls):
+        pinned_snapshots = getattr(_pinned, 'snapshots', None)
+        if pinned_snapshots:
+            return pinned_snapshots[-1]
+        cls._start_listener()
+        snapshot = cls._snapshot
+        if snapshot is None or time.time() - cls._snapshot_loaded_at >= GATEKEEPER_SNAPSHOT_TTL:
+            generation = cls._generation
+            loaded_at = time.time()
+            snapshot = cls.load_snapshot()
+            # an invalidation arrived during the load, the snapshot may miss
+            # the change so it is used for this check only
+            if generation == cls._generation:
+                cls._snapshot, cls._snapshot_loaded_at = snapshot, loaded_at
+        return snapshot
+
+    @classmethod
+    def invalidate_snapshot(cls):
+        cls._generation += 1
+        cls._snapshot = None
+
+    @classmethod
+    def pin_snapshot(cls):
+        """
+        returns a token for unpin_snapshot, pins nest so an eager celery task
+        inside a request keeps the snapshot of the request
+        """
+        snapshot = cls.get_snapshot()
+        if getattr(_pinned, 'snapshots', None) is None:
+            _pinned.snapshots = []
+        _pinned.snapshots.append(snapshot)
+        return len(_pinned.snapshots) - 1
 
-        redis_hash = conn.hgetall(name)
+    @classmethod
+    def unpin_snapshot(cls, token):
+        del _pinned.snapshots[token:]
+
+    @classmethod
+    def _start_listener(cls):
+        # once per process, a forked worker needs its own thread
+        if GATEKEEPER_SNAPSHOT_TTL == 0 or cls._listener_pid == os.getpid():
+            return
+        cls._listener_pid = os.getpid()
+        threading.Thread(target=cls._listen, daemon=True).start()
+
+    @classmethod
+    def _listen(cls):
+        while True:
+            try:
+                pubsub = RedisClient.get_connection().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(GATEKEEPERS_CHANNEL)
+                # changes made while we were not subscribed
+                cls.invalidate_snapshot()
+                for _ in pubsub.listen():
+                    cls.invalidate_snapshot()
+            except Exception:
+                cls.invalidate_snapshot()
+                time.sleep(GATEKEEPER_LISTENER_RETRY_DELAY)
+
+    @classmethod
+    def get(cls, gk_name):
+        gk = cls.get_snapshot().get(gk_name, {})
         return {
-            'percent': int(redis_hash.get(b'percent', 0)),
-            'description': str(redis_hash.get(b'description', '')),
+            'percent': int(gk.get('percent', 0)),
+            'description': gk.get('description', ''),
         }
 
     @classmethod
     def set_kv(cls, gk_name, key, value):
         conn = RedisClient.get_connection()
-        name = f'gatekeeper:{gk_name}'
-        conn.hset(name, key, value)
+        pipe = conn.pipeline()
+        pipe.hset(GATEKEEPERS_KEY, f'{gk_name}:{key}', value)
+        pipe.publish(GATEKEEPERS_CHANNEL, gk_name)
+        pipe.execute()
+        cls.invalidate_snapshot()
 
     @classmethod
     def is_switch_on(cls, gk_name):
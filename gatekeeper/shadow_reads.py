@@ -0,0 +1,141 @@
+"""
+gradual migration of reads from mysql to hbase
+
+every read is routed per user with GateKeeper.in_gk on switch_<name>_to_hbase,
+so raising its percent moves more users to hbase once dual_write_<name>_to_hbase
+is on. for the percent of reads set on shadow_read_<name>, the other store is
+read as well, the results are compared and the latencies of both stores are
+recorded in a redis hash.
+get_stats gives the mismatches and the latency percentiles to ramp on.
+"""
+from gatekeeper.models import GateKeeper
+from twitter.cache import SHADOW_READ_STATS_PATTERN
+from utils.redis_client import RedisClient
+
+import random
+import time
+
+STORES = ('mysql', 'hbase')
+# upper bounds of the latency histogram buckets in milliseconds
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class ShadowRead(object):
+
+    @classmethod
+    def reads_from_hbase(cls, name, user_id):
+        """
+        below 100 the switch only routes reads to hbase while the
+        dual_write_<name>_to_hbase gatekeeper keeps it in sync with mysql,
+        at 100 the writes go to hbase only and every read follows
+        """
+        switch = 'switch_{}_to_hbase'.format(name)
+        if GateKeeper.is_switch_on(switch):
+            return True
+        if not GateKeeper.is_switch_on('dual_write_{}_to_hbase'.format(name)):
+            return False
+        return GateKeeper.in_gk(switch, int(user_id))
+
+    @classmethod
+    def is_sampled(cls, name):
+        return random.randrange(100) < GateKeeper.get('shadow_read_{}'.format(name))['percent']
+
+    @classmethod
+    def get_stats_key(cls, name):
+        return SHADOW_READ_STATS_PATTERN.format(name=name)
+
+    @classmethod
+    def get_bucket(cls, latency):
+        milliseconds = latency * 1000
+        for bucket in LATENCY_BUCKETS:
+            if milliseconds <= bucket:
+                return bucket
+        return 'inf'
+
+    @classmethod
+    def read(cls, name, user_id, read_mysql, read_hbase, normalize=None):
+        """
+        return the result of the store user_id is routed to, normalize maps
+        the results of both stores to comparable values
+        """
+        primary = 'hbase' if cls.reads_from_hbase(name, user_id) else 'mysql'
+        reads = {'mysql': read_mysql, 'hbase': read_hbase}
+        if not cls.is_sampled(name):
+            return reads[primary]()
+
+        results, latencies = {}, {}
+        for store in sorted(STORES, key=lambda store: store != primary):
+            started_at = time.time()
+            try:
+                results[store] = reads[store]()
+            except Exception:
+                # a broken shadow read must not fail the request
+                if store == primary:
+                    raise
+                cls.record(name, latencies, matched=None)
+                return results[primary]
+            latencies[store] = time.time() - started_at
+
+        if normalize is None:
+            normalize = lambda result: result
+        matched = normalize(results['mysql']) == normalize(results['hbase'])
+        cls.record(name, latencies, matched)
+        return results[primary]
+
+    @classmethod
+    def record(cls, name, latencies, matched):
+        """
+        matched is None if the shadow read failed
+        """
+        conn = RedisClient.get_connection()
+        key = cls.get_stats_key(name)
+        pipe = conn.pipeline()
+        pipe.hincrby(key, 'reads', 1)
+        if matched is None:
+            pipe.hincrby(key, 'errors', 1)
+        elif not matched:
+            pipe.hincrby(key, 'mismatches', 1)
+        for store, latency in latencies.items():
+            pipe.hincrby(key, '{}:{}'.format(store, cls.get_bucket(latency)), 1)
+        pipe.execute()
+
+    @classmethod
+    def get_percentile(cls, histogram, percentile):
+        total = sum(histogram.values())
+        if not total:
+            return None
+        count = 0
+        for bucket in list(LATENCY_BUCKETS) + ['inf']:
+            count += histogram.get(bucket, 0)
+            if count >= total * percentile:
+                return bucket
+
+    @classmethod
+    def get_stats(cls, name):
+        """
+        the latency percentiles are the upper bounds of their buckets in ms
+        """
+        conn = RedisClient.get_connection()
+        stats = {'reads': 0, 'mismatches': 0, 'errors': 0}
+        histograms = {store: {} for store in STORES}
+        for field, value in conn.hgetall(cls.get_stats_key(name)).items():
+            field = field.decode('utf-8')
+            if ':' not in field:
+                stats[field] = int(value)
+                continue
+            store, bucket = field.split(':')
+            bucket = bucket if bucket == 'inf' else int(bucket)
+            histograms[store][bucket] = int(value)
+
+        for store in STORES:
+            stats[store] = {
+                'reads': sum(histograms[store].values()),
+                'p50': cls.get_percentile(histograms[store], 0.5),
+                'p99': cls.get_percentile(histograms[store], 0.99),
+            }
+        return stats
+
+    @classmethod
+    def reset_stats(cls, name):
+        conn = RedisClient.get_connection()
+        conn.delete(cls.get_stats_key(name))
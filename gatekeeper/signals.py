@@ -0,0 +1,14 @@
+from gatekeeper.models import GateKeeper
+
+# tokens of the snapshots pinned by running tasks, by task id
+_task_tokens = {}
+
+
+def pin_task_snapshot(task_id=None, **kwargs):
+    _task_tokens[task_id] = GateKeeper.pin_snapshot()
+
+
+def unpin_task_snapshot(task_id=None, **kwargs):
+    token = _task_tokens.pop(task_id, None)
+    if token is not None:
+        GateKeeper.unpin_snapshot(token)
@@ -1,5 +1,9 @@
 from testing.testcases import TestCase
 from gatekeeper.models import GateKeeper
+from gatekeeper.shadow_reads import ShadowRead
+from twitter.cache import GATEKEEPERS_MIGRATED_KEY
+from unittest import mock
+from utils.redis_client import RedisClient
 
 
 class GateKeeperTests(TestCase):
@@ -20,3 +24,79 @@ class GateKeeperTests(TestCase):
         GateKeeper.set_kv('gk_name', 'percent', 100)
         self.assertEqual(GateKeeper.is_switch_on('gk_name'), True)
         self.assertEqual(GateKeeper.in_gk('gk_name', 1), True)
+
+    def test_shadow_read(self):
+        GateKeeper.set_kv('switch_test_to_hbase', 'percent', 50)
+        # without dual writes hbase is incomplete, every read goes to mysql
+        self.assertEqual(ShadowRead.reads_from_hbase('test', 1), False)
+        GateKeeper.turn_on('dual_write_test_to_hbase')
+        read_mysql = lambda: [2, 1]
+        read_hbase = lambda: [1, 2]
+
+        # routed by user id, nothing recorded without sampling
+        self.assertEqual(ShadowRead.read('test', 1, read_mysql, read_hbase), [1, 2])
+        self.assertEqual(ShadowRead.read('test', 51, read_mysql, read_hbase), [2, 1])
+        self.assertEqual(ShadowRead.get_stats('test')['reads'], 0)
+
+        GateKeeper.turn_on('shadow_read_test')
+        self.assertEqual(ShadowRead.read('test', 51, read_mysql, read_hbase), [2, 1])
+        ShadowRead.read('test', 51, read_mysql, read_hbase, normalize=sorted)
+
+        def broken_read():
+            raise Exception('hbase is down')
+        self.assertEqual(ShadowRead.read('test', 51, read_mysql, broken_read), [2, 1])
+
+        stats = ShadowRead.get_stats('test')
+        self.assertEqual(stats['reads'], 3)
+        self.assertEqual(stats['mismatches'], 1)
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['mysql']['reads'], 3)
+        self.assertEqual(stats['hbase']['reads'], 2)
+        self.assertEqual(stats['hbase']['p99'], 1)
+
+        ShadowRead.reset_stats('test')
+        self.assertEqual(ShadowRead.get_stats('test')['reads'], 0)
+
+    def test_snapshot(self):
+        GateKeeper.set_kv('gk_name', 'percent', 20)
+        GateKeeper.set_kv('gk_name', 'description', 'hbase:newsfeeds')
+        snapshot = GateKeeper.get_snapshot()
+        self.assertEqual(snapshot['gk_name'], {'percent': '20', 'description': 'hbase:newsfeeds'})
+        self.assertEqual(snapshot['switch_newsfeed_to_hbase'], {'percent': '100'})
+        self.assertEqual(GateKeeper.get('gk_name'), {'percent': 20, 'description': 'hbase:newsfeeds'})
+
+    def test_pinned_snapshot(self):
+        token = GateKeeper.pin_snapshot()
+        try:
+            GateKeeper.set_kv('switch_newsfeed_to_hbase', 'percent', 0)
+            self.assertEqual(GateKeeper.is_switch_on('switch_newsfeed_to_hbase'), True)
+        finally:
+            GateKeeper.unpin_snapshot(token)
+        self.assertEqual(GateKeeper.is_switch_on('switch_newsfeed_to_hbase'), False)
+
+    def test_legacy_gatekeepers(self):
+        conn = RedisClient.get_connection()
+        conn.hset('gatekeeper:legacy_gk', 'percent', 100)
+        conn.hset('gatekeeper:switch_newsfeed_to_hbase', 'percent', 0)
+        conn.delete(GATEKEEPERS_MIGRATED_KEY)
+        GateKeeper.invalidate_snapshot()
+
+        # copied on the first load, the values of the new hash win
+        self.assertEqual(GateKeeper.is_switch_on('legacy_gk'), True)
+        self.assertEqual(GateKeeper.is_switch_on('switch_newsfeed_to_hbase'), True)
+        self.assertEqual(conn.exists(GATEKEEPERS_MIGRATED_KEY), 1)
+
+    def test_invalidated_during_load(self):
+        load_snapshot = GateKeeper.load_snapshot
+
+        def _load_snapshot():
+            snapshot = load_snapshot()
+            # the change is published after the hash was read
+            GateKeeper.set_kv('gk_name', 'percent', 100)
+            return snapshot
+
+        with mock.patch.object(GateKeeper, 'load_snapshot', side_effect=_load_snapshot):
+            GateKeeper.invalidate_snapshot()
+            self.assertEqual(GateKeeper.is_switch_on('gk_name'), False)
+        # the stale load was not kept
+        self.assertEqual(GateKeeper.is_switch_on('gk_name'), True)
@@ -1,8 +1,12 @@
+from inbox.services import NotificationService
 from rest_framework import serializers
 from notifications.models import Notification
 
 
 class NotificationSerializer(serializers.ModelSerializer):
+    # aggregated notifications, actor_object_id is the latest actor
+    actor_count = serializers.SerializerMethodField()
+    recent_actor_ids = serializers.SerializerMethodField()
 
     class Meta:
         model = Notification
@@ -10,6 +14,8 @@ class NotificationSerializer(serializers.ModelSerializer):
             'id',
             'actor_content_type',
             'actor_object_id',
+            'actor_count',
+            'recent_actor_ids',
             'verb',
             'action_object_content_type',
             'action_object_object_id',
@@ -19,6 +25,17 @@ class NotificationSerializer(serializers.ModelSerializer):
             'unread',
         )
 
+    def get_actor_count(self, obj):
+        if not obj.data:
+            return 1
+        return obj.data['actor_count']
+
+    def get_recent_actor_ids(self, obj):
+        if not obj.data:
+            return [int(obj.actor_object_id)]
+        return obj.data['actor_ids']
+
+
 class NotificationSerializerForUpdate(serializers.ModelSerializer):
     unread = serializers.BooleanField()
 
@@ -27,6 +44,4 @@ class NotificationSerializerForUpdate(serializers.ModelSerializer):
         fields = ('unread',)
 
     def update(self, instance, validated_data):
-        instance.unread = validated_data['unread']
-        instance.save()
-        return instance
\ No newline at end of file
+        return NotificationService.set_unread(instance, validated_data['unread'])
\ No newline at end of file
@@ -1,5 +1,6 @@
 from notifications.models import Notification
 from testing.testcases import TestCase
+from utils.paginations import KeysetPagination
 
 COMMENT_URL = '/api/comments/'
 LIKE_URL = '/api/likes/'
@@ -34,6 +35,7 @@ class NotificationTests(TestCase):
 class NotificationApiTests(TestCase):
 
     def setUp(self):
+        super(NotificationApiTests, self).setUp()
         self.jesse, self.jesse_client = self.create_user_and_client('jesse')
         self.eliza, self.eliza_client = self.create_user_and_client('eliza')
         self.jesse_tweet = self.create_tweet(self.jesse)
@@ -96,19 +98,68 @@ class NotificationApiTests(TestCase):
         self.assertEqual(response.status_code, 403)
         response = self.eliza_client.get(NOTIFICATION_URL)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.data['count'], 0)
+        self.assertEqual(len(response.data['results']), 0)
         response = self.jesse_client.get(NOTIFICATION_URL)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(response.data['has_next_page'], False)
         notification = self.jesse.notifications.first()
-        notification.unread = False
-        notification.save()
+        self.jesse_client.put(
+            '/api/notifications/{}/'.format(notification.id),
+            {'unread': False},
+        )
         response = self.jesse_client.get(NOTIFICATION_URL)
-        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(response.data['results'][0]['unread'], False)
         response = self.jesse_client.get(NOTIFICATION_URL, {'unread': True})
-        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(len(response.data['results']), 1)
         response = self.jesse_client.get(NOTIFICATION_URL, {'unread': False})
-        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_list_pagination(self):
+        page_size = KeysetPagination.page_size
+        tweets = [self.create_tweet(self.jesse) for _ in range(page_size * 2)]
+        for tweet in tweets:
+            self.create_like(self.eliza, tweet)
+        notifications = list(self.jesse.notifications.order_by('-timestamp', '-id'))
+        # rows sharing a timestamp are ordered by id
+        Notification.objects.filter(id__in=[
+            notification.id for notification in notifications
+        ]).update(timestamp=notifications[0].timestamp)
+        notifications = list(self.jesse.notifications.order_by('-timestamp', '-id'))
+
+        response = self.jesse_client.get(NOTIFICATION_URL)
+        self.assertEqual(response.data['has_next_page'], True)
+        results = response.data['results']
+        self.assertEqual(
+            [result['id'] for result in results],
+            [notification.id for notification in notifications[:page_size]],
+        )
+
+        response = self.jesse_client.get(NOTIFICATION_URL, {
+            'timestamp__lt': results[-1]['timestamp'],
+            'id__lt': results[-1]['id'],
+        })
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual(
+            [result['id'] for result in response.data['results']],
+            [notification.id for notification in notifications[page_size:]],
+        )
+
+        # an aggregated like bumps its notification to the head
+        self.create_like(self.create_user('linghu'), tweets[0])
+        response = self.jesse_client.get(NOTIFICATION_URL, {
+            'timestamp__gt': results[0]['timestamp'],
+            'id__gt': results[0]['id'],
+        })
+        self.assertEqual(
+            [result['id'] for result in response.data['results']],
+            [notifications[-1].id],
+        )
+        self.assertEqual(response.data['results'][0]['actor_count'], 2)
+
+        response = self.jesse_client.get(NOTIFICATION_URL, {'timestamp__lt': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
 
     def test_update(self):
         self.eliza_client.post(LIKE_URL, {
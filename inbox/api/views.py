@@ -3,35 +3,46 @@ from inbox.api.serializers import (
     NotificationSerializer,
     NotificationSerializerForUpdate,
 )
+from inbox.services import NotificationService
 from ratelimit.decorators import ratelimit
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from utils.decorators import required_params
+from utils.paginations import KeysetPagination
 
 
-class NotificationViewSet(
-    viewsets.GenericViewSet,
-    viewsets.mixins.ListModelMixin,
-):
+class NotificationViewSet(viewsets.GenericViewSet):
     serializer_class = NotificationSerializer
     permission_classes = (IsAuthenticated,)
     filterset_fields = ('unread',)
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         return self.request.user.notifications.all()
 
+    def list(self, request, *args, **kwargs):
+        page = None
+        # the cached list is not filtered, filtered pages come from the database
+        if 'unread' not in request.query_params:
+            cached_notifications = NotificationService.get_cached_notifications(request.user.id)
+            page = self.paginator.paginate_cached_list(cached_notifications, request)
+        if page is None:
+            page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        serializer = NotificationSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     @action(methods=['GET'], detail=False, url_path='unread-count')
     @method_decorator(ratelimit(key='user', rate='3/s', method='GET', block=True))
     def unread_count(self, request, *args, **kwargs):
-        count = self.get_queryset().filter(unread=True).count()
+        count = NotificationService.get_unread_count(request.user.id)
         return Response({'unread_count': count}, status=status.HTTP_200_OK)
 
     @action(methods=['POST'], detail=False, url_path='mark-all-as-read')
     @method_decorator(ratelimit(key='user', rate='3/s', method='POST', block=True))
     def mark_all_as_read(self, request, *args, **kwargs):
-        updated_count = self.get_queryset().update(unread=False)
+        updated_count = NotificationService.mark_all_as_read(request.user)
         return Response({'marked_count': updated_count}, status=status.HTTP_200_OK)
 
     @required_params(method='POST', params=['unread'])
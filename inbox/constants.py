@@ -0,0 +1,13 @@
+# notifications with the same recipient, verb and target within this window
+# (in seconds) are aggregated into one, e.g. "jesse and 24 others liked your tweet"
+NOTIFICATION_AGGREGATION_WINDOW = 86400
+# how many of the latest actors an aggregated notification keeps
+NOTIFICATION_RECENT_ACTORS_LIMIT = 5
+# the first sender of a bucket claims it while it creates the notification,
+# the others wait for its id, see NotificationService.claim_aggregation_key
+NOTIFICATION_CLAIMED = 'claimed'
+NOTIFICATION_CLAIM_TIMEOUT = 10  # in seconds
+NOTIFICATION_CLAIM_RETRY_DELAY = 0.05  # in seconds
+
+# unread counters, see NotificationService.get_unread_count
+UNREAD_COUNTS_RECONCILE_BATCH_SIZE = 1000
@@ -1,7 +1,30 @@
 from comments.models import Comment
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from notifications.signals import notify
+from django.db import transaction
+from django.utils import timezone
+from inbox.constants import (
+    NOTIFICATION_AGGREGATION_WINDOW,
+    NOTIFICATION_CLAIM_RETRY_DELAY,
+    NOTIFICATION_CLAIM_TIMEOUT,
+    NOTIFICATION_CLAIMED,
+    NOTIFICATION_RECENT_ACTORS_LIMIT,
+    UNREAD_COUNTS_RECONCILE_BATCH_SIZE,
+)
+from notifications.models import Notification
 from tweets.models import Tweet
+from twitter.cache import (
+    AGGREGATED_NOTIFICATION_ACTORS_PATTERN,
+    AGGREGATED_NOTIFICATION_PATTERN,
+    UNREAD_COUNTS_DIRTY_USERS_KEY,
+    USER_NOTIFICATIONS_PATTERN,
+    USER_UNREAD_NOTIFICATIONS_PATTERN,
+)
+from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
+from utils.redis_serializers import DjangoModelSerializer
+
+import time
 
 
 class NotificationService(object):
@@ -12,27 +35,262 @@ class NotificationService(object):
         if like.user == target.user:
             return
         if like.content_type == ContentType.objects.get_for_model(Tweet):
-            notify.send(
-                like.user,
-                recipient=target.user,
-                verb='liked your tweet',
-                target=target,
-            )
+            cls.send_aggregated_notification(like.user, target.user, 'liked your tweet', target)
         if like.content_type == ContentType.objects.get_for_model(Comment):
-            notify.send(
-                like.user,
-                recipient=target.user,
-                verb='liked your comment',
-                target=target,
-            )
+            cls.send_aggregated_notification(like.user, target.user, 'liked your comment', target)
 
     @classmethod
     def send_comment_notification(cls, comment):
         if comment.user == comment.tweet.user:
             return
-        notify.send(
+        cls.send_aggregated_notification(
             comment.user,
-            recipient=comment.tweet.user,
-            verb='commented your tweet',
-            target=comment.tweet,
-        )
\ No newline at end of file
+            comment.tweet.user,
+            'commented your tweet',
+            comment.tweet,
+        )
+
+    @classmethod
+    def get_aggregation_bucket(cls):
+        return int(time.time()) // NOTIFICATION_AGGREGATION_WINDOW
+
+    @classmethod
+    def get_aggregation_key(cls, recipient, verb, target, bucket=None):
+        if bucket is None:
+            bucket = cls.get_aggregation_bucket()
+        content_type = ContentType.objects.get_for_model(target.__class__)
+        return AGGREGATED_NOTIFICATION_PATTERN.format(
+            recipient_id=recipient.id,
+            verb=verb.replace(' ', '_'),
+            target='{}.{}'.format(content_type.model, target.id),
+            bucket=bucket,
+        )
+
+    @classmethod
+    def claim_aggregation_key(cls, key):
+        """
+        returns the id of the notification of the bucket, or None if the
+        caller claimed the bucket and has to create the notification. the
+        other senders wait for the id meanwhile, so two first actors do not
+        both create one. a claim not filled in time (its sender died)
+        expires and is taken over, so the wait is bounded by its timeout.
+        """
+        conn = RedisClient.get_connection()
+        while True:
+            if conn.set(key, NOTIFICATION_CLAIMED, nx=True, ex=NOTIFICATION_CLAIM_TIMEOUT):
+                return None
+            notification_id = conn.get(key)
+            if notification_id is not None and notification_id.decode('utf-8') != NOTIFICATION_CLAIMED:
+                return int(notification_id)
+            time.sleep(NOTIFICATION_CLAIM_RETRY_DELAY)
+
+    @classmethod
+    def add_aggregated_actor(cls, notification, actor_ids, actor_id, expire_at):
+        """
+        add actor_id to the distinct actors of the notification, returns
+        True if it was not in yet. the set is seeded with actor_ids, the
+        latest actors, if it expired before the notification. it expires at
+        expire_at, the end of the bucket, no actor is added after that.
+        """
+        conn = RedisClient.get_connection()
+        key = AGGREGATED_NOTIFICATION_ACTORS_PATTERN.format(notification_id=notification.id)
+        pipe = conn.pipeline()
+        pipe.exists(key)
+        pipe.sadd(key, actor_id)
+        pipe.expireat(key, expire_at)
+        exists, added, _ = pipe.execute()
+        if not exists:
+            conn.sadd(key, *actor_ids)
+            return actor_id not in actor_ids
+        return bool(added)
+
+    @classmethod
+    def send_aggregated_notification(cls, actor, recipient, verb, target):
+        """
+        upsert the notification of (recipient, verb, target) in the current
+        time bucket instead of inserting one per actor. data keeps the number
+        of distinct actors and the latest ones, the actor column is the
+        latest actor.
+        """
+        conn = RedisClient.get_connection()
+        bucket = cls.get_aggregation_bucket()
+        bucket_end = (bucket + 1) * NOTIFICATION_AGGREGATION_WINDOW
+        key = cls.get_aggregation_key(recipient, verb, target, bucket)
+        notification_id = cls.claim_aggregation_key(key)
+        # load the counter before the write so that the load does not count it
+        cls.get_unread_count(recipient.id)
+
+        with transaction.atomic():
+            notification, stale_data = None, None
+            if notification_id is not None:
+                notification = Notification.objects.select_for_update().filter(
+                    id=notification_id,
+                    recipient=recipient,
+                ).first()
+            if notification is None:
+                notification = Notification.objects.create(
+                    recipient=recipient,
+                    actor=actor,
+                    verb=verb,
+                    target=target,
+                    # keys in the order mysql stores json objects in (by
+                    # length), so the cached copy serializes as a loaded one
+                    # and push_notification can LREM it
+                    data={'actor_ids': [actor.id], 'actor_count': 1},
+                )
+                cls.add_aggregated_actor(notification, [], actor.id, bucket_end)
+                was_unread = False
+            else:
+                stale_data = DjangoModelSerializer.serialize(notification)
+                data = notification.data or {
+                    'actor_count': 1,
+                    'actor_ids': [int(notification.actor_object_id)],
+                }
+                if cls.add_aggregated_actor(notification, data['actor_ids'], actor.id, bucket_end):
+                    data['actor_count'] += 1
+                data['actor_ids'] = ([actor.id] + [
+                    actor_id
+                    for actor_id in data['actor_ids']
+                    if actor_id != actor.id
+                ])[:NOTIFICATION_RECENT_ACTORS_LIMIT]
+                was_unread = notification.unread
+                notification.actor = actor
+                notification.data = {
+                    'actor_ids': data['actor_ids'],
+                    'actor_count': data['actor_count'],
+                }
+                notification.unread = True
+                notification.timestamp = timezone.now()
+                notification.save()
+        if notification.id != notification_id:
+            # only once committed, the other senders would not see the row
+            pipe = conn.pipeline()
+            pipe.set(key, notification.id)
+            pipe.expireat(key, bucket_end)
+            pipe.execute()
+        if not was_unread:
+            cls.incr_unread_count(recipient.id)
+        cls.push_notification(notification, stale_data)
+        return notification
+
+    @classmethod
+    def get_notifications_key(cls, user_id):
+        return USER_NOTIFICATIONS_PATTERN.format(user_id=user_id)
+
+    @classmethod
+    def get_cached_notifications(cls, user_id):
+        def _lazy_load(limit):
+            return Notification.objects.filter(
+                recipient_id=user_id,
+            ).order_by('-timestamp', '-id')[:limit]
+        notifications = RedisHelper.load_objects(cls.get_notifications_key(user_id), _lazy_load)
+        # concurrent sends may push out of order, or leave a copy behind if
+        # the cached one differed, the pagination needs (timestamp, id) order
+        latest = {}
+        for notification in notifications:
+            latest.setdefault(notification.id, notification)
+        return sorted(
+            latest.values(),
+            key=lambda notification: (notification.timestamp, notification.id),
+            reverse=True,
+        )
+
+    @classmethod
+    def push_notification(cls, notification, stale_data=None):
+        """
+        move the sent notification to the head of the cached list, stale_data
+        is its previous copy as serialized before an aggregation bumped it.
+        the list is not loaded here, most recipients do not open their inbox
+        before it expires.
+        """
+        RedisHelper.push_cached_object(
+            cls.get_notifications_key(notification.recipient_id),
+            notification,
+            stale_data,
+        )
+
+    @classmethod
+    def get_unread_count_key(cls, user_id):
+        return USER_UNREAD_NOTIFICATIONS_PATTERN.format(user_id=user_id)
+
+    @classmethod
+    def get_unread_count(cls, user_id):
+        """
+        one GET, the counter is counted in the database on a miss
+        """
+        conn = RedisClient.get_connection()
+        key = cls.get_unread_count_key(user_id)
+        count = conn.get(key)
+        if count is None:
+            count = Notification.objects.filter(recipient_id=user_id, unread=True).count()
+            # nx, do not clobber a counter loaded meanwhile
+            conn.set(key, count, ex=settings.REDIS_KEY_EXPIRE_TIME, nx=True)
+        # a decrement racing with a reset may go below 0 until reconciled
+        return max(int(count), 0)
+
+    @classmethod
+    def incr_unread_count(cls, user_id, delta=1):
+        """
+        the counter has to be loaded (get_unread_count) before the
+        notifications are written, otherwise the first load counts them too.
+        the user is marked dirty so reconcile_unread_counts fixes any drift.
+        """
+        conn = RedisClient.get_connection()
+        pipe = conn.pipeline()
+        pipe.incrby(cls.get_unread_count_key(user_id), delta)
+        pipe.sadd(UNREAD_COUNTS_DIRTY_USERS_KEY, user_id)
+        pipe.execute()
+
+    @classmethod
+    def decr_unread_count(cls, user_id):
+        cls.incr_unread_count(user_id, delta=-1)
+
+    @classmethod
+    def set_unread(cls, notification, unread):
+        if notification.unread == unread:
+            return notification
+        cls.get_unread_count(notification.recipient_id)
+        stale_data = DjangoModelSerializer.serialize(notification)
+        notification.unread = unread
+        notification.save()
+        cls.incr_unread_count(notification.recipient_id, 1 if unread else -1)
+        # a cached copy more recently aggregated does not match and is left
+        # alone, it was pushed after this one was read
+        RedisHelper.replace_cached_object(
+            cls.get_notifications_key(notification.recipient_id),
+            stale_data,
+            notification,
+        )
+        return notification
+
+    @classmethod
+    def mark_all_as_read(cls, user):
+        marked_count = user.notifications.update(unread=False)
+        conn = RedisClient.get_connection()
+        pipe = conn.pipeline()
+        pipe.set(cls.get_unread_count_key(user.id), 0, ex=settings.REDIS_KEY_EXPIRE_TIME)
+        # reloaded on the next list, a rewrite could race with a send
+        pipe.delete(cls.get_notifications_key(user.id))
+        # a notification sent between the update and the reset is not counted
+        pipe.sadd(UNREAD_COUNTS_DIRTY_USERS_KEY, user.id)
+        pipe.execute()
+        return marked_count
+
+    @classmethod
+    def reconcile_unread_counts(cls):
+        """
+        recount the counters of the users changed since the last run in the
+        database, called periodically by celery beat
+        """
+        conn = RedisClient.get_connection()
+        user_ids = [
+            int(user_id)
+            for user_id in conn.spop(
+                UNREAD_COUNTS_DIRTY_USERS_KEY,
+                UNREAD_COUNTS_RECONCILE_BATCH_SIZE,
+            ) or []
+        ]
+        for user_id in user_ids:
+            count = Notification.objects.filter(recipient_id=user_id, unread=True).count()
+            conn.set(cls.get_unread_count_key(user_id), count, ex=settings.REDIS_KEY_EXPIRE_TIME)
+        return len(user_ids)
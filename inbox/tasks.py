@@ -0,0 +1,9 @@
+from celery import shared_task
+from utils.time_constants import ONE_HOUR
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def reconcile_unread_counts_task():
+    from inbox.services import NotificationService
+    count = NotificationService.reconcile_unread_counts()
+    return 'unread notification counts of {} users reconciled.'.format(count)
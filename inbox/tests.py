@@ -1,33 +1,164 @@
-from testing.testcases import TestCase
+from comments.models import Comment
+from django.contrib.contenttypes.models import ContentType
+from inbox.constants import NOTIFICATION_AGGREGATION_WINDOW
 from inbox.services import NotificationService
+from likes.models import Like
 from notifications.models import Notification
+from testing.testcases import TestCase
+from tweets.models import Tweet
+from twitter.cache import AGGREGATED_NOTIFICATION_ACTORS_PATTERN
+from utils.redis_client import RedisClient
+
+import time
 
 
 class NotificationServiceTests(TestCase):
 
     def setUp(self):
+        super(NotificationServiceTests, self).setUp()
         self.jesse = self.create_user('jesse')
         self.eliza = self.create_user('eliza')
         self.jesse_tweet = self.create_tweet(self.jesse)
 
+    # likes and comments saved through the orm already send their
+    # notifications through EngagementService, so these are not saved
+
     def test_send_comment_notification(self):
         # do not dispatch notification if tweet user == comment user
-        comment = self.create_comment(self.jesse, self.jesse_tweet)
+        comment = Comment(user=self.jesse, tweet=self.jesse_tweet)
         NotificationService.send_comment_notification(comment)
         self.assertEqual(Notification.objects.count(), 0)
 
         # dispatch notification if tweet user != comment user
-        comment = self.create_comment(self.eliza, self.jesse_tweet)
+        comment = Comment(user=self.eliza, tweet=self.jesse_tweet)
         NotificationService.send_comment_notification(comment)
         self.assertEqual(Notification.objects.count(), 1)
 
     def test_send_like_notification(self):
         # do not dispatch notification if tweet user == like user
-        like = self.create_like(self.jesse, self.jesse_tweet)
+        like = Like(
+            user=self.jesse,
+            content_type=ContentType.objects.get_for_model(Tweet),
+            object_id=self.jesse_tweet.id,
+        )
         NotificationService.send_like_notification(like)
         self.assertEqual(Notification.objects.count(), 0)
 
-        # dispatch notification if tweet user != comment user
-        like = self.create_comment(self.eliza, self.jesse_tweet)
-        NotificationService.send_comment_notification(like)
+        # dispatch notification if tweet user != like user
+        like = Like(
+            user=self.eliza,
+            content_type=ContentType.objects.get_for_model(Tweet),
+            object_id=self.jesse_tweet.id,
+        )
+        NotificationService.send_like_notification(like)
         self.assertEqual(Notification.objects.count(), 1)
+
+    def test_engagement_notifications(self):
+        self.create_like(self.eliza, self.jesse_tweet)
+        self.create_comment(self.eliza, self.jesse_tweet)
+        self.create_like(self.jesse, self.jesse_tweet)
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_aggregated_notification(self):
+        users = [self.create_user('user{}'.format(i)) for i in range(7)]
+        for user in users:
+            self.create_like(user, self.jesse_tweet)
+        self.create_like(self.eliza, self.jesse_tweet).delete()
+        self.create_like(self.eliza, self.jesse_tweet)
+
+        # one row for all the likes, the comment is a different verb
+        self.create_comment(self.eliza, self.jesse_tweet)
+        self.assertEqual(Notification.objects.count(), 2)
+        notification = Notification.objects.get(verb='liked your tweet')
+        self.assertEqual(notification.data['actor_count'], 8)
+        self.assertEqual(
+            notification.data['actor_ids'],
+            [self.eliza.id] + [user.id for user in users[::-1][:4]],
+        )
+        self.assertEqual(int(notification.actor_object_id), self.eliza.id)
+
+        # an actor out of the latest ones is still only counted once
+        Like.objects.get(user=users[0], object_id=self.jesse_tweet.id).delete()
+        self.create_like(users[0], self.jesse_tweet)
+        notification.refresh_from_db()
+        self.assertEqual(notification.data['actor_count'], 8)
+        self.assertEqual(notification.data['actor_ids'][0], users[0].id)
+
+    def test_cached_notifications(self):
+        self.create_like(self.eliza, self.jesse_tweet)
+        self.create_comment(self.eliza, self.jesse_tweet)
+        self.assertEqual(len(NotificationService.get_cached_notifications(self.jesse.id)), 2)
+
+        # an aggregated notification moves to the head, its stale copy is removed
+        self.create_like(self.create_user('linghu'), self.jesse_tweet)
+        key = NotificationService.get_notifications_key(self.jesse.id)
+        self.assertEqual(RedisClient.get_connection().llen(key), 2)
+        notifications = NotificationService.get_cached_notifications(self.jesse.id)
+        self.assertEqual(
+            [notification.verb for notification in notifications],
+            ['liked your tweet', 'commented your tweet'],
+        )
+        self.assertEqual(notifications[0].data['actor_count'], 2)
+
+        # the flag is updated in place
+        NotificationService.set_unread(notifications[1], False)
+        notifications = NotificationService.get_cached_notifications(self.jesse.id)
+        self.assertEqual([notification.unread for notification in notifications], [True, False])
+        self.assertEqual(RedisClient.get_connection().llen(key), 2)
+        self.assertEqual(
+            notifications,
+            list(Notification.objects.filter(recipient=self.jesse).order_by('-timestamp', '-id')),
+        )
+
+    def test_claim_aggregation_key(self):
+        key = NotificationService.get_aggregation_key(self.jesse, 'liked your tweet', self.jesse_tweet)
+        # the first sender claims the bucket, the next ones get its notification
+        self.assertEqual(NotificationService.claim_aggregation_key(key), None)
+        RedisClient.get_connection().set(key, 42)
+        self.assertEqual(NotificationService.claim_aggregation_key(key), 42)
+
+        # a claim is waited for, then taken over once it expired
+        conn = RedisClient.get_connection()
+        conn.set(key, 'claimed', px=200)
+        self.assertEqual(NotificationService.claim_aggregation_key(key), None)
+        self.assertEqual(conn.get(key), b'claimed')
+
+    def test_aggregated_actors_expire_with_the_bucket(self):
+        self.create_like(self.eliza, self.jesse_tweet)
+        notification = Notification.objects.get(recipient=self.jesse)
+        bucket = NotificationService.get_aggregation_bucket()
+        key = AGGREGATED_NOTIFICATION_ACTORS_PATTERN.format(notification_id=notification.id)
+        self.create_like(self.create_user('linghu'), self.jesse_tweet)
+        ttl = RedisClient.get_connection().ttl(key)
+        bucket_end = (bucket + 1) * NOTIFICATION_AGGREGATION_WINDOW
+        self.assertEqual(0 < ttl <= bucket_end - int(time.time()) + 1, True)
+
+    def test_unread_count(self):
+        like = self.create_like(self.eliza, self.jesse_tweet)
+        self.assertEqual(NotificationService.get_unread_count(self.jesse.id), 1)
+
+        # aggregated into the same unread notification
+        self.create_like(self.create_user('linghu'), self.jesse_tweet)
+        self.assertEqual(NotificationService.get_unread_count(self.jesse.id), 1)
+
+        notification = Notification.objects.get(recipient=self.jesse)
+        NotificationService.set_unread(notification, False)
+        NotificationService.set_unread(notification, False)
+        self.assertEqual(NotificationService.get_unread_count(self.jesse.id), 0)
+
+        # a read notification becomes unread again
+        like.delete()
+        self.create_like(self.eliza, self.jesse_tweet)
+        self.assertEqual(NotificationService.get_unread_count(self.jesse.id), 1)
+
+        self.create_comment(self.eliza, self.jesse_tweet)
+        self.assertEqual(NotificationService.get_unread_count(self.jesse.id), 2)
+        self.assertEqual(NotificationService.mark_all_as_read(self.jesse), 2)
+        self.assertEqual(NotificationService.get_unread_count(self.jesse.id), 0)
+
+        # drift is fixed by the reconciliation
+        NotificationService.incr_unread_count(self.jesse.id, 3)
+        self.assertEqual(NotificationService.get_unread_count(self.jesse.id), 3)
+        self.assertEqual(NotificationService.reconcile_unread_counts(), 1)
+        self.assertEqual(NotificationService.get_unread_count(self.jesse.id), 0)
+        self.assertEqual(NotificationService.reconcile_unread_counts(), 0)
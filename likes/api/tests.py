@@ -1,4 +1,5 @@
 from testing.testcases import TestCase
+from tweets.services import TweetService
 from rest_framework.test import APIClient
 
 
@@ -209,11 +210,13 @@ class LikeApiTests(TestCase):
         tweet_url = TWEET_DETAIL_API.format(tweet.id)
         response = self.jesse_client.get(tweet_url)
         self.assertEqual(response.data['likes_count'], 1)
+        TweetService.flush_pending_counts()
         tweet.refresh_from_db()
         self.assertEqual(tweet.likes_count, 1)
 
         # eliza canceled likes
         self.jesse_client.post(LIKE_BASE_URL + 'cancel/', data)
+        TweetService.flush_pending_counts()
         tweet.refresh_from_db()
         self.assertEqual(tweet.likes_count, 0)
         response = self.eliza_client.get(tweet_url)
@@ -232,12 +235,14 @@ class LikeApiTests(TestCase):
             # check tweet api
             response = client.get(tweet_url)
             self.assertEqual(response.data['likes_count'], i + 1)
+            TweetService.flush_pending_counts()
             tweet.refresh_from_db()
             self.assertEqual(tweet.likes_count, i + 1)
 
         self.eliza_client.post(LIKE_BASE_URL, data)
         response = self.eliza_client.get(tweet_url)
         self.assertEqual(response.data['likes_count'], 4)
+        TweetService.flush_pending_counts()
         tweet.refresh_from_db()
         self.assertEqual(tweet.likes_count, 4)
 
@@ -250,6 +255,7 @@ class LikeApiTests(TestCase):
 
         # eliza canceled likes
         self.eliza_client.post(LIKE_BASE_URL + 'cancel/', data)
+        TweetService.flush_pending_counts()
         tweet.refresh_from_db()
         self.assertEqual(tweet.likes_count, 3)
         response = self.eliza_client.get(tweet_url)
@@ -1,5 +1,4 @@
 from django.utils.decorators import method_decorator
-from inbox.services import NotificationService
 from likes.api.serializers import (
     LikeSerializer,
     LikeSerializerForCancel,
@@ -31,9 +30,8 @@ class LikeViewSet(viewsets.GenericViewSet):
                 'message': 'Please check input',
                 'errors': serializer.errors,
             }, status=status.HTTP_400_BAD_REQUEST)
-        instance, created = serializer.get_or_create()
-        if created:
-            NotificationService.send_like_notification(instance)
+        # the notification is sent by the engagement pipeline, see EngagementService
+        instance, _ = serializer.get_or_create()
         return Response(
             LikeSerializer(instance).data,
             status=status.HTTP_201_CREATED,
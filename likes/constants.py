@@ -0,0 +1,4 @@
+# how many of the latest likes of a user are kept in redis
+RECENT_LIKES_LIMIT = 200
+# how many of the latest likes of an object are listed with it
+LIKES_LIST_LIMIT = 100
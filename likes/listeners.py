@@ -1,30 +1,23 @@
-from utils.redis_helper import RedisHelper
+from django.contrib.contenttypes.models import ContentType
 
 
 def incr_likes_count(sender, instance, created, **kwargs):
-    from tweets.models import Tweet
-    from django.db.models import F
-
     if not created:
         return
 
-    model_class = instance.content_type.model_class()
-    if model_class != Tweet:
-        return
+    from likes.services import LikeService
+    LikeService.update_like_index(instance, liked=True)
 
-    Tweet.objects.filter(id=instance.object_id).update(likes_count=F('likes_count') + 1)
-    tweet = instance.content_object
-    RedisHelper.incr_count(tweet, 'likes_count')
+    # counters, ranked newsfeeds and notifications are updated asynchronously
+    from tweets.services import EngagementService
+    model = ContentType.objects.get_for_id(instance.content_type_id).model
+    EngagementService.push_event(model, instance.object_id, 'like', instance.user_id)
 
 
 def decr_likes_count(sender, instance, **kwargs):
-    from tweets.models import Tweet
-    from django.db.models import F
-
-    model_class = instance.content_type.model_class()
-    if model_class != Tweet:
-        return
+    from likes.services import LikeService
+    LikeService.update_like_index(instance, liked=False)
 
-    Tweet.objects.filter(id=instance.object_id).update(likes_count=F('likes_count') - 1)
-    tweet = instance.content_object
-    RedisHelper.decr_count(tweet, 'likes_count')
+    from tweets.services import EngagementService
+    model = ContentType.objects.get_for_id(instance.content_type_id).model
+    EngagementService.push_event(model, instance.object_id, 'unlike', instance.user_id)
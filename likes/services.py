@@ -1,15 +1,219 @@
-from likes.models import Like
+from datetime import datetime
 from django.contrib.contenttypes.models import ContentType
+from likes.constants import LIKES_LIST_LIMIT, RECENT_LIKES_LIMIT
+from likes.models import Like
+from twitter.cache import (
+    OBJECT_LIKERS_PATTERN,
+    USER_LIKED_OBJECTS_PATTERN,
+    USER_RECENT_LIKES_PATTERN,
+)
+from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
+from utils.time_helpers import to_timestamp
+
+import pytz
+
+# redis drops empty (sorted) sets, this member tells "no likes" apart from
+# "not cached yet". no object or user has id 0.
+OBJECT_ID_SET_SENTINEL = 0
 
 
 class LikeService(object):
 
+    @classmethod
+    def get_liked_objects_key(cls, user_id, model_class):
+        """
+        key of the redis set holding the ids of the model_class objects
+        user_id has liked, the set is loaded from the database if needed
+        """
+        content_type = ContentType.objects.get_for_model(model_class)
+        return RedisHelper.load_set(
+            USER_LIKED_OBJECTS_PATTERN.format(model=content_type.model, user_id=user_id),
+            lambda: [OBJECT_ID_SET_SENTINEL] + list(Like.objects.filter(
+                content_type=content_type,
+                user_id=user_id,
+            ).values_list('object_id', flat=True)),
+        )
+
+    @classmethod
+    def _load_sorted_set(cls, key, load_mapping):
+        """
+        make sure the sorted set at key is cached, load_mapping returns
+        {member: score} and is only called if it is not
+        """
+        def _load_args():
+            mapping = load_mapping()
+            mapping[OBJECT_ID_SET_SENTINEL] = 0
+            args = []
+            for member, score in mapping.items():
+                args += [score, member]
+            return args
+
+        return RedisHelper.load_set(key, _load_args, command='ZADD')
+
+    @classmethod
+    def get_likers_key(cls, model_class, object_id):
+        """
+        key of the sorted set of the ids of the users who liked the object,
+        scored by when they liked it
+        """
+        content_type = ContentType.objects.get_for_model(model_class)
+        return cls._load_sorted_set(
+            OBJECT_LIKERS_PATTERN.format(model=content_type.model, object_id=object_id),
+            lambda: {
+                user_id: to_timestamp(created_at)
+                for user_id, created_at in Like.objects.filter(
+                    content_type=content_type,
+                    object_id=object_id,
+                ).values_list('user_id', 'created_at')
+            },
+        )
+
+    @classmethod
+    def get_recent_likes_key(cls, user_id):
+        """
+        key of the sorted set of the latest likes of user_id,
+        members are '<model>:<object_id>' scored by when they were liked
+        """
+        return cls._load_sorted_set(
+            USER_RECENT_LIKES_PATTERN.format(user_id=user_id),
+            lambda: {
+                '{}:{}'.format(model, object_id): to_timestamp(created_at)
+                for model, object_id, created_at in Like.objects.filter(
+                    user_id=user_id,
+                ).order_by('-created_at').values_list(
+                    'content_type__model',
+                    'object_id',
+                    'created_at',
+                )[:RECENT_LIKES_LIMIT]
+            },
+        )
+
+    @classmethod
+    def update_like_index(cls, like, liked):
+        """
+        called by the like listeners, keys that are not cached are left
+        alone and will be loaded with the like already in (or out of) mysql
+        """
+        model = ContentType.objects.get_for_id(like.content_type_id).model
+        liked_objects_key = USER_LIKED_OBJECTS_PATTERN.format(model=model, user_id=like.user_id)
+        likers_key = OBJECT_LIKERS_PATTERN.format(model=model, object_id=like.object_id)
+        recent_likes_key = USER_RECENT_LIKES_PATTERN.format(user_id=like.user_id)
+        recent_like = '{}:{}'.format(model, like.object_id)
+        timestamp = to_timestamp(like.created_at)
+
+        conn = RedisClient.get_connection()
+        pipe = conn.pipeline()
+        if liked:
+            RedisHelper.update_set(liked_objects_key, 'SADD', [like.object_id], pipe)
+            RedisHelper.update_set(likers_key, 'ZADD', [timestamp, like.user_id], pipe)
+            RedisHelper.update_set(recent_likes_key, 'ZADD', [timestamp, recent_like], pipe)
+            # the sentinel scored 0 is ranked first, keep it and the latest likes
+            pipe.zremrangebyrank(recent_likes_key, 1, -RECENT_LIKES_LIMIT - 1)
+        else:
+            RedisHelper.update_set(liked_objects_key, 'SREM', [like.object_id], pipe)
+            RedisHelper.update_set(likers_key, 'ZREM', [like.user_id], pipe)
+            RedisHelper.update_set(recent_likes_key, 'ZREM', [recent_like], pipe)
+        pipe.execute()
+
+    @classmethod
+    def get_likes_count(cls, obj):
+        return cls.get_likes_counts([obj])[obj.id]
+
+    @classmethod
+    def get_likes_counts(cls, objects):
+        """
+        {object_id: likes count} with ZCARD on the likers sets,
+        objects are expected to be of one model class
+        """
+        if not objects:
+            return {}
+        model = ContentType.objects.get_for_model(objects[0].__class__).model
+        conn = RedisClient.get_connection()
+        pipe = conn.pipeline()
+        for obj in objects:
+            pipe.zcard(OBJECT_LIKERS_PATTERN.format(model=model, object_id=obj.id))
+
+        counts = {}
+        for obj, count in zip(objects, pipe.execute()):
+            # a cached set holds at least the sentinel
+            if count == 0:
+                count = conn.zcard(cls.get_likers_key(obj.__class__, obj.id))
+            counts[obj.id] = count - 1
+        return counts
+
+    @classmethod
+    def get_likes(cls, obj, limit=LIKES_LIST_LIMIT):
+        """
+        at most limit likes of obj from the latest one, read from the likers
+        set. the Like objects are not saved, they only carry user_id and
+        created_at.
+        """
+        conn = RedisClient.get_connection()
+        key = cls.get_likers_key(obj.__class__, obj.id)
+        content_type = ContentType.objects.get_for_model(obj.__class__)
+        likes = [
+            Like(
+                user_id=int(user_id),
+                content_type=content_type,
+                object_id=obj.id,
+                created_at=datetime.fromtimestamp(score / 1000000, tz=pytz.utc),
+            )
+            for user_id, score in conn.zrevrange(key, 0, limit, withscores=True)
+            if int(user_id) != OBJECT_ID_SET_SENTINEL
+        ]
+        return likes[:limit]
+
+    @classmethod
+    def get_recent_likes(cls, user_id, limit=RECENT_LIKES_LIMIT):
+        """
+        [(model, object_id)] of the latest likes of user_id
+        """
+        conn = RedisClient.get_connection()
+        key = cls.get_recent_likes_key(user_id)
+        recent_likes = []
+        for member in conn.zrevrange(key, 0, limit):
+            member = member.decode('utf-8')
+            if member == str(OBJECT_ID_SET_SENTINEL):
+                continue
+            model, object_id = member.split(':')
+            recent_likes.append((model, int(object_id)))
+        return recent_likes[:limit]
+
     @classmethod
     def has_liked(cls, user, target):
-        if user.is_anonymous:
-            return False
-        return Like.objects.filter(
-            content_type=ContentType.objects.get_for_model(target.__class__),
-            object_id=target.id,
-            user=user,
-        ).exists()
+        return target.id in cls.has_liked_many(user, [target])
+
+    @classmethod
+    def has_liked_many(cls, user, objects):
+        """
+        ids of the objects user has liked, with one pipelined round trip of
+        SISMEMBER per model class instead of one query per object
+        """
+        objects_by_class = {}
+        for obj in objects:
+            objects_by_class.setdefault(obj.__class__, []).append(obj.id)
+        liked_object_ids = set()
+        for model_class, object_ids in objects_by_class.items():
+            liked_object_ids |= cls.get_liked_object_ids(user, model_class, object_ids)
+        return liked_object_ids
+
+    @classmethod
+    def get_liked_object_ids(cls, user, model_class, object_ids):
+        """
+        ids of the objects user has liked among object_ids
+        """
+        object_ids = list(object_ids)
+        if user.is_anonymous or not object_ids:
+            return set()
+
+        conn = RedisClient.get_connection()
+        key = cls.get_liked_objects_key(user.id, model_class)
+        pipe = conn.pipeline()
+        for object_id in object_ids:
+            pipe.sismember(key, object_id)
+        return set(
+            object_id
+            for object_id, liked in zip(object_ids, pipe.execute())
+            if liked
+        )
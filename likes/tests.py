@@ -0,0 +1,115 @@
+from likes.models import Like
+from likes.services import LikeService
+from testing.testcases import TestCase
+from twitter.cache import OBJECT_LIKERS_PATTERN, USER_RECENT_LIKES_PATTERN
+from unittest import mock
+from utils.redis_client import RedisClient
+
+
+class LikeServiceTests(TestCase):
+
+    def setUp(self):
+        super(LikeServiceTests, self).setUp()
+        self.jesse = self.create_user('jesse')
+        self.eliza = self.create_user('eliza')
+
+    def test_has_liked_many(self):
+        tweets = [self.create_tweet(self.eliza) for _ in range(3)]
+        comment = self.create_comment(self.eliza, tweets[0])
+        self.create_like(self.jesse, tweets[0])
+        self.create_like(self.jesse, comment)
+
+        # one lookup per model class, the sets are cached after the first one
+        with self.assertNumQueries(2):
+            liked = LikeService.has_liked_many(self.jesse, tweets + [comment])
+        self.assertEqual(liked, {tweets[0].id, comment.id})
+        with self.assertNumQueries(0):
+            self.assertEqual(LikeService.has_liked(self.jesse, tweets[1]), False)
+
+        # kept up to date by the like listeners
+        self.create_like(self.jesse, tweets[1])
+        self.assertEqual(LikeService.has_liked(self.jesse, tweets[1]), True)
+        like = self.create_like(self.jesse, tweets[0])
+        like.delete()
+        self.assertEqual(LikeService.has_liked_many(self.jesse, tweets), {tweets[1].id})
+        self.assertEqual(LikeService.has_liked_many(self.eliza, tweets), set())
+
+    def test_like_index(self):
+        tweet = self.create_tweet(self.eliza)
+        comment = self.create_comment(self.eliza, tweet)
+        self.create_like(self.eliza, tweet)
+        self.assertEqual(LikeService.get_likes_count(tweet), 1)
+        self.assertEqual(LikeService.get_likes_counts([comment]), {comment.id: 0})
+        self.assertEqual(LikeService.get_recent_likes(self.jesse.id), [])
+
+        # the cached sets are kept up to date by the like listeners
+        self.create_like(self.jesse, tweet)
+        self.create_like(self.jesse, comment)
+        self.assertEqual(LikeService.get_likes_count(tweet), 2)
+        self.assertEqual(LikeService.get_likes_counts([comment]), {comment.id: 1})
+        self.assertEqual(
+            [like.user_id for like in LikeService.get_likes(tweet)],
+            [self.jesse.id, self.eliza.id],
+        )
+        self.assertEqual(
+            LikeService.get_recent_likes(self.jesse.id),
+            [('comment', comment.id), ('tweet', tweet.id)],
+        )
+
+        self.create_like(self.jesse, tweet).delete()
+        self.assertEqual(LikeService.get_likes_count(tweet), 1)
+        self.assertEqual(LikeService.get_recent_likes(self.jesse.id), [('comment', comment.id)])
+
+        # rebuilt from the database on a miss
+        self.clear_cache()
+        self.assertEqual(LikeService.get_likes_count(tweet), 1)
+        self.assertEqual(LikeService.get_recent_likes(self.jesse.id), [('comment', comment.id)])
+
+    def test_like_index_limits(self):
+        tweets = [self.create_tweet(self.eliza) for _ in range(3)]
+        self.assertEqual(LikeService.get_recent_likes(self.jesse.id), [])
+        with mock.patch('likes.services.RECENT_LIKES_LIMIT', 2):
+            for tweet in tweets:
+                self.create_like(self.jesse, tweet)
+                self.create_like(self.eliza, tweet)
+
+        # the trim keeps the sentinel, the set is not loaded again
+        conn = RedisClient.get_connection()
+        key = USER_RECENT_LIKES_PATTERN.format(user_id=self.jesse.id)
+        self.assertEqual(conn.zcard(key), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                LikeService.get_recent_likes(self.jesse.id),
+                [('tweet', tweets[2].id), ('tweet', tweets[1].id)],
+            )
+
+        self.assertEqual(
+            [like.user_id for like in LikeService.get_likes(tweets[0], limit=1)],
+            [self.eliza.id],
+        )
+
+    def test_like_index_races(self):
+        tweet = self.create_tweet(self.eliza)
+        conn = RedisClient.get_connection()
+        key = OBJECT_LIKERS_PATTERN.format(model='tweet', object_id=tweet.id)
+
+        # a like of an object whose likers are not cached does not cache them
+        self.create_like(self.eliza, tweet)
+        self.assertEqual(conn.exists(key), 0)
+
+        # a like written after the loader read the database
+        loads = []
+
+        def _load_mapping():
+            mapping = {
+                like.user_id: 1
+                for like in Like.objects.filter(object_id=tweet.id)
+            }
+            if not loads:
+                self.create_like(self.jesse, tweet)
+            loads.append(mapping)
+            return mapping
+
+        LikeService._load_sorted_set(key, _load_mapping)
+        self.assertEqual(len(loads), 2)
+        self.assertEqual(LikeService.get_likes_count(tweet), 2)
@@ -13,7 +13,18 @@ class NewsFeedSerializer(serializers.Serializer):
         pass
 
     def get_tweet(self, obj):
-        return TweetSerializer(obj.cached_tweet, context=self.context).data
+        hydration = self.context.get('tweet_hydration')
+        if hydration is not None and obj.tweet_id in hydration.tweets:
+            tweet = hydration.tweets[obj.tweet_id]
+        else:
+            tweet = obj.cached_tweet
+        return TweetSerializer(tweet, context=self.context).data
 
     def get_created_at(self, obj):
         return obj.created_at
+
+
+class RankedNewsFeedSerializer(NewsFeedSerializer):
+    score = serializers.FloatField()
+    # with the score, the cursor of the next page
+    member = serializers.CharField()
@@ -1,13 +1,17 @@
+from datetime import datetime
 from django.conf import settings
 from gatekeeper.models import GateKeeper
 from newsfeeds.models import NewsFeed, HBaseNewsFeed
-from newsfeeds.services import NewsFeedService
+from newsfeeds.services import NewsFeedService, NewsFeedRankingService
 from rest_framework.test import APIClient
 from testing.testcases import TestCase
+from twitter.cache import TWEET_RANKED_READERS_PATTERN, USER_RANKED_NEWSFEEDS_PATTERN
 from utils.paginations import EndlessPagination
+from utils.redis_client import RedisClient
 
 
 NEWSFEEDS_URL = '/api/newsfeeds/'
+RANKED_NEWSFEEDS_URL = '/api/newsfeeds/ranked/'
 POST_TWEETS_URL = '/api/tweets/'
 FOLLOW_URL = '/api/friendships/{}/follow/'
 
@@ -207,3 +211,83 @@ class NewsFeedApiTests(TestCase):
         # cache expired
         self.clear_cache()
         _test_newsfeeds_after_new_feed_pushed()
+
+    def test_ranked(self):
+        response = self.anonymous_client.get(RANKED_NEWSFEEDS_URL)
+        self.assertEqual(response.status_code, 403)
+        response = self.jesse_client.get(RANKED_NEWSFEEDS_URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 0)
+
+        self.create_friendship(self.jesse, self.eliza)
+        tweets = [self.create_tweet(self.eliza) for i in range(3)]
+        for tweet in tweets:
+            self.create_newsfeed(self.jesse, tweet)
+
+        # same engagement, ranked by recency
+        response = self.jesse_client.get(RANKED_NEWSFEEDS_URL)
+        results = response.data['results']
+        self.assertEqual(
+            [result['tweet']['id'] for result in results],
+            [tweets[2].id, tweets[1].id, tweets[0].id],
+        )
+        # only the cached ranked newsfeeds are rescored on engagement
+        key = TWEET_RANKED_READERS_PATTERN.format(tweet_id=tweets[0].id)
+        self.assertEqual(RedisClient.get_connection().smembers(key), {str(self.jesse.id).encode('utf-8')})
+
+        # a liked tweet ranks higher
+        someone = self.create_user('someone')
+        self.create_like(someone, tweets[0])
+        response = self.jesse_client.get(RANKED_NEWSFEEDS_URL)
+        results = response.data['results']
+        self.assertEqual(
+            [result['tweet']['id'] for result in results],
+            [tweets[0].id, tweets[2].id, tweets[1].id],
+        )
+
+        # jesse interacted with eliza, all eliza's tweets rank higher
+        # than tweets of others
+        other_tweet = self.create_tweet(someone)
+        self.create_newsfeed(self.jesse, other_tweet)
+        self.create_like(self.jesse, tweets[1])
+        response = self.jesse_client.get(RANKED_NEWSFEEDS_URL)
+        results = response.data['results']
+        self.assertEqual(
+            [result['tweet']['id'] for result in results],
+            [tweets[1].id, tweets[0].id, tweets[2].id, other_tweet.id],
+        )
+
+        # paginate by score and member
+        response = self.jesse_client.get(
+            RANKED_NEWSFEEDS_URL,
+            {'score__lt': results[1]['score'], 'member__lt': results[1]['member']},
+        )
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual(
+            [result['tweet']['id'] for result in response.data['results']],
+            [tweets[2].id, other_tweet.id],
+        )
+
+        response = self.jesse_client.get(RANKED_NEWSFEEDS_URL, {'score__lt': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+        # tied scores are not skipped by the cursor
+        conn = RedisClient.get_connection()
+        key = USER_RANKED_NEWSFEEDS_PATTERN.format(user_id=self.jesse.id)
+        conn.zadd(key, {result['member']: 1 for result in results})
+        newsfeed_ids = []
+        cursor = None
+        for _ in range(len(results)):
+            newsfeeds = NewsFeedRankingService.load_ranked_newsfeeds(self.jesse.id, cursor, 1)
+            newsfeed_ids.append(newsfeeds[0].tweet_id)
+            cursor = (newsfeeds[0].score, newsfeeds[0].member)
+        self.assertEqual(
+            NewsFeedRankingService.load_ranked_newsfeeds(self.jesse.id, cursor, 1),
+            [],
+        )
+        self.assertEqual(sorted(newsfeed_ids), sorted(result['tweet']['id'] for result in results))
+
+        # created_at has the type of the store the newsfeeds are read from
+        GateKeeper.set_kv('switch_newsfeed_to_hbase', 'percent', 0)
+        newsfeeds = NewsFeedRankingService.load_ranked_newsfeeds(self.jesse.id, None, 1)
+        self.assertEqual(isinstance(newsfeeds[0].created_at, datetime), True)
@@ -1,11 +1,12 @@
 from django.utils.decorators import method_decorator
-from gatekeeper.models import GateKeeper
-from newsfeeds.api.serializers import NewsFeedSerializer
+from newsfeeds.api.serializers import NewsFeedSerializer, RankedNewsFeedSerializer
 from newsfeeds.models import NewsFeed, HBaseNewsFeed
-from newsfeeds.services import NewsFeedService
+from newsfeeds.services import NewsFeedService, NewsFeedRankingService
 from ratelimit.decorators import ratelimit
 from rest_framework import viewsets
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
+from tweets.services import TweetHydration
 from utils.paginations import EndlessPagination
 
 
@@ -18,7 +19,7 @@ class NewsFeedViewSet(viewsets.GenericViewSet):
         cached_newsfeeds = NewsFeedService.get_cached_newsfeeds(request.user.id)
         page = self.paginator.paginate_cached_list(cached_newsfeeds, request)
         if page is None:
-            if GateKeeper.is_switch_on('switch_newsfeed_to_hbase'):
+            if NewsFeedService.reads_from_hbase(request.user.id):
                 page = self.paginator.paginate_hbase(HBaseNewsFeed, (request.user.id,), request)
             else:
                 queryset = NewsFeed.objects.filter(user=request.user)
@@ -26,7 +27,37 @@ class NewsFeedViewSet(viewsets.GenericViewSet):
 
         serializer = NewsFeedSerializer(
             page,
-            context={'request': request},
+            context={
+                'request': request,
+                'tweet_hydration': TweetHydration(
+                    [newsfeed.tweet_id for newsfeed in page],
+                    request.user,
+                ),
+            },
+            many=True,
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['GET'], detail=False)
+    @method_decorator(ratelimit(key='user', rate='5/s', method='GET', block=True))
+    def ranked(self, request):
+        def _load_ranked_newsfeeds(cursor, limit):
+            return NewsFeedRankingService.load_ranked_newsfeeds(
+                request.user.id,
+                cursor,
+                limit,
+            )
+
+        page = self.paginator.paginate_ranked_list(_load_ranked_newsfeeds, request)
+        serializer = RankedNewsFeedSerializer(
+            page,
+            context={
+                'request': request,
+                'tweet_hydration': TweetHydration(
+                    [newsfeed.tweet_id for newsfeed in page],
+                    request.user,
+                ),
+            },
             many=True,
         )
         return self.get_paginated_response(serializer.data)
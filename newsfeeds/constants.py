@@ -1,3 +1,22 @@
 from django.conf import settings
+from utils.time_constants import ONE_HOUR
 
 FANOUT_BATCH_SIZE = 1000 if not settings.TESTING else 3
+
+# tweets posted by the same user within this window (in seconds) are fanned out together
+FANOUT_COALESCE_WINDOW = 0.3 if not settings.TESTING else 0
+
+# a claimed pending fanout queue older than this (in seconds) belongs to a run
+# killed by the task time limit, see NewsFeedService.recover_stale_fanouts
+FANOUT_PROCESSING_TIMEOUT = ONE_HOUR + 60
+
+# how many recent tweets of a newly followed user go into the follower's newsfeed
+NEWSFEED_BACKFILL_LIMIT = 100 if not settings.TESTING else 5
+
+# ranked newsfeeds, score = hours since epoch + weighted engagement,
+# so one hour of recency is worth 10 likes, 3 comments or 2 interactions
+# of the reader with the author
+RANKING_RECENCY_UNIT = 3600
+RANKING_LIKE_WEIGHT = 0.1
+RANKING_COMMENT_WEIGHT = 0.3
+RANKING_AFFINITY_WEIGHT = 0.5
@@ -0,0 +1,20 @@
+from newsfeeds.models import HBaseNewsFeed, NewsFeed
+from utils.hbase_backfill import HBaseBackfill
+from utils.time_helpers import to_timestamp
+
+
+class NewsFeedBackfill(HBaseBackfill):
+    name = 'newsfeeds'
+    model_class = NewsFeed
+    fields = ('user_id', 'tweet_id', 'tweet__created_at')
+    required_fields = ('user_id', 'tweet_id')
+    hbase_model_classes = (HBaseNewsFeed,)
+
+    @classmethod
+    def to_hbase_data(cls, row):
+        # dated with the tweet, as NewsFeedService does for dual writes
+        return {
+            'user_id': row['user_id'],
+            'tweet_id': row['tweet_id'],
+            'created_at': to_timestamp(row['tweet__created_at']),
+        }
@@ -0,0 +1,7 @@
+from newsfeeds.hbase_backfill import NewsFeedBackfill
+from utils.hbase_backfill import HBaseBackfillCommand
+
+
+class Command(HBaseBackfillCommand):
+    help = 'Copy the mysql newsfeeds into HBaseNewsFeed'
+    backfill_class = NewsFeedBackfill
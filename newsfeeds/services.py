@@ -1,16 +1,48 @@
+from django.conf import settings
+from django.db.models import Case, DateTimeField, F, Value, When
 from gatekeeper.models import GateKeeper
+from gatekeeper.shadow_reads import ShadowRead
+from newsfeeds.constants import (
+    FANOUT_COALESCE_WINDOW,
+    FANOUT_PROCESSING_TIMEOUT,
+    NEWSFEED_BACKFILL_LIMIT,
+    RANKING_AFFINITY_WEIGHT,
+    RANKING_COMMENT_WEIGHT,
+    RANKING_LIKE_WEIGHT,
+    RANKING_RECENCY_UNIT,
+)
 from newsfeeds.models import NewsFeed, HBaseNewsFeed
-from newsfeeds.tasks import fanout_newsfeeds_main_task
-from twitter.cache import USER_NEWSFEEDS_PATTERN
+from newsfeeds.tasks import fanout_pending_tweets_main_task, update_ranked_newsfeeds_task
+from tweets.constants import TWEET_COUNT_ATTRS
+from tweets.models import Tweet
+from tweets.services import TweetService
+from twitter.cache import (
+    PENDING_FANOUT_TWEETS_PATTERN,
+    PROCESSING_FANOUTS_KEY,
+    USER_AUTHOR_AFFINITY_PATTERN,
+    USER_HBASE_NEWSFEEDS_PATTERN,
+    USER_NEWSFEEDS_PATTERN,
+    TWEET_RANKED_READERS_PATTERN,
+    USER_RANKED_NEWSFEEDS_PATTERN,
+)
+from utils.memcached_helper import MemcachedHelper
+from utils.redis_client import RedisClient
 from utils.redis_helper import RedisHelper
 from utils.redis_serializers import DjangoModelSerializer, HBaseModelSerializer
+from utils.time_helpers import from_timestamp
+
+import uuid
 
 
 def lazy_load_newsfeeds(user_id):
     def _lazy_load(limit):
-        if GateKeeper.is_switch_on('switch_newsfeed_to_hbase'):
-            return HBaseNewsFeed.filter(prefix=(user_id, None), limit=limit, reverse=True)
-        return NewsFeed.objects.filter(user_id=user_id).order_by('-created_at')[:limit]
+        return ShadowRead.read(
+            'newsfeed',
+            user_id,
+            lambda: list(NewsFeed.objects.filter(user_id=user_id).order_by('-created_at')[:limit]),
+            lambda: HBaseNewsFeed.filter(prefix=(user_id, None), limit=limit, reverse=True),
+            normalize=lambda newsfeeds: [newsfeed.tweet_id for newsfeed in newsfeeds],
+        )
     return _lazy_load
 
 
@@ -18,22 +50,122 @@ class NewsFeedService(object):
 
     @classmethod
     def fanout_to_followers(cls, tweet):
-        fanout_newsfeeds_main_task.delay(tweet.id, tweet.timestamp, tweet.user_id)
+        # every tweet schedules a task, the first one to run after the window
+        # fans out all the pending tweets and the rest find nothing to do
+        key = PENDING_FANOUT_TWEETS_PATTERN.format(user_id=tweet.user_id)
+        RedisHelper.push_to_queue(key, [tweet.id, tweet.timestamp])
+        fanout_pending_tweets_main_task.apply_async(
+            args=(tweet.user_id,),
+            countdown=FANOUT_COALESCE_WINDOW,
+        )
+
+    @classmethod
+    def claim_pending_fanout_tweets(cls, user_id, queue_key=None):
+        """
+        returns (processing_key, [[tweet_id, created_at], ...]), the tweets
+        stay in processing_key until release_pending_fanout_tweets.
+        queue_key is the pending queue of user_id by default, or a stale
+        processing queue of it.
+        """
+        if queue_key is None:
+            queue_key = PENDING_FANOUT_TWEETS_PATTERN.format(user_id=user_id)
+        processing_key = '{}:processing:{}'.format(
+            PENDING_FANOUT_TWEETS_PATTERN.format(user_id=user_id),
+            uuid.uuid4().hex,
+        )
+        tweets = RedisHelper.claim_queue(queue_key, processing_key, PROCESSING_FANOUTS_KEY)
+        return processing_key, tweets
+
+    @classmethod
+    def release_pending_fanout_tweets(cls, processing_key):
+        pipe = RedisClient.get_connection().pipeline()
+        RedisHelper.release_queue(processing_key, PROCESSING_FANOUTS_KEY, pipe)
+        pipe.execute()
+
+    @classmethod
+    def recover_stale_fanouts(cls):
+        """
+        fanout again the queues claimed by runs older than the task time
+        limit, their worker died before releasing them. the newsfeeds
+        already written are not duplicated, see batch_create.
+        """
+        stale_keys = RedisHelper.get_stale_processing_queues(
+            PROCESSING_FANOUTS_KEY,
+            FANOUT_PROCESSING_TIMEOUT,
+        )
+        for stale_key in stale_keys:
+            # pending_fanout_tweets:<user_id>:processing:<run>
+            user_id = int(stale_key.split(':')[1])
+            fanout_pending_tweets_main_task.delay(user_id, queue_key=stale_key)
+        return len(stale_keys)
+
+    @classmethod
+    def reads_from_hbase(cls, user_id):
+        """
+        reads move to hbase user by user with the percent of the switch once
+        the dual writes keep hbase in sync, writes only move at 100
+        """
+        return ShadowRead.reads_from_hbase('newsfeed', user_id)
+
+    @classmethod
+    def get_newsfeeds_key(cls, user_id, hbase):
+        # the cached list of a user holds the objects of the store it reads
+        # from, one key per store so that a ramp never mixes them up
+        if hbase:
+            return USER_HBASE_NEWSFEEDS_PATTERN.format(user_id=user_id)
+        return USER_NEWSFEEDS_PATTERN.format(user_id=user_id)
+
+    @classmethod
+    def _filter_by_store(cls, newsfeeds, hbase):
+        return [
+            newsfeed
+            for newsfeed in newsfeeds
+            if isinstance(newsfeed, HBaseNewsFeed) == hbase
+        ]
 
     @classmethod
     def get_cached_newsfeeds(cls, user_id):
-        key = USER_NEWSFEEDS_PATTERN.format(user_id=user_id)
-        if GateKeeper.is_switch_on('switch_newsfeed_to_hbase'):
-            serializer = HBaseModelSerializer
-        else:
-            serializer = DjangoModelSerializer
-        return RedisHelper.load_objects(key, lazy_load_newsfeeds(user_id), serializer=serializer)
+        hbase = cls.reads_from_hbase(user_id)
+        return RedisHelper.load_objects(
+            cls.get_newsfeeds_key(user_id, hbase),
+            lazy_load_newsfeeds(user_id),
+            serializer=HBaseModelSerializer if hbase else DjangoModelSerializer,
+        )
 
     @classmethod
     def push_newsfeed_to_cache(cls, newsfeed):
-        key = USER_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id)
+        hbase = cls.reads_from_hbase(newsfeed.user_id)
+        if isinstance(newsfeed, HBaseNewsFeed) != hbase:
+            return
+        key = cls.get_newsfeeds_key(newsfeed.user_id, hbase)
         RedisHelper.push_object(key, newsfeed, lazy_load_newsfeeds(newsfeed.user_id))
 
+    @classmethod
+    def is_dual_write_on(cls):
+        """
+        while newsfeeds are still read from mysql, also write them to hbase
+        so that the table stays in sync with the backfill until the switch
+        """
+        return GateKeeper.is_switch_on('dual_write_newsfeed_to_hbase')
+
+    @classmethod
+    def _dual_write_newsfeeds(cls, batch_params):
+        """
+        created_at in batch_params is the timestamp of the tweet, as in the
+        hbase mode, so that the row keys are the same whichever path writes
+        the newsfeed first and backfills are idempotent
+        """
+        if not batch_params or not cls.is_dual_write_on():
+            return []
+        return HBaseNewsFeed.batch_create([
+            {
+                'user_id': params['user_id'],
+                'tweet_id': params['tweet_id'],
+                'created_at': params['created_at'],
+            }
+            for params in batch_params
+        ])
+
     @classmethod
     def create(cls, **kwargs):
         if GateKeeper.is_switch_on('switch_newsfeed_to_hbase'):
@@ -41,15 +173,445 @@ class NewsFeedService(object):
             cls.push_newsfeed_to_cache(newsfeed)
         else:
             newsfeed = NewsFeed.objects.create(**kwargs)
+            for hbase_newsfeed in cls._dual_write_newsfeeds([kwargs]):
+                cls.push_newsfeed_to_cache(hbase_newsfeed)
+        NewsFeedRankingService.add_newsfeeds([newsfeed])
         return newsfeed
 
+    @classmethod
+    def _get_cached_tweet_ids(cls, hbase_by_user):
+        """
+        hbase_by_user is {user_id: whether the user reads from hbase}, returns
+        the tweet ids in the cached newsfeeds of each user with one pipeline
+        """
+        conn = RedisClient.get_connection()
+        pipe = conn.pipeline()
+        for user_id, hbase in hbase_by_user.items():
+            pipe.lrange(cls.get_newsfeeds_key(user_id, hbase), 0, -1)
+        cached_tweet_ids = {}
+        for (user_id, hbase), serialized_list in zip(hbase_by_user.items(), pipe.execute()):
+            serializer = HBaseModelSerializer if hbase else DjangoModelSerializer
+            cached_tweet_ids[user_id] = set(
+                serializer.deserialize(serialized_data).tweet_id
+                for serialized_data in serialized_list
+            )
+        return cached_tweet_ids
+
     @classmethod
     def batch_create(cls, batch_params):
         if GateKeeper.is_switch_on('switch_newsfeed_to_hbase'):
             newsfeeds = HBaseNewsFeed.batch_create(batch_params)
+            hbase_newsfeeds = []
         else:
             newsfeeds = [NewsFeed(**params) for params in batch_params]
-            NewsFeed.objects.bulk_create(newsfeeds)
-        for newsfeed in newsfeeds:
-            NewsFeedService.push_newsfeed_to_cache(newsfeed)
+            # the tweet may have been backfilled already if the follow
+            # happened right before the fanout
+            NewsFeed.objects.bulk_create(newsfeeds, ignore_conflicts=True)
+            hbase_newsfeeds = cls._dual_write_newsfeeds(batch_params)
+        newsfeeds_by_user = {}
+        for newsfeed in newsfeeds + hbase_newsfeeds:
+            newsfeeds_by_user.setdefault(newsfeed.user_id, []).append(newsfeed)
+        hbase_by_user = {
+            user_id: cls.reads_from_hbase(user_id)
+            for user_id in newsfeeds_by_user
+        }
+        cached_tweet_ids = cls._get_cached_tweet_ids(hbase_by_user)
+        for user_id, user_newsfeeds in newsfeeds_by_user.items():
+            hbase = hbase_by_user[user_id]
+            # rows skipped as duplicates, e.g. by a retried fanout, are
+            # already in the cached list
+            user_newsfeeds = sorted(
+                [
+                    newsfeed
+                    for newsfeed in cls._filter_by_store(user_newsfeeds, hbase)
+                    if newsfeed.tweet_id not in cached_tweet_ids[user_id]
+                ],
+                key=lambda newsfeed: newsfeed.created_at,
+            )
+            RedisHelper.push_objects(
+                cls.get_newsfeeds_key(user_id, hbase),
+                user_newsfeeds,
+                lazy_load_newsfeeds(user_id),
+            )
+        NewsFeedRankingService.add_newsfeeds(newsfeeds)
+        return newsfeeds
+
+    @classmethod
+    def backfill_newsfeeds(cls, user_id, author_ids):
+        """
+        merge the recent tweets of author_ids into the newsfeeds of user_id,
+        called asynchronously after user_id followed author_ids
+        """
+        tweets = []
+        for author_id in author_ids:
+            tweets.extend(TweetService.get_cached_tweets(author_id)[:NEWSFEED_BACKFILL_LIMIT])
+        if not tweets:
+            return []
+
+        if GateKeeper.is_switch_on('switch_newsfeed_to_hbase'):
+            # created_at is the same as fanout uses, so the row keys are
+            # idempotent if the tweet has already been fanned out to user_id
+            newsfeeds = HBaseNewsFeed.batch_create([
+                {'user_id': user_id, 'tweet_id': tweet.id, 'created_at': tweet.timestamp}
+                for tweet in tweets
+            ])
+            hbase_newsfeeds = []
+        else:
+            existing_tweet_ids = set(NewsFeed.objects.filter(
+                user_id=user_id,
+                tweet_id__in=[tweet.id for tweet in tweets],
+            ).values_list('tweet_id', flat=True))
+            created_at_by_tweet_id = {
+                tweet.id: tweet.created_at
+                for tweet in tweets
+                if tweet.id not in existing_tweet_ids
+            }
+            NewsFeed.objects.bulk_create([
+                NewsFeed(user_id=user_id, tweet_id=tweet_id)
+                for tweet_id in created_at_by_tweet_id
+            ], ignore_conflicts=True)
+            # created_at is auto_now_add, the backfilled newsfeeds are dated
+            # with their tweet afterwards so that they sort among the others
+            queryset = NewsFeed.objects.filter(
+                user_id=user_id,
+                tweet_id__in=created_at_by_tweet_id.keys(),
+            )
+            if created_at_by_tweet_id:
+                queryset.update(created_at=Case(
+                    *[
+                        When(tweet_id=tweet_id, then=Value(created_at))
+                        for tweet_id, created_at in created_at_by_tweet_id.items()
+                    ],
+                    default=F('created_at'),
+                    output_field=DateTimeField(),
+                ))
+            newsfeeds = sorted(queryset, key=lambda newsfeed: newsfeed.created_at)
+            hbase_newsfeeds = cls._dual_write_newsfeeds([
+                {'user_id': user_id, 'tweet_id': tweet.id, 'created_at': tweet.timestamp}
+                for tweet in tweets
+                if tweet.id in created_at_by_tweet_id
+            ])
+
+        hbase = cls.reads_from_hbase(user_id)
+        new_newsfeeds = cls._filter_by_store(newsfeeds + hbase_newsfeeds, hbase)
+
+        def _merge(cached_newsfeeds):
+            tweet_ids = set(newsfeed.tweet_id for newsfeed in new_newsfeeds)
+            merged = new_newsfeeds + [
+                newsfeed
+                for newsfeed in cached_newsfeeds
+                if newsfeed.tweet_id not in tweet_ids
+            ]
+            merged.sort(key=lambda newsfeed: newsfeed.created_at, reverse=True)
+            return merged[:settings.REDIS_LIST_LENGTH_LIMIT]
+
+        RedisHelper.rewrite_objects(
+            cls.get_newsfeeds_key(user_id, hbase),
+            _merge,
+            serializer=HBaseModelSerializer if hbase else DjangoModelSerializer,
+        )
+        NewsFeedRankingService.add_newsfeeds(newsfeeds)
         return newsfeeds
+
+    @classmethod
+    def _purge_hbase_newsfeeds(cls, user_id, author_ids):
+        newsfeeds = HBaseNewsFeed.filter(prefix=(user_id, None))
+        tweet_ids = set(Tweet.objects.filter(
+            id__in=set(newsfeed.tweet_id for newsfeed in newsfeeds),
+            user_id__in=author_ids,
+        ).values_list('id', flat=True))
+        HBaseNewsFeed.batch_delete([
+            {'user_id': newsfeed.user_id, 'created_at': newsfeed.created_at}
+            for newsfeed in newsfeeds
+            if newsfeed.tweet_id in tweet_ids
+        ])
+        return tweet_ids
+
+    @classmethod
+    def purge_newsfeeds(cls, user_id, author_ids):
+        """
+        remove the tweets of author_ids from the newsfeeds of user_id,
+        called asynchronously after user_id unfollowed author_ids
+        """
+        if GateKeeper.is_switch_on('switch_newsfeed_to_hbase'):
+            tweet_ids = cls._purge_hbase_newsfeeds(user_id, author_ids)
+        else:
+            queryset = NewsFeed.objects.filter(user_id=user_id, tweet__user_id__in=author_ids)
+            tweet_ids = set(queryset.values_list('tweet_id', flat=True))
+            queryset.delete()
+            if cls.is_dual_write_on():
+                cls._purge_hbase_newsfeeds(user_id, author_ids)
+
+        def _purge(cached_newsfeeds):
+            return [
+                newsfeed
+                for newsfeed in cached_newsfeeds
+                if newsfeed.tweet_id not in tweet_ids
+            ]
+
+        hbase = cls.reads_from_hbase(user_id)
+        RedisHelper.rewrite_objects(
+            cls.get_newsfeeds_key(user_id, hbase),
+            _purge,
+            serializer=HBaseModelSerializer if hbase else DjangoModelSerializer,
+        )
+        for author_id in author_ids:
+            NewsFeedRankingService.remove_author(user_id, author_id)
+        return len(tweet_ids)
+
+
+class NewsFeedRankingService(object):
+    """
+    keep a sorted set of newsfeeds per user, scored by recency, likes,
+    comments and how often the user interacted with the author.
+    the score is linear so that likes and comments only need a ZINCRBY.
+    """
+
+    @classmethod
+    def get_member(cls, tweet):
+        return '{}:{}:{}'.format(tweet.user_id, tweet.id, tweet.timestamp)
+
+    @classmethod
+    def parse_member(cls, user_id, member, score):
+        member = member.decode('utf-8')
+        _, tweet_id, created_at = member.split(':')
+        # only used as a container for NewsFeedSerializer, created_at has
+        # the type of the store the newsfeeds are read from
+        if NewsFeedService.reads_from_hbase(user_id):
+            newsfeed = HBaseNewsFeed(
+                user_id=user_id,
+                tweet_id=int(tweet_id),
+                created_at=int(created_at),
+            )
+        else:
+            newsfeed = NewsFeed(
+                user_id=user_id,
+                tweet_id=int(tweet_id),
+                created_at=from_timestamp(int(created_at)),
+            )
+        newsfeed.score = score
+        newsfeed.member = member
+        return newsfeed
+
+    @classmethod
+    def get_engagement_score(cls, likes_count, comments_count):
+        return RANKING_LIKE_WEIGHT * likes_count + RANKING_COMMENT_WEIGHT * comments_count
+
+    @classmethod
+    def get_score(cls, tweet, affinity, counts=None):
+        """
+        counts is the {attr: count} of the tweet if already loaded in batch
+        """
+        if counts is None:
+            counts = RedisHelper.get_counts([tweet], TWEET_COUNT_ATTRS)[tweet.id]
+        return (
+            tweet.timestamp / 1000000 / RANKING_RECENCY_UNIT
+            + cls.get_engagement_score(counts['likes_count'], counts['comments_count'])
+            + RANKING_AFFINITY_WEIGHT * affinity
+        )
+
+    @classmethod
+    def get_affinity_map(cls, user_id):
+        conn = RedisClient.get_connection()
+        key = USER_AUTHOR_AFFINITY_PATTERN.format(user_id=user_id)
+        return {
+            int(author_id): int(count)
+            for author_id, count in conn.hgetall(key).items()
+        }
+
+    @classmethod
+    def _load_ranked_newsfeeds_to_cache(cls, user_id):
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(user_id)
+        if not newsfeeds:
+            return
+
+        affinity_map = cls.get_affinity_map(user_id)
+        tweets = [newsfeed.cached_tweet for newsfeed in newsfeeds]
+        counts = RedisHelper.get_counts(tweets, TWEET_COUNT_ATTRS)
+        mapping = {}
+        for tweet in tweets:
+            affinity = affinity_map.get(tweet.user_id, 0)
+            mapping[cls.get_member(tweet)] = cls.get_score(tweet, affinity, counts[tweet.id])
+
+        conn = RedisClient.get_connection()
+        key = USER_RANKED_NEWSFEEDS_PATTERN.format(user_id=user_id)
+        pipe = conn.pipeline()
+        pipe.zadd(key, mapping)
+        pipe.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+        cls._add_readers(pipe, user_id, [tweet.id for tweet in tweets])
+        pipe.execute()
+
+    @classmethod
+    def load_ranked_newsfeeds(cls, user_id, cursor, limit):
+        """
+        return at most limit newsfeeds ranked below the (score, member) cursor,
+        read from the precomputed sorted set. members of the same score are
+        ranked in reverse lexicographical order as in ZREVRANGEBYSCORE.
+        """
+        conn = RedisClient.get_connection()
+        key = USER_RANKED_NEWSFEEDS_PATTERN.format(user_id=user_id)
+        if not conn.exists(key):
+            cls._load_ranked_newsfeeds_to_cache(user_id)
+
+        if cursor is None:
+            max_score, cursor_member = '+inf', None
+        else:
+            max_score, cursor_member = cursor
+            if cursor_member is not None:
+                cursor_member = cursor_member.encode('utf-8')
+            else:
+                # without member, the cursor only compares the score
+                max_score = '({!r}'.format(max_score)
+
+        newsfeeds = []
+        offset = 0
+        while len(newsfeeds) < limit:
+            members = conn.zrevrangebyscore(
+                key,
+                max_score,
+                '-inf',
+                start=offset,
+                num=limit,
+                withscores=True,
+            )
+            for member, score in members:
+                # skip the ties of the cursor ranked above it
+                if cursor_member is not None and (score, member) >= (cursor[0], cursor_member):
+                    continue
+                newsfeeds.append(cls.parse_member(user_id, member, score))
+            if len(members) < limit:
+                break
+            offset += len(members)
+        return newsfeeds[:limit]
+
+    @classmethod
+    def add_newsfeeds(cls, newsfeeds):
+        """
+        add newly created newsfeeds into the ranked sets that are already cached,
+        the others will be built from the newsfeeds cache when they are read
+        """
+        user_ids = list(set(newsfeed.user_id for newsfeed in newsfeeds))
+        if not user_ids:
+            return
+
+        conn = RedisClient.get_connection()
+        pipe = conn.pipeline()
+        for user_id in user_ids:
+            pipe.exists(USER_RANKED_NEWSFEEDS_PATTERN.format(user_id=user_id))
+        cached_user_ids = set(
+            user_id
+            for user_id, exists in zip(user_ids, pipe.execute())
+            if exists
+        )
+        newsfeeds = [
+            newsfeed
+            for newsfeed in newsfeeds
+            if newsfeed.user_id in cached_user_ids
+        ]
+        if not newsfeeds:
+            return
+
+        # the same tweets are fanned out to many users, score them only once
+        tweets = MemcachedHelper.get_objects_through_cache(
+            Tweet,
+            set(newsfeed.tweet_id for newsfeed in newsfeeds),
+        )
+        counts = RedisHelper.get_counts(list(tweets.values()), TWEET_COUNT_ATTRS)
+        base_scores = {
+            tweet.id: cls.get_score(tweet, 0, counts[tweet.id])
+            for tweet in tweets.values()
+        }
+
+        pipe = conn.pipeline()
+        for newsfeed in newsfeeds:
+            key = USER_AUTHOR_AFFINITY_PATTERN.format(user_id=newsfeed.user_id)
+            pipe.hget(key, tweets[newsfeed.tweet_id].user_id)
+        affinities = pipe.execute()
+
+        pipe = conn.pipeline()
+        for newsfeed, affinity in zip(newsfeeds, affinities):
+            tweet = tweets[newsfeed.tweet_id]
+            score = base_scores[tweet.id] + RANKING_AFFINITY_WEIGHT * int(affinity or 0)
+            key = USER_RANKED_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id)
+            pipe.zadd(key, {cls.get_member(tweet): score})
+            cls._add_readers(pipe, newsfeed.user_id, [tweet.id])
+        for user_id in cached_user_ids:
+            key = USER_RANKED_NEWSFEEDS_PATTERN.format(user_id=user_id)
+            pipe.zremrangebyrank(key, 0, -settings.REDIS_LIST_LENGTH_LIMIT - 1)
+        pipe.execute()
+
+    @classmethod
+    def _add_readers(cls, pipe, user_id, tweet_ids):
+        # users whose ranked set expired or dropped the tweet are left in,
+        # the rescore skips them
+        for tweet_id in tweet_ids:
+            key = TWEET_RANKED_READERS_PATTERN.format(tweet_id=tweet_id)
+            pipe.sadd(key, user_id)
+            pipe.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+
+    @classmethod
+    def iter_reader_ids(cls, tweet_id, batch_size):
+        """
+        yields batches of the users whose ranked newsfeeds have been cached
+        with tweet_id, instead of every follower of the author
+        """
+        conn = RedisClient.get_connection()
+        key = TWEET_RANKED_READERS_PATTERN.format(tweet_id=tweet_id)
+        user_ids = []
+        for user_id in conn.sscan_iter(key, count=batch_size):
+            user_ids.append(int(user_id))
+            if len(user_ids) == batch_size:
+                yield user_ids
+                user_ids = []
+        if user_ids:
+            yield user_ids
+
+    @classmethod
+    def remove_author(cls, user_id, author_id):
+        conn = RedisClient.get_connection()
+        key = USER_RANKED_NEWSFEEDS_PATTERN.format(user_id=user_id)
+        members = [
+            member
+            for member, _ in conn.zscan_iter(key, match='{}:*'.format(author_id))
+        ]
+        if members:
+            conn.zrem(key, *members)
+
+    @classmethod
+    def on_tweet_engaged(cls, tweet, engagements):
+        """
+        called by EngagementService with [[user_id, likes_delta, comments_delta]],
+        the followers of the author are rescored asynchronously
+        """
+        if engagements:
+            update_ranked_newsfeeds_task.delay(tweet.id, engagements)
+
+    @classmethod
+    def incr_scores(cls, user_ids, tweet, delta):
+        conn = RedisClient.get_connection()
+        member = cls.get_member(tweet)
+        pipe = conn.pipeline()
+        for user_id in user_ids:
+            key = USER_RANKED_NEWSFEEDS_PATTERN.format(user_id=user_id)
+            # xx: only rescore the tweet if it's in the ranked set
+            pipe.zadd(key, {member: delta}, xx=True, incr=True)
+        pipe.execute()
+
+    @classmethod
+    def incr_affinity(cls, user_id, author_id, delta):
+        if user_id == author_id:
+            return
+
+        conn = RedisClient.get_connection()
+        key = USER_AUTHOR_AFFINITY_PATTERN.format(user_id=user_id)
+        pipe = conn.pipeline()
+        pipe.hincrby(key, author_id, delta)
+        pipe.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+        pipe.execute()
+
+        # rescore the tweets of author_id that user_id can see
+        key = USER_RANKED_NEWSFEEDS_PATTERN.format(user_id=user_id)
+        pipe = conn.pipeline()
+        for member, _ in conn.zscan_iter(key, match='{}:*'.format(author_id)):
+            pipe.zincrby(key, RANKING_AFFINITY_WEIGHT * delta, member)
+        pipe.execute()
@@ -36,3 +36,126 @@ def fanout_newsfeeds_main_task(tweet_id, created_at, tweet_user_id):
         len(follower_ids),
         (len(follower_ids) - 1) // FANOUT_BATCH_SIZE + 1,
     )
+
+
+@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR)
+def fanout_tweets_batch_task(tweets, follower_ids):
+    from newsfeeds.services import NewsFeedService
+    batch_params = [
+        {'user_id': follower_id, 'created_at': created_at, 'tweet_id': tweet_id}
+        for follower_id in follower_ids
+        for tweet_id, created_at in tweets
+    ]
+    newsfeeds = NewsFeedService.batch_create(batch_params)
+    return "{} newsfeeds created".format(len(newsfeeds))
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def fanout_pending_tweets_main_task(tweet_user_id, queue_key=None):
+    """
+    fanout all the tweets tweet_user_id posted within the coalescing window,
+    so that followers are enumerated only once for a thread of tweets.
+    the claimed tweets are released once every batch is enqueued.
+    """
+    from newsfeeds.services import NewsFeedService
+
+    processing_key, tweets = NewsFeedService.claim_pending_fanout_tweets(tweet_user_id, queue_key)
+    if not tweets:
+        # already fanned out by a previous task in the same window
+        return 'no pending tweets to fanout.'
+
+    NewsFeedService.batch_create([
+        {'user_id': tweet_user_id, 'created_at': created_at, 'tweet_id': tweet_id}
+        for tweet_id, created_at in tweets
+    ])
+
+    follower_ids = FriendshipService.get_follower_ids(tweet_user_id)
+    index = 0
+    while index < len(follower_ids):
+        batch_ids = follower_ids[index: index + FANOUT_BATCH_SIZE]
+        fanout_tweets_batch_task.delay(tweets, batch_ids)
+        index += FANOUT_BATCH_SIZE
+    NewsFeedService.release_pending_fanout_tweets(processing_key)
+
+    return '{} tweets to {} followers going to fanout, {} batches created.'.format(
+        len(tweets),
+        len(follower_ids),
+        (len(follower_ids) - 1) // FANOUT_BATCH_SIZE + 1,
+    )
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def recover_fanouts_task():
+    from newsfeeds.services import NewsFeedService
+    count = NewsFeedService.recover_stale_fanouts()
+    return '{} stale fanouts scheduled.'.format(count)
+
+
+@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR)
+def backfill_newsfeeds_task(user_id, author_id):
+    return backfill_newsfeeds_batch_task(user_id, [author_id])
+
+
+@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR)
+def backfill_newsfeeds_batch_task(user_id, author_ids):
+    from newsfeeds.services import NewsFeedService
+
+    # the follows may have been undone before this task is consumed
+    followed_ids = FriendshipService.get_followed_user_ids(user_id, author_ids)
+    author_ids = [author_id for author_id in author_ids if author_id in followed_ids]
+    if not author_ids:
+        return 'user {} is not following any of the authors'.format(user_id)
+
+    newsfeeds = NewsFeedService.backfill_newsfeeds(user_id, author_ids)
+    return '{} newsfeeds backfilled'.format(len(newsfeeds))
+
+
+@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR)
+def purge_newsfeeds_task(user_id, author_id):
+    return purge_newsfeeds_batch_task(user_id, [author_id])
+
+
+@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR)
+def purge_newsfeeds_batch_task(user_id, author_ids):
+    from newsfeeds.services import NewsFeedService
+
+    # user_id may have followed some authors again before this task is consumed
+    followed_ids = FriendshipService.get_followed_user_ids(user_id, author_ids)
+    author_ids = [author_id for author_id in author_ids if author_id not in followed_ids]
+    if not author_ids:
+        return 'user {} is following all of the authors'.format(user_id)
+
+    purged = NewsFeedService.purge_newsfeeds(user_id, author_ids)
+    return '{} newsfeeds purged'.format(purged)
+
+
+@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR)
+def update_ranked_newsfeeds_task(tweet_id, engagements):
+    """
+    the users in engagements [[user_id, likes_delta, comments_delta]] liked or
+    commented tweet_id, rescore the tweet once in the cached ranked newsfeeds
+    holding it, and rescore the tweets of the author in the ranked newsfeeds
+    of each user
+    """
+    from newsfeeds.services import NewsFeedRankingService
+    from tweets.models import Tweet
+    from utils.memcached_helper import MemcachedHelper
+
+    tweet = MemcachedHelper.get_object_through_cache(Tweet, tweet_id)
+    for user_id, likes_delta, comments_delta in engagements:
+        NewsFeedRankingService.incr_affinity(
+            user_id,
+            tweet.user_id,
+            likes_delta + comments_delta,
+        )
+
+    delta = NewsFeedRankingService.get_engagement_score(
+        sum(likes_delta for _, likes_delta, _ in engagements),
+        sum(comments_delta for _, _, comments_delta in engagements),
+    )
+    total = 0
+    for user_ids in NewsFeedRankingService.iter_reader_ids(tweet_id, FANOUT_BATCH_SIZE):
+        NewsFeedRankingService.incr_scores(user_ids, tweet, delta)
+        total += len(user_ids)
+
+    return '{} ranked newsfeeds rescored.'.format(total)
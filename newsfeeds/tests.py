@@ -1,10 +1,13 @@
+from friendships.services import FriendshipService
 from gatekeeper.models import GateKeeper
+from newsfeeds.hbase_backfill import NewsFeedBackfill
 from newsfeeds.models import NewsFeed, HBaseNewsFeed
 from newsfeeds.services import NewsFeedService
-from newsfeeds.tasks import fanout_newsfeeds_main_task
+from newsfeeds.tasks import fanout_newsfeeds_main_task, fanout_pending_tweets_main_task
 from testing.testcases import TestCase
-from twitter.cache import USER_NEWSFEEDS_PATTERN
+from twitter.cache import PENDING_FANOUT_TWEETS_PATTERN, PROCESSING_FANOUTS_KEY
 from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
 
 
 class NewsFeedServiceTests(TestCase):
@@ -43,7 +46,7 @@ class NewsFeedServiceTests(TestCase):
         self.clear_cache()
         conn = RedisClient.get_connection()
 
-        key = USER_NEWSFEEDS_PATTERN.format(user_id=self.jesse.id)
+        key = NewsFeedService.get_newsfeeds_key(self.jesse.id, hbase=True)
         self.assertEqual(conn.exists(key), False)
         feed2 = self.create_newsfeed(self.jesse, self.create_tweet(self.jesse))
         self.assertEqual(conn.exists(key), True)
@@ -73,16 +76,17 @@ class NewsFeedTaskTests(TestCase):
         cached_list = NewsFeedService.get_cached_newsfeeds(self.jesse.id)
         self.assertEqual(len(cached_list), 1)
 
+        # new followers get 'tweet 1' backfilled into their newsfeeds
         for i in range(2):
             user = self.create_user('user{}'.format(i))
             self.create_friendship(user, self.jesse)
         tweet = self.create_tweet(self.jesse, 'tweet 2')
         if GateKeeper.is_switch_on('switch_newsfeed_to_hbase'):
             msg = fanout_newsfeeds_main_task(tweet.id, tweet.timestamp, self.jesse.id)
-            self.assertEqual(4 + 2, len(HBaseNewsFeed.filter(prefix=(None, None))))
+            self.assertEqual(4 + 4, len(HBaseNewsFeed.filter(prefix=(None, None))))
         else:
             msg = fanout_newsfeeds_main_task(tweet.id, tweet.created_at, self.jesse.id)
-            self.assertEqual(4 + 2, NewsFeed.objects.count())
+            self.assertEqual(4 + 4, NewsFeed.objects.count())
         self.assertEqual(msg, '3 newsfeeds going to fanout, 1 batches created.')
         cached_list = NewsFeedService.get_cached_newsfeeds(self.jesse.id)
         self.assertEqual(len(cached_list), 2)
@@ -92,12 +96,167 @@ class NewsFeedTaskTests(TestCase):
         tweet = self.create_tweet(self.jesse, 'tweet 3')
         if GateKeeper.is_switch_on('switch_newsfeed_to_hbase'):
             msg = fanout_newsfeeds_main_task(tweet.id, tweet.timestamp, self.jesse.id)
-            self.assertEqual(8 + 3, len(HBaseNewsFeed.filter(prefix=(None, None))))
+            self.assertEqual(10 + 5, len(HBaseNewsFeed.filter(prefix=(None, None))))
         else:
             msg = fanout_newsfeeds_main_task(tweet.id, tweet.created_at, self.jesse.id)
-            self.assertEqual(8 + 3, NewsFeed.objects.count())
+            self.assertEqual(10 + 5, NewsFeed.objects.count())
         self.assertEqual(msg, '4 newsfeeds going to fanout, 2 batches created.')
         cached_list = NewsFeedService.get_cached_newsfeeds(self.jesse.id)
         self.assertEqual(len(cached_list), 3)
         cached_list = NewsFeedService.get_cached_newsfeeds(self.eliza.id)
         self.assertEqual(len(cached_list), 3)
+
+    def test_fanout_pending_tweets_main_task(self):
+        followers = [self.create_user('follower{}'.format(i)) for i in range(4)]
+        for follower in followers:
+            self.create_friendship(follower, self.jesse)
+
+        # a thread of tweets waiting in the coalescing window
+        tweets = [self.create_tweet(self.jesse, 'thread {}'.format(i)) for i in range(3)]
+        key = PENDING_FANOUT_TWEETS_PATTERN.format(user_id=self.jesse.id)
+        for tweet in tweets:
+            RedisHelper.push_to_queue(key, [tweet.id, tweet.timestamp])
+
+        msg = fanout_pending_tweets_main_task(self.jesse.id)
+        self.assertEqual(msg, '3 tweets to 4 followers going to fanout, 2 batches created.')
+        for user in followers + [self.jesse]:
+            cached_list = NewsFeedService.get_cached_newsfeeds(user.id)
+            self.assertEqual([f.tweet_id for f in cached_list], [t.id for t in tweets[::-1]])
+
+        # the pending queue has been consumed
+        msg = fanout_pending_tweets_main_task(self.jesse.id)
+        self.assertEqual(msg, 'no pending tweets to fanout.')
+
+    def test_recover_stale_fanouts(self):
+        self.create_friendship(self.eliza, self.jesse)
+        tweet = self.create_tweet(self.jesse)
+        key = PENDING_FANOUT_TWEETS_PATTERN.format(user_id=self.jesse.id)
+        RedisHelper.push_to_queue(key, [tweet.id, tweet.timestamp])
+
+        # a worker claimed the tweets and died before the fanout
+        NewsFeedService.claim_pending_fanout_tweets(self.jesse.id)
+        self.assertEqual(NewsFeedService.recover_stale_fanouts(), 0)
+        conn = RedisClient.get_connection()
+        processing_key = conn.zrange(PROCESSING_FANOUTS_KEY, 0, -1)[0]
+        conn.zadd(PROCESSING_FANOUTS_KEY, {processing_key: 0})
+
+        self.assertEqual(NewsFeedService.recover_stale_fanouts(), 1)
+        for user in [self.jesse, self.eliza]:
+            cached_list = NewsFeedService.get_cached_newsfeeds(user.id)
+            self.assertEqual([f.tweet_id for f in cached_list], [tweet.id])
+        self.assertEqual(conn.zcard(PROCESSING_FANOUTS_KEY), 0)
+        self.assertEqual(conn.exists(processing_key), 0)
+
+    def test_retried_fanout(self):
+        self.create_friendship(self.eliza, self.jesse)
+        tweet = self.create_tweet(self.jesse)
+        NewsFeedService.get_cached_newsfeeds(self.eliza.id)
+        for hbase in [True, False]:
+            GateKeeper.set_kv('switch_newsfeed_to_hbase', 'percent', 100 if hbase else 0)
+            created_at = tweet.timestamp if hbase else tweet.created_at
+            # the rows of the first attempt are skipped, not pushed again
+            for _ in range(2):
+                NewsFeedService.batch_create([
+                    {'user_id': self.eliza.id, 'tweet_id': tweet.id, 'created_at': created_at},
+                ])
+            cached_list = NewsFeedService.get_cached_newsfeeds(self.eliza.id)
+            self.assertEqual([f.tweet_id for f in cached_list], [tweet.id])
+
+    def test_fanout_to_followers(self):
+        self.create_friendship(self.eliza, self.jesse)
+        tweet = self.create_tweet(self.jesse)
+        NewsFeedService.fanout_to_followers(tweet)
+        for user in [self.jesse, self.eliza]:
+            cached_list = NewsFeedService.get_cached_newsfeeds(user.id)
+            self.assertEqual([f.tweet_id for f in cached_list], [tweet.id])
+
+
+class NewsFeedBackfillTests(TestCase):
+
+    def setUp(self):
+        super(NewsFeedBackfillTests, self).setUp()
+        self.jesse = self.create_user('jesse')
+        self.eliza = self.create_user('eliza')
+
+    def test_backfill_on_follow(self):
+        tweets = [self.create_tweet(self.eliza, 'tweet {}'.format(i)) for i in range(3)]
+        feed = self.create_newsfeed(self.jesse, self.create_tweet(self.jesse))
+        # cache the newsfeeds before following
+        self.assertEqual(len(NewsFeedService.get_cached_newsfeeds(self.jesse.id)), 1)
+
+        self.create_friendship(self.jesse, self.eliza)
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.jesse.id)
+        self.assertEqual(
+            [f.tweet_id for f in newsfeeds],
+            [feed.tweet_id] + [t.id for t in tweets[::-1]],
+        )
+
+        # cache expired, load from db
+        self.clear_cache()
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.jesse.id)
+        self.assertEqual(len(newsfeeds), 4)
+
+    def test_backfill_on_follow_mysql(self):
+        GateKeeper.set_kv('switch_newsfeed_to_hbase', 'percent', 0)
+        tweets = [self.create_tweet(self.eliza, 'tweet {}'.format(i)) for i in range(3)]
+        feed = self.create_newsfeed(self.jesse, self.create_tweet(self.jesse))
+        self.assertEqual(len(NewsFeedService.get_cached_newsfeeds(self.jesse.id)), 1)
+
+        # the backfilled newsfeeds are dated with their tweets
+        self.create_friendship(self.jesse, self.eliza)
+        for tweet in tweets:
+            newsfeed = NewsFeed.objects.get(user=self.jesse, tweet=tweet)
+            self.assertEqual(newsfeed.created_at, tweet.created_at)
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.jesse.id)
+        self.assertEqual(
+            [f.tweet_id for f in newsfeeds],
+            [feed.tweet_id] + [t.id for t in tweets[::-1]],
+        )
+
+        self.clear_cache()
+        GateKeeper.set_kv('switch_newsfeed_to_hbase', 'percent', 0)
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.jesse.id)
+        self.assertEqual(
+            [f.tweet_id for f in newsfeeds],
+            [feed.tweet_id] + [t.id for t in tweets[::-1]],
+        )
+
+    def test_dual_write_and_backfill(self):
+        GateKeeper.set_kv('switch_newsfeed_to_hbase', 'percent', 0)
+        GateKeeper.turn_on('dual_write_newsfeed_to_hbase')
+        tweet = self.create_tweet(self.eliza)
+        self.create_newsfeed(self.jesse, tweet)
+        newsfeeds = HBaseNewsFeed.filter(prefix=(self.jesse.id, None))
+        self.assertEqual([newsfeed.created_at for newsfeed in newsfeeds], [tweet.timestamp])
+
+        # the row keys of the dual writes and the backfills are the same
+        self.create_friendship(self.jesse, self.eliza)
+        NewsFeedService.backfill_newsfeeds(self.jesse.id, [self.eliza.id])
+        self.assertEqual(len(HBaseNewsFeed.filter(prefix=(self.jesse.id, None))), 1)
+        total_rows, mismatched_chunks = NewsFeedBackfill.run(chunk_size=2, workers=0, verify=True)
+        self.assertEqual(total_rows, 1)
+        self.assertEqual(mismatched_chunks, [])
+
+        # chunks are aligned to chunk_size whatever the smallest id
+        newsfeed_id = NewsFeed.objects.get(user=self.jesse).id
+        self.assertEqual(
+            NewsFeedBackfill.get_chunks(chunk_size=10),
+            [(newsfeed_id // 10 * 10, newsfeed_id // 10 * 10 + 10)],
+        )
+
+    def test_purge_on_unfollow(self):
+        self.create_friendship(self.jesse, self.eliza)
+        eliza_tweet = self.create_tweet(self.eliza)
+        jesse_tweet = self.create_tweet(self.jesse)
+        self.create_newsfeed(self.jesse, eliza_tweet)
+        self.create_newsfeed(self.jesse, jesse_tweet)
+        self.assertEqual(len(NewsFeedService.get_cached_newsfeeds(self.jesse.id)), 2)
+
+        FriendshipService.unfollow(self.jesse.id, self.eliza.id)
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.jesse.id)
+        self.assertEqual([f.tweet_id for f in newsfeeds], [jesse_tweet.id])
+
+        # cache expired, load from db
+        self.clear_cache()
+        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.jesse.id)
+        self.assertEqual([f.tweet_id for f in newsfeeds], [jesse_tweet.id])
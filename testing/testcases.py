@@ -63,11 +63,8 @@ class TestCase(DjangoTestCase):
         return Tweet.objects.create(user=user, content=content)
 
     def create_newsfeed(self, user, tweet):
-        if GateKeeper.is_switch_on('switch_newsfeed_to_hbase'):
-            created_at = tweet.timestamp
-        else:
-            created_at = tweet.created_at
-        return NewsFeedService.create(user_id=user.id, tweet_id=tweet.id, created_at=created_at)
+        # as the fanout does, mysql ignores it for the auto_now_add created_at
+        return NewsFeedService.create(user_id=user.id, tweet_id=tweet.id, created_at=tweet.timestamp)
 
     def create_comment(self, user, tweet, content=None):
         if content is None:
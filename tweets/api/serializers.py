@@ -1,10 +1,12 @@
 from accounts.api.serializers import UserSerializerForTweet
+from accounts.services import UserService
+from collections import OrderedDict
 from comments.api.serializers import CommentSerializer
 from likes.api.serializers import LikeSerializer
 from likes.services import LikeService
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
-from tweets.constants import TWEET_PHOTOS_UPLOAD_LIMIT
+from tweets.constants import TWEET_FRAGMENT_FIELDS, TWEET_PHOTOS_UPLOAD_LIMIT
 from tweets.models import Tweet
 from tweets.services import TweetService
 from utils.redis_helper import RedisHelper
@@ -30,16 +32,76 @@ class TweetSerializer(serializers.ModelSerializer):
             'photo_urls',
         )
 
+    def _get_hydration(self, obj):
+        hydration = self.context.get('tweet_hydration')
+        if hydration is None or obj.id not in hydration.tweets:
+            return None
+        return hydration
+
+    def to_representation(self, instance):
+        # the viewer independent fields come from the cached fragment,
+        # only has_liked, the counts and subclass fields are rendered here
+        fragment = self._get_fragment(instance)
+        ret = OrderedDict()
+        for field in self._readable_fields:
+            if field.field_name in fragment:
+                ret[field.field_name] = fragment[field.field_name]
+            else:
+                ret[field.field_name] = self._render_field(field, instance)
+        return ret
+
+    def _render_field(self, field, instance):
+        attribute = field.get_attribute(instance)
+        if attribute is None:
+            return None
+        return field.to_representation(attribute)
+
+    def _get_fragment(self, instance):
+        hydration = self._get_hydration(instance)
+        if hydration is not None:
+            fragment = hydration.fragments.get(instance.id)
+            user_fragment = hydration.user_fragments.get(instance.user_id)
+        else:
+            fragment = TweetService.get_tweet_fragments([instance.id]).get(instance.id)
+            user_fragment = UserService.get_user_fragments([instance.user_id]).get(instance.user_id)
+
+        if fragment is None:
+            fragment = {
+                field_name: self._render_field(self.fields[field_name], instance)
+                for field_name in TWEET_FRAGMENT_FIELDS
+            }
+            TweetService.set_tweet_fragment(instance.id, fragment)
+
+        if instance.user_id is None:
+            user_fragment = None
+        elif user_fragment is None:
+            user_fragment = self._render_field(self.fields['user'], instance)
+            UserService.set_user_fragment(instance.user_id, user_fragment)
+
+        return dict(fragment, user=user_fragment)
+
     def get_likes_count(self, obj):
+        hydration = self._get_hydration(obj)
+        if hydration is not None:
+            return hydration.likes_counts[obj.id]
         return RedisHelper.get_count(obj, 'likes_count')
 
     def get_comments_count(self, obj):
+        hydration = self._get_hydration(obj)
+        if hydration is not None:
+            return hydration.comments_counts[obj.id]
         return RedisHelper.get_count(obj, 'comments_count')
 
     def get_has_liked(self, obj):
+        hydration = self._get_hydration(obj)
+        if hydration is not None:
+            return obj.id in hydration.liked_tweet_ids
         return LikeService.has_liked(self.context['request'].user, obj)
 
     def get_photo_urls(self, obj):
+        hydration = self._get_hydration(obj)
+        if hydration is not None:
+            return hydration.photo_urls[obj.id]
         photo_urls = []
         for photo in obj.tweetphoto_set.all().order_by('order'):
             photo_urls.append(photo.file.url)
@@ -48,7 +110,7 @@ class TweetSerializer(serializers.ModelSerializer):
 
 class TweetSerializerForDetail(TweetSerializer):
     comments = CommentSerializer(source='comment_set', many=True)
-    likes = LikeSerializer(source='like_set', many=True)
+    likes = serializers.SerializerMethodField()
 
     class Meta:
         model = Tweet
@@ -66,6 +128,10 @@ class TweetSerializerForDetail(TweetSerializer):
             'photo_urls',
         )
 
+    def get_likes(self, obj):
+        # read from the likers set in redis instead of the like table
+        return LikeSerializer(LikeService.get_likes(obj), many=True).data
+
 
 class TweetSerializerForCreate(serializers.ModelSerializer):
     content = serializers.CharField(min_length=6, max_length=140)
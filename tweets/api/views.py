@@ -1,4 +1,5 @@
 from django.utils.decorators import method_decorator
+from likes.services import LikeService
 from newsfeeds.services import NewsFeedService
 from ratelimit.decorators import ratelimit
 from rest_framework import viewsets
@@ -10,7 +11,7 @@ from tweets.api.serializers import (
     TweetSerializerForDetail,
 )
 from tweets.models import Tweet
-from tweets.services import TweetService
+from tweets.services import TweetHydration, TweetService
 from utils.decorators import required_params
 from utils.paginations import EndlessPagination
 
@@ -30,9 +31,16 @@ class TweetViewSet(viewsets.GenericViewSet):
 
     @method_decorator(ratelimit(key='user_or_ip', rate='5/s', method='GET', block=True))
     def retrieve(self, request, *args, **kwargs):
+        tweet = self.get_object()
+        comments = list(tweet.comment_set.all())
         serializer = TweetSerializerForDetail(
-            self.get_object(),
-            context={'request': request},
+            tweet,
+            context={
+                'request': request,
+                'tweet_hydration': TweetHydration([tweet.id], request.user),
+                'liked_comment_ids': LikeService.has_liked_many(request.user, comments),
+                'comment_likes_counts': LikeService.get_likes_counts(comments),
+            },
         )
         return Response(serializer.data)
 
@@ -48,7 +56,10 @@ class TweetViewSet(viewsets.GenericViewSet):
             page = self.paginate_queryset(queryset)
         serializer = TweetSerializer(
             page,
-            context={'request': request},
+            context={
+                'request': request,
+                'tweet_hydration': TweetHydration([tweet.id for tweet in page], request.user),
+            },
             many=True,
         )
         return self.get_paginated_response(serializer.data)
@@ -1,3 +1,7 @@
+from django.conf import settings
+from utils.time_constants import ONE_HOUR
+
+
 class TweetPhotoStatus:
     PENDING = 0
     APPROVED = 1
@@ -11,3 +15,19 @@ TWEET_PHOTO_STATUS_CHOICES = (
 )
 
 TWEET_PHOTOS_UPLOAD_LIMIT = 9
+
+# bump when the viewer independent part of TweetSerializer changes,
+# so that fragments rendered by the old code are never served
+TWEET_FRAGMENT_VERSION = 1
+TWEET_FRAGMENT_FIELDS = ('id', 'created_at', 'content', 'photo_urls')
+
+# tweet counters buffered in redis by RedisHelper.incr_count
+TWEET_COUNT_ATTRS = ('likes_count', 'comments_count')
+
+# likes and comments of the same object within this window (in seconds)
+# have their side effects applied together, see EngagementService
+ENGAGEMENT_COALESCE_WINDOW = 1 if not settings.TESTING else 0
+
+# a claimed engagement queue older than this (in seconds) belongs to a run
+# killed by the task time limit, see EngagementService.recover_stale_events
+ENGAGEMENT_PROCESSING_TIMEOUT = ONE_HOUR + 60
@@ -4,3 +4,16 @@ def push_tweet_to_cache(sender, instance, created, **kwargs):
 
     from tweets.services import TweetService
     TweetService.push_tweet_to_cache(instance)
+
+
+def tweet_changed(sender, instance, **kwargs):
+    from tweets.services import TweetService
+    TweetService.invalidate_tweet_fragment(instance.id)
+
+
+def tweet_photo_changed(sender, instance, **kwargs):
+    if instance.tweet_id is None:
+        return
+
+    from tweets.services import TweetService
+    TweetService.invalidate_tweet_fragment(instance.tweet_id)
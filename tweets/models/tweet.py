@@ -3,7 +3,7 @@ from django.contrib.contenttypes.models import ContentType
 from django.db import models
 from django.db.models.signals import post_save
 from likes.models import Like
-from tweets.listeners import push_tweet_to_cache
+from tweets.listeners import push_tweet_to_cache, tweet_changed
 from utils.listeners import invalidate_object_cache
 from utils.memcached_helper import MemcachedHelper
 from utils.time_helpers import utc_now
@@ -37,6 +37,9 @@ class Tweet(models.Model):
 
     @property
     def cached_user(self):
+        # set by TweetHydration when the users of a page are loaded in batch
+        if hasattr(self, '_cached_user'):
+            return getattr(self, '_cached_user')
         return MemcachedHelper.get_object_through_cache(User, self.user_id)
 
     @property
@@ -46,3 +49,4 @@ class Tweet(models.Model):
 
 post_save.connect(invalidate_object_cache, sender=Tweet)
 post_save.connect(push_tweet_to_cache, sender=Tweet)
+post_save.connect(tweet_changed, sender=Tweet)
@@ -1,7 +1,9 @@
 from .tweet import Tweet
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models.signals import post_save, pre_delete
 from tweets.constants import TweetPhotoStatus, TWEET_PHOTO_STATUS_CHOICES
+from tweets.listeners import tweet_photo_changed
 
 
 class TweetPhoto(models.Model):
@@ -31,3 +33,7 @@ class TweetPhoto(models.Model):
 
     def __str__(self):
         return f'{self.tweet_id}: {self.file}'
+
+
+pre_delete.connect(tweet_photo_changed, sender=TweetPhoto)
+post_save.connect(tweet_photo_changed, sender=TweetPhoto)
@@ -1,8 +1,30 @@
+from accounts.services import UserService
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from likes.services import LikeService
+from tweets.constants import (
+    ENGAGEMENT_COALESCE_WINDOW,
+    ENGAGEMENT_PROCESSING_TIMEOUT,
+    TWEET_COUNT_ATTRS,
+    TWEET_FRAGMENT_VERSION,
+)
 from tweets.models import Tweet
 from tweets.models import TweetPhoto
-from twitter.cache import USER_TWEETS_PATTERN
+from twitter.cache import (
+    PENDING_ENGAGEMENTS_PATTERN,
+    PROCESSING_ENGAGEMENTS_KEY,
+    TWEET_FRAGMENT_PATTERN,
+    USER_TWEETS_PATTERN,
+)
+from utils.memcached_helper import MemcachedHelper
+from utils.redis_client import RedisClient
 from utils.redis_helper import RedisHelper
 
+import uuid
+
+cache = caches['testing'] if settings.TESTING else caches['default']
+
 
 def lazy_load_tweets(user_id):
     def _lazy_load(limit):
@@ -12,6 +34,16 @@ def lazy_load_tweets(user_id):
 
 class TweetService(object):
 
+    @classmethod
+    def flush_pending_counts(cls):
+        """
+        write the buffered likes/comments count deltas to the tweet table
+        """
+        return sum(
+            RedisHelper.flush_pending_counts(Tweet, attr)
+            for attr in TWEET_COUNT_ATTRS
+        )
+
     @classmethod
     def create_photos_from_files(cls, tweet, files):
         photos = []
@@ -24,6 +56,8 @@ class TweetService(object):
             )
             photos.append(photo)
         TweetPhoto.objects.bulk_create(photos)
+        # bulk_create does not send post_save
+        cls.invalidate_tweet_fragment(tweet.id)
 
     @classmethod
     def get_cached_tweets(cls, user_id):
@@ -34,3 +68,201 @@ class TweetService(object):
     def push_tweet_to_cache(cls, tweet):
         key = USER_TWEETS_PATTERN.format(user_id=tweet.user_id)
         RedisHelper.push_object(key, tweet, lazy_load_tweets(tweet.user_id))
+
+    @classmethod
+    def get_photo_urls(cls, tweet_ids):
+        photo_urls = {tweet_id: [] for tweet_id in tweet_ids}
+        photos = TweetPhoto.objects.filter(tweet_id__in=tweet_ids).order_by('order')
+        for photo in photos:
+            photo_urls[photo.tweet_id].append(photo.file.url)
+        return photo_urls
+
+    @classmethod
+    def get_tweet_fragment_key(cls, tweet_id):
+        return TWEET_FRAGMENT_PATTERN.format(
+            version=TWEET_FRAGMENT_VERSION,
+            tweet_id=tweet_id,
+        )
+
+    @classmethod
+    def get_tweet_fragments(cls, tweet_ids):
+        """
+        rendered viewer independent json of the tweets, returns
+        {tweet_id: fragment} for the tweets that have been cached
+        """
+        keys = {cls.get_tweet_fragment_key(tweet_id): tweet_id for tweet_id in tweet_ids}
+        return {
+            keys[key]: fragment
+            for key, fragment in cache.get_many(list(keys)).items()
+        }
+
+    @classmethod
+    def set_tweet_fragment(cls, tweet_id, fragment):
+        cache.set(cls.get_tweet_fragment_key(tweet_id), fragment)
+
+    @classmethod
+    def invalidate_tweet_fragment(cls, tweet_id):
+        cache.delete(cls.get_tweet_fragment_key(tweet_id))
+
+
+class EngagementService(object):
+    """
+    the side effects of likes and comments, i.e. counters, ranked newsfeeds
+    and notifications, are queued per target object by the listeners and
+    applied by process_engagements_task. every event schedules a task, the
+    first one to run after the window applies all the queued events of the
+    target with net deltas and the rest find nothing to do.
+
+    the events are claimed into a processing queue and only deleted in the
+    transaction that buffers the counter deltas, recover_stale_events
+    processes again the queues of the runs that died before. the counters
+    are applied once, notifications and ranking may be applied twice.
+    """
+
+    @classmethod
+    def get_pending_engagements_key(cls, model, object_id):
+        return PENDING_ENGAGEMENTS_PATTERN.format(model=model, object_id=object_id)
+
+    @classmethod
+    def push_event(cls, model, object_id, kind, user_id):
+        """
+        kind is like/unlike on a tweet or comment, comment/uncomment on a tweet
+        """
+        from tweets.tasks import process_engagements_task
+        key = cls.get_pending_engagements_key(model, object_id)
+        RedisHelper.push_to_queue(key, [kind, user_id])
+        process_engagements_task.apply_async(
+            args=(model, object_id),
+            countdown=ENGAGEMENT_COALESCE_WINDOW,
+        )
+
+    @classmethod
+    def process_events(cls, model, object_id, queue_key=None):
+        """
+        queue_key is the pending queue of the target by default,
+        or a stale processing queue of it
+        """
+        if queue_key is None:
+            queue_key = cls.get_pending_engagements_key(model, object_id)
+        processing_key = '{}:processing:{}'.format(
+            cls.get_pending_engagements_key(model, object_id),
+            uuid.uuid4().hex,
+        )
+        events = RedisHelper.claim_queue(queue_key, processing_key, PROCESSING_ENGAGEMENTS_KEY)
+        if not events:
+            return 0
+        return cls._apply_events(model, object_id, events, processing_key)
+
+    @classmethod
+    def _apply_events(cls, model, object_id, events, processing_key):
+        from comments.models import Comment
+        from inbox.services import NotificationService
+        from likes.models import Like
+        from newsfeeds.services import NewsFeedRankingService
+
+        pipe = RedisClient.get_connection().pipeline()
+        RedisHelper.release_queue(processing_key, PROCESSING_ENGAGEMENTS_KEY, pipe)
+
+        # {user_id: [likes_delta, comments_delta]}
+        deltas = {}
+        for kind, user_id in events:
+            user_deltas = deltas.setdefault(user_id, [0, 0])
+            if kind in ('like', 'unlike'):
+                user_deltas[0] += 1 if kind == 'like' else -1
+            else:
+                user_deltas[1] += 1 if kind == 'comment' else -1
+
+        model_class = Tweet if model == 'tweet' else Comment
+        target = MemcachedHelper.get_objects_through_cache(model_class, [object_id]).get(object_id)
+        if target is None:
+            pipe.execute()
+            return 0
+
+        content_type = ContentType.objects.get_for_model(model_class)
+        for user_id, (likes_delta, comments_delta) in deltas.items():
+            # the notifications are sent from the actual model instances
+            if likes_delta > 0:
+                NotificationService.send_like_notification(Like(
+                    user_id=user_id,
+                    content_type=content_type,
+                    object_id=object_id,
+                ))
+            if comments_delta > 0:
+                NotificationService.send_comment_notification(Comment(
+                    user_id=user_id,
+                    tweet_id=object_id,
+                ))
+        if model_class != Tweet:
+            pipe.execute()
+            return len(events)
+
+        NewsFeedRankingService.on_tweet_engaged(target, [
+            [user_id, user_likes_delta, user_comments_delta]
+            for user_id, (user_likes_delta, user_comments_delta) in deltas.items()
+            if user_likes_delta or user_comments_delta
+        ])
+        likes_delta = sum(user_deltas[0] for user_deltas in deltas.values())
+        comments_delta = sum(user_deltas[1] for user_deltas in deltas.values())
+        if likes_delta:
+            RedisHelper.incr_count(target, 'likes_count', likes_delta, pipe=pipe)
+        if comments_delta:
+            RedisHelper.incr_count(target, 'comments_count', comments_delta, pipe=pipe)
+        # the deltas and the removal of the events in one MULTI
+        pipe.execute()
+        return len(events)
+
+    @classmethod
+    def recover_stale_events(cls):
+        """
+        process again the queues claimed by runs older than the task time
+        limit, their worker died before releasing them
+        """
+        count = 0
+        stale_keys = RedisHelper.get_stale_processing_queues(
+            PROCESSING_ENGAGEMENTS_KEY,
+            ENGAGEMENT_PROCESSING_TIMEOUT,
+        )
+        for stale_key in stale_keys:
+            # pending_engagements:<model>:<object_id>:processing:<run>
+            _, model, object_id = stale_key.split(':')[:3]
+            count += cls.process_events(model, int(object_id), queue_key=stale_key)
+        return count
+
+
+class TweetHydration(object):
+    """
+    everything TweetSerializer needs to render a page of tweets, resolved
+    with one batched call per data source instead of several per tweet.
+    pass it to the serializers as context['tweet_hydration'].
+    """
+
+    def __init__(self, tweet_ids, user):
+        tweet_ids = list(set(tweet_ids))
+        self.tweets = MemcachedHelper.get_objects_through_cache(Tweet, tweet_ids)
+        tweets = list(self.tweets.values())
+
+        user_ids = set(tweet.user_id for tweet in tweets if tweet.user_id is not None)
+        users = UserService.get_users_with_profiles_through_cache(user_ids)
+        for tweet in tweets:
+            if tweet.user_id in users:
+                setattr(tweet, '_cached_user', users[tweet.user_id])
+
+        counts = RedisHelper.get_counts(tweets, TWEET_COUNT_ATTRS)
+        self.likes_counts = {
+            tweet_id: tweet_counts['likes_count']
+            for tweet_id, tweet_counts in counts.items()
+        }
+        self.comments_counts = {
+            tweet_id: tweet_counts['comments_count']
+            for tweet_id, tweet_counts in counts.items()
+        }
+        self.liked_tweet_ids = LikeService.get_liked_object_ids(user, Tweet, tweet_ids)
+
+        # rendered fragments, photos are only needed to render the missing ones
+        self.fragments = TweetService.get_tweet_fragments(self.tweets.keys())
+        self.user_fragments = UserService.get_user_fragments(users.keys())
+        self.photo_urls = TweetService.get_photo_urls([
+            tweet_id
+            for tweet_id in self.tweets
+            if tweet_id not in self.fragments
+        ])
@@ -0,0 +1,23 @@
+from celery import shared_task
+from utils.time_constants import ONE_HOUR
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def flush_pending_tweet_counts_task():
+    from tweets.services import TweetService
+    count = TweetService.flush_pending_counts()
+    return 'counts of {} tweets flushed.'.format(count)
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def process_engagements_task(model, object_id):
+    from tweets.services import EngagementService
+    count = EngagementService.process_events(model, object_id)
+    return '{} engagements of {} {} processed.'.format(count, model, object_id)
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def recover_engagements_task():
+    from tweets.services import EngagementService
+    count = EngagementService.recover_stale_events()
+    return '{} stale engagements processed.'.format(count)
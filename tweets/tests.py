@@ -1,10 +1,12 @@
+from accounts.services import UserService
 from datetime import timedelta
 from testing.testcases import TestCase
 from tweets.constants import TweetPhotoStatus
-from tweets.models import TweetPhoto
-from tweets.services import TweetService
-from twitter.cache import USER_TWEETS_PATTERN
+from tweets.models import Tweet, TweetPhoto
+from tweets.services import EngagementService, TweetHydration, TweetService
+from twitter.cache import PROCESSING_ENGAGEMENTS_KEY, USER_TWEETS_PATTERN
 from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
 from utils.redis_serializers import DjangoModelSerializer
 from utils.time_helpers import utc_now
 
@@ -97,3 +99,143 @@ class TweetServiceTests(TestCase):
 
         tweets = TweetService.get_cached_tweets(self.jesse.id)
         self.assertEqual([t.id for t in tweets], [tweet2.id, tweet1.id])
+
+    def test_tweet_hydration(self):
+        eliza = self.create_user('eliza')
+        tweet1 = self.create_tweet(self.jesse, 'tweet1')
+        tweet2 = self.create_tweet(eliza, 'tweet2')
+        self.create_like(eliza, tweet1)
+        self.create_comment(eliza, tweet2)
+
+        hydration = TweetHydration([tweet1.id, tweet2.id], eliza)
+        self.assertEqual(set(hydration.tweets.keys()), {tweet1.id, tweet2.id})
+        self.assertEqual(hydration.tweets[tweet1.id].cached_user, self.jesse)
+        self.assertEqual(hydration.likes_counts, {tweet1.id: 1, tweet2.id: 0})
+        self.assertEqual(hydration.comments_counts, {tweet1.id: 0, tweet2.id: 1})
+        self.assertEqual(hydration.liked_tweet_ids, {tweet1.id})
+        self.assertEqual(hydration.photo_urls, {tweet1.id: [], tweet2.id: []})
+
+    def test_tweet_fragment_invalidation(self):
+        tweet = self.create_tweet(self.jesse, 'tweet1')
+        TweetService.set_tweet_fragment(tweet.id, {'content': 'tweet1'})
+        UserService.set_user_fragment(self.jesse.id, {'username': 'jesse'})
+        self.assertEqual(TweetService.get_tweet_fragments([tweet.id]), {
+            tweet.id: {'content': 'tweet1'},
+        })
+
+        # photo changed
+        TweetPhoto.objects.create(tweet=tweet, user=self.jesse)
+        self.assertEqual(TweetService.get_tweet_fragments([tweet.id]), {})
+
+        # tweet changed
+        TweetService.set_tweet_fragment(tweet.id, {'content': 'tweet1'})
+        tweet.content = 'tweet1 updated'
+        tweet.save()
+        self.assertEqual(TweetService.get_tweet_fragments([tweet.id]), {})
+
+        # profile changed
+        self.assertEqual(UserService.get_user_fragments([self.jesse.id]), {
+            self.jesse.id: {'username': 'jesse'},
+        })
+        profile = self.jesse.profile
+        profile.nickname = 'jesse'
+        profile.save()
+        self.assertEqual(UserService.get_user_fragments([self.jesse.id]), {})
+
+    def test_flush_pending_counts(self):
+        eliza = self.create_user('eliza')
+        tweet = self.create_tweet(self.jesse)
+        self.create_like(eliza, tweet)
+        self.create_like(self.jesse, tweet)
+        self.create_comment(eliza, tweet)
+
+        # counted in redis before the tweet row is updated
+        self.assertEqual(RedisHelper.get_count(tweet, 'likes_count'), 2)
+        tweet.refresh_from_db()
+        self.assertEqual((tweet.likes_count, tweet.comments_count), (0, 0))
+
+        self.assertEqual(TweetService.flush_pending_counts(), 2)
+        tweet.refresh_from_db()
+        self.assertEqual((tweet.likes_count, tweet.comments_count), (2, 1))
+        self.assertEqual(
+            RedisHelper.get_counts([tweet], ['likes_count', 'comments_count']),
+            {tweet.id: {'likes_count': 2, 'comments_count': 1}},
+        )
+        self.assertEqual(TweetService.flush_pending_counts(), 0)
+
+        # a count loaded before the flush updated the row is not cached
+        RedisClient.get_connection().delete(RedisHelper.get_count_key(tweet, 'likes_count'))
+        self.assertEqual(RedisHelper.run_script(
+            RedisHelper.SET_COUNT_SCRIPT,
+            keys=[
+                RedisHelper.get_count_key(tweet, 'likes_count'),
+                RedisHelper.get_counts_version_key(Tweet, 'likes_count'),
+            ],
+            args=['', 0, 60],
+        ), 0)
+        self.assertEqual(RedisHelper.get_count(tweet, 'likes_count'), 2)
+
+        # a flush that starts while another one runs does nothing
+        self.create_like(eliza, self.create_tweet(eliza))
+        lock = RedisClient.get_connection().lock(
+            RedisHelper.get_flush_lock_key(Tweet, 'likes_count'),
+            timeout=60,
+        )
+        lock.acquire()
+        self.assertEqual(TweetService.flush_pending_counts(), 0)
+        lock.release()
+        self.assertEqual(TweetService.flush_pending_counts(), 1)
+
+    def test_get_counts(self):
+        tweets = [self.create_tweet(self.jesse) for _ in range(3)]
+        self.create_comment(self.jesse, tweets[0])
+        TweetService.flush_pending_counts()
+
+        # the missing counters of the whole page are loaded with one query
+        self.clear_cache()
+        with self.assertNumQueries(1):
+            counts = RedisHelper.get_counts(tweets, ['likes_count', 'comments_count'])
+        self.assertEqual(counts[tweets[0].id], {'likes_count': 0, 'comments_count': 1})
+        self.assertEqual(counts[tweets[2].id], {'likes_count': 0, 'comments_count': 0})
+        with self.assertNumQueries(0):
+            RedisHelper.get_counts(tweets, ['likes_count', 'comments_count'])
+
+    def test_process_engagements(self):
+        eliza = self.create_user('eliza')
+        tweet = self.create_tweet(self.jesse)
+        key = EngagementService.get_pending_engagements_key('tweet', tweet.id)
+        for kind, user_id in [
+            ['like', eliza.id],
+            ['comment', eliza.id],
+            ['like', self.jesse.id],
+            ['unlike', self.jesse.id],
+        ]:
+            RedisHelper.push_to_queue(key, [kind, user_id])
+
+        # applied together with net deltas
+        self.assertEqual(EngagementService.process_events('tweet', tweet.id), 4)
+        self.assertEqual(EngagementService.process_events('tweet', tweet.id), 0)
+        self.assertEqual(RedisHelper.get_count(tweet, 'likes_count'), 1)
+        self.assertEqual(RedisHelper.get_count(tweet, 'comments_count'), 1)
+        self.assertEqual(self.jesse.notifications.count(), 2)
+
+    def test_recover_stale_events(self):
+        eliza = self.create_user('eliza')
+        tweet = self.create_tweet(self.jesse)
+        key = EngagementService.get_pending_engagements_key('tweet', tweet.id)
+        RedisHelper.push_to_queue(key, ['like', eliza.id])
+
+        # a run that claimed the events and died
+        processing_key = key + ':processing:dead'
+        RedisHelper.claim_queue(key, processing_key, PROCESSING_ENGAGEMENTS_KEY)
+        self.assertEqual(EngagementService.process_events('tweet', tweet.id), 0)
+        self.assertEqual(EngagementService.recover_stale_events(), 0)
+        self.assertEqual(RedisHelper.get_count(tweet, 'likes_count'), 0)
+
+        conn = RedisClient.get_connection()
+        conn.zadd(PROCESSING_ENGAGEMENTS_KEY, {processing_key: 0})
+        self.assertEqual(EngagementService.recover_stale_events(), 1)
+        self.assertEqual(RedisHelper.get_count(tweet, 'likes_count'), 1)
+        self.assertEqual(conn.exists(processing_key), 0)
+        self.assertEqual(conn.zcard(PROCESSING_ENGAGEMENTS_KEY), 0)
+        self.assertEqual(EngagementService.recover_stale_events(), 0)
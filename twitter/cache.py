@@ -1,7 +1,40 @@
 # memcached
 FOLLOWINGS_PATTERN = 'followings:{user_id}'
 USER_PROFILE_PATTERN = 'userprofile:{user_id}'
+TWEET_FRAGMENT_PATTERN = 'tweet_fragment:{version}:{tweet_id}'
+USER_FRAGMENT_PATTERN = 'user_fragment:{version}:{user_id}'
 
 # redis
 USER_TWEETS_PATTERN = 'user_tweets:{user_id}'
 USER_NEWSFEEDS_PATTERN = 'user_newsfeeds:{user_id}'
+USER_HBASE_NEWSFEEDS_PATTERN = 'user_hbase_newsfeeds:{user_id}'
+PENDING_FANOUT_TWEETS_PATTERN = 'pending_fanout_tweets:{user_id}'
+PROCESSING_FANOUTS_KEY = 'processing_fanouts'
+PENDING_ENGAGEMENTS_PATTERN = 'pending_engagements:{model}:{object_id}'
+PROCESSING_ENGAGEMENTS_KEY = 'processing_engagements'
+USER_RANKED_NEWSFEEDS_PATTERN = 'user_ranked_newsfeeds:{user_id}'
+# the users whose cached ranked newsfeeds hold the tweet
+TWEET_RANKED_READERS_PATTERN = 'tweet_ranked_readers:{tweet_id}'
+USER_AUTHOR_AFFINITY_PATTERN = 'user_author_affinity:{user_id}'
+USER_FOLLOWINGS_PATTERN = 'user_followings:{user_id}'
+USER_FOLLOWINGS_BLOOM_FILTER_PATTERN = 'user_followings_bloom_filter:{user_id}'
+USER_FOLLOWERS_PATTERN = 'user_followers:{user_id}'
+USER_FOLLOW_RECOMMENDATIONS_PATTERN = 'user_follow_recommendations:{user_id}'
+FOLLOW_RECOMMENDATIONS_DIRTY_USERS_KEY = 'follow_recommendations_dirty_users'
+USER_SOCIAL_COUNT_PATTERN = 'user_social_count:{attr}:{user_id}'
+SOCIAL_COUNTS_DIRTY_USERS_KEY = 'social_counts_dirty_users'
+HBASE_BACKFILL_DONE_CHUNKS_PATTERN = 'hbase_backfill_done_chunks:{name}:{chunk_size}'
+SHADOW_READ_STATS_PATTERN = 'shadow_read_stats:{name}'
+USER_LIKED_OBJECTS_PATTERN = 'user_liked_objects:{model}:{user_id}'
+OBJECT_LIKERS_PATTERN = 'object_likers:{model}:{object_id}'
+USER_RECENT_LIKES_PATTERN = 'user_recent_likes:{user_id}'
+AGGREGATED_NOTIFICATION_PATTERN = 'aggregated_notification:{recipient_id}:{verb}:{target}:{bucket}'
+AGGREGATED_NOTIFICATION_ACTORS_PATTERN = 'aggregated_notification_actors:{notification_id}'
+USER_NOTIFICATIONS_PATTERN = 'user_notifications:{user_id}'
+USER_UNREAD_NOTIFICATIONS_PATTERN = 'user_unread_notifications:{user_id}'
+UNREAD_COUNTS_DIRTY_USERS_KEY = 'unread_counts_dirty_users'
+GATEKEEPERS_KEY = 'gatekeepers'
+GATEKEEPERS_CHANNEL = 'gatekeepers_changed'
+# set once the legacy gatekeeper:<gk_name> hashes are copied into GATEKEEPERS_KEY
+GATEKEEPERS_MIGRATED_KEY = 'gatekeepers_migrated'
+LEGACY_GATEKEEPER_PATTERN = 'gatekeeper:{gk_name}'
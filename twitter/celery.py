@@ -1,6 +1,7 @@
 import os
 
 from celery import Celery
+from celery.signals import task_postrun, task_prerun
 
 # set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'twitter.settings')
@@ -17,6 +18,19 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 
+@task_prerun.connect
+def pin_gatekeeper_snapshot(**kwargs):
+    # every task sees one consistent set of gatekeeper flags
+    from gatekeeper.signals import pin_task_snapshot
+    pin_task_snapshot(**kwargs)
+
+
+@task_postrun.connect
+def unpin_gatekeeper_snapshot(**kwargs):
+    from gatekeeper.signals import unpin_task_snapshot
+    unpin_task_snapshot(**kwargs)
+
+
 @app.task(bind=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
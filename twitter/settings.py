@@ -53,6 +53,8 @@ INSTALLED_APPS = [
     'newsfeeds',
     'comments',
     'likes',
+    'gatekeeper',
+    'inbox',
 ]
 
 REST_FRAMEWORK = {
@@ -72,6 +74,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'gatekeeper.middleware.GateKeeperSnapshotMiddleware',
 ]
 
 ROOT_URLCONF = 'twitter.urls'
@@ -196,6 +199,32 @@ CELERY_QUEUES = (
     Queue('default', routing_key='default'),
     Queue('newsfeeds', routing_key='newsfeeds'),
 )
+CELERY_BEAT_SCHEDULE = {
+    'refresh-dirty-follow-recommendations': {
+        'task': 'friendships.tasks.refresh_dirty_follow_recommendations_task',
+        'schedule': 600,  # in seconds
+    },
+    'write-back-social-counts': {
+        'task': 'friendships.tasks.write_back_social_counts_task',
+        'schedule': 300,  # in seconds
+    },
+    'flush-pending-tweet-counts': {
+        'task': 'tweets.tasks.flush_pending_tweet_counts_task',
+        'schedule': 10,  # in seconds
+    },
+    'recover-stale-engagements': {
+        'task': 'tweets.tasks.recover_engagements_task',
+        'schedule': 600,  # in seconds
+    },
+    'recover-stale-fanouts': {
+        'task': 'newsfeeds.tasks.recover_fanouts_task',
+        'schedule': 600,  # in seconds
+    },
+    'reconcile-unread-notification-counts': {
+        'task': 'inbox.tasks.reconcile_unread_counts_task',
+        'schedule': 300,  # in seconds
+    },
+}
 
 # Rate Limiter
 RATELIMIT_USE_CACHE = 'ratelimit'
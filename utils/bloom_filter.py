@@ -0,0 +1,128 @@
+from django.conf import settings
+from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
+from utils.time_constants import ONE_HOUR
+
+import hashlib
+import uuid
+
+# KEYS: bitmaps, ARGV: offsets. bitmaps that do not exist are left alone
+# instead of being created with only these bits.
+BLOOM_FILTER_ADD_SCRIPT = """
+    for _, key in ipairs(KEYS) do
+        if redis.call('EXISTS', key) == 1 then
+            for _, offset in ipairs(ARGV) do
+                redis.call('SETBIT', key, offset, 1)
+            end
+        end
+    end
+"""
+
+
+class RedisBloomFilter:
+    """
+    bloom filter kept in a redis bitmap. might_contain never returns False
+    for an added value, a True has to be confirmed by an exact check.
+    """
+
+    def __init__(self, key, num_bits, num_hashes, rebuild_timeout=ONE_HOUR):
+        self.key = key
+        # holds the temporary key of the rebuild in progress
+        self.rebuild_key = '{}:rebuild'.format(key)
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.rebuild_timeout = rebuild_timeout
+
+    def get_offsets(self, value):
+        # double hashing, h1 + i * h2 simulates num_hashes hash functions
+        digest = hashlib.md5(str(value).encode('utf-8')).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def _set_bits(self, pipe, key, values):
+        for value in values:
+            for offset in self.get_offsets(value):
+                pipe.setbit(key, offset, 1)
+
+    def exists(self):
+        conn = RedisClient.get_connection()
+        return bool(conn.exists(self.key))
+
+    def add(self, values):
+        """
+        add values to the filter and to the one being rebuilt. missing keys
+        are left alone, an absent filter is rebuilt before it is consulted.
+        """
+        offsets = set()
+        for value in values:
+            offsets.update(self.get_offsets(value))
+        if not offsets:
+            return
+        conn = RedisClient.get_connection()
+        keys = [self.key]
+        building_key = conn.get(self.rebuild_key)
+        if building_key is not None:
+            keys.append(building_key.decode('utf-8'))
+        RedisHelper.run_script(BLOOM_FILTER_ADD_SCRIPT, keys=keys, args=sorted(offsets))
+
+    def might_contain_many(self, values):
+        """
+        returns {value: bool} with one pipelined round trip of GETBIT,
+        or None if the filter does not exist
+        """
+        values = list(values)
+        conn = RedisClient.get_connection()
+        pipe = conn.pipeline()
+        pipe.exists(self.key)
+        for value in values:
+            for offset in self.get_offsets(value):
+                pipe.getbit(self.key, offset)
+        exists, *bits = pipe.execute()
+        if not exists:
+            return None
+        return {
+            value: all(bits[index * self.num_hashes: (index + 1) * self.num_hashes])
+            for index, value in enumerate(values)
+        }
+
+    def might_contain(self, value):
+        might_contain = self.might_contain_many([value])
+        return might_contain is None or might_contain[value]
+
+    def start_rebuild(self):
+        """
+        claim the rebuild with SET NX and allocate its temporary key, returns
+        the key or None if a rebuild is already in progress. values added
+        from now on also go to the temporary key, so none are lost while
+        the rebuild loads the values.
+        """
+        conn = RedisClient.get_connection()
+        building_key = '{}:building:{}'.format(self.key, uuid.uuid4().hex)
+        if not conn.set(self.rebuild_key, building_key, nx=True, ex=self.rebuild_timeout):
+            return None
+        # allocate the whole bitmap, this also creates the key
+        pipe = conn.pipeline()
+        pipe.setbit(building_key, self.num_bits - 1, 0)
+        pipe.expire(building_key, self.rebuild_timeout)
+        pipe.execute()
+        return building_key
+
+    def rebuild(self, load_values, building_key=None):
+        """
+        build the filter into the temporary key of start_rebuild and swap
+        it in with RENAME, returns False if another rebuild is in progress
+        """
+        if building_key is None:
+            building_key = self.start_rebuild()
+            if building_key is None:
+                return False
+
+        conn = RedisClient.get_connection()
+        pipe = conn.pipeline()
+        self._set_bits(pipe, building_key, load_values())
+        pipe.rename(building_key, self.key)
+        pipe.expire(self.key, settings.REDIS_KEY_EXPIRE_TIME)
+        pipe.delete(self.rebuild_key)
+        pipe.execute()
+        return True
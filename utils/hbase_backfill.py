@@ -0,0 +1,212 @@
+"""
+copy mysql tables into their hbase counterparts before a gatekeeper switch
+
+the rows are read by primary key ranges (chunks) and written with one
+HBaseModel.batch_create per chunk and hbase model. finished chunks are
+recorded in redis, so an interrupted run resumes where it stopped. together
+with the dual writes in the services, hbase is complete once a run is done.
+"""
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Max, Min
+from django_hbase.client import HBaseClient
+from multiprocessing import Pool
+from twitter.cache import HBASE_BACKFILL_DONE_CHUNKS_PATTERN
+from utils.redis_client import RedisClient
+
+import time
+import zlib
+
+
+class HBaseBackfill:
+    """
+    subclass it and set model_class, fields and hbase_model_classes,
+    to_hbase_data maps a row of model_class to the data of every hbase model
+    """
+    name = None
+    model_class = None
+    fields = ()
+    # rows with a null in any of them have no row key, e.g. a foreign key
+    # set to null when the user or tweet was deleted, and are skipped
+    required_fields = ()
+    hbase_model_classes = ()
+
+    @classmethod
+    def to_hbase_data(cls, row):
+        raise NotImplementedError
+
+    @classmethod
+    def get_done_chunks_key(cls, chunk_size):
+        return HBASE_BACKFILL_DONE_CHUNKS_PATTERN.format(name=cls.name, chunk_size=chunk_size)
+
+    @classmethod
+    def get_chunks(cls, chunk_size):
+        ids = cls.model_class.objects.aggregate(min_id=Min('id'), max_id=Max('id'))
+        if ids['min_id'] is None:
+            return []
+        # aligned to chunk_size, the done chunks recorded by a previous run
+        # still match when the smallest ids have been deleted since
+        first_start = ids['min_id'] // chunk_size * chunk_size
+        return [
+            (start, start + chunk_size)
+            for start in range(first_start, ids['max_id'] + 1, chunk_size)
+        ]
+
+    @classmethod
+    def get_pending_chunks(cls, chunk_size):
+        conn = RedisClient.get_connection()
+        done = set(int(start) for start in conn.smembers(cls.get_done_chunks_key(chunk_size)))
+        return [chunk for chunk in cls.get_chunks(chunk_size) if chunk[0] not in done]
+
+    @classmethod
+    def reset(cls, chunk_size):
+        conn = RedisClient.get_connection()
+        conn.delete(cls.get_done_chunks_key(chunk_size))
+
+    @classmethod
+    def _get_rows(cls, start, end):
+        queryset = cls.model_class.objects.filter(id__gte=start, id__lt=end)
+        for field in cls.required_fields:
+            queryset = queryset.exclude(**{'{}__isnull'.format(field): True})
+        return queryset.order_by('id').values(*cls.fields)
+
+    @classmethod
+    def copy_chunk(cls, chunk):
+        start, end = chunk
+        batch_data = [cls.to_hbase_data(row) for row in cls._get_rows(start, end)]
+        if batch_data:
+            for hbase_model_class in cls.hbase_model_classes:
+                hbase_model_class.batch_create(batch_data)
+
+        conn = RedisClient.get_connection()
+        conn.sadd(cls.get_done_chunks_key(end - start), start)
+        return len(batch_data)
+
+    @classmethod
+    def get_checksum(cls, data):
+        return zlib.crc32(repr(sorted(data.items())).encode('utf-8'))
+
+    @classmethod
+    def verify_chunk(cls, chunk):
+        """
+        returns (chunk, number of rows, number of mismatched rows), a row
+        mismatches if an hbase model misses it or its checksum differs
+        """
+        start, end = chunk
+        batch_data = [cls.to_hbase_data(row) for row in cls._get_rows(start, end)]
+        mismatched = 0
+        for hbase_model_class in cls.hbase_model_classes:
+            row_keys = [hbase_model_class.serialize_row_key(data) for data in batch_data]
+            rows = dict(hbase_model_class.get_table().rows(row_keys)) if row_keys else {}
+            for row_key, data in zip(row_keys, batch_data):
+                instance = hbase_model_class.init_from_row(row_key, rows.get(row_key))
+                if instance is None:
+                    mismatched += 1
+                    continue
+                hbase_data = {key: getattr(instance, key) for key in data}
+                if cls.get_checksum(hbase_data) != cls.get_checksum(data):
+                    mismatched += 1
+        return chunk, len(batch_data), mismatched
+
+    @classmethod
+    def run(cls, chunk_size, workers=1, verify=False, log=None):
+        """
+        copy (or verify) every pending chunk with a pool of worker processes,
+        workers=0 runs in the current process. log receives progress lines
+        with the throughput so far.
+        """
+        if verify:
+            chunks, func = cls.get_chunks(chunk_size), _verify_chunk
+        else:
+            chunks, func = cls.get_pending_chunks(chunk_size), _copy_chunk
+        args = [(cls, chunk) for chunk in chunks]
+
+        if workers:
+            pool = Pool(workers, initializer=_init_worker)
+            results = pool.imap_unordered(func, args)
+        else:
+            pool = None
+            results = map(func, args)
+
+        started_at = time.time()
+        total_rows, mismatched_chunks = 0, []
+        try:
+            for index, result in enumerate(results):
+                if verify:
+                    chunk, rows, mismatched = result
+                    if mismatched:
+                        mismatched_chunks.append(chunk)
+                else:
+                    rows = result
+                total_rows += rows
+                if log is not None:
+                    elapsed = max(time.time() - started_at, 1e-6)
+                    log('{} {}/{} chunks, {} rows, {:.0f} rows/s'.format(
+                        cls.name,
+                        index + 1,
+                        len(chunks),
+                        total_rows,
+                        total_rows / elapsed,
+                    ))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return total_rows, mismatched_chunks
+
+
+def _init_worker():
+    # connections must not be shared with the parent process
+    connections.close_all()
+    HBaseClient.conn = None
+    RedisClient.conn = None
+
+
+def _copy_chunk(args):
+    backfill_class, chunk = args
+    return backfill_class.copy_chunk(chunk)
+
+
+def _verify_chunk(args):
+    backfill_class, chunk = args
+    return backfill_class.verify_chunk(chunk)
+
+
+class HBaseBackfillCommand(BaseCommand):
+    """
+    management command running an HBaseBackfill, subclasses set backfill_class
+    """
+    backfill_class = None
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='forget the finished chunks and copy everything again',
+        )
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='compare the checksums of every row instead of copying',
+        )
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            self.backfill_class.reset(options['chunk_size'])
+        total_rows, mismatched_chunks = self.backfill_class.run(
+            options['chunk_size'],
+            workers=options['workers'],
+            verify=options['verify'],
+            log=self.stdout.write,
+        )
+        if not options['verify']:
+            self.stdout.write('{} rows copied'.format(total_rows))
+            return
+        for start, end in mismatched_chunks:
+            self.stdout.write('mismatched rows in id range [{}, {})'.format(start, end))
+        self.stdout.write('{} rows verified, {} chunks mismatched'.format(
+            total_rows,
+            len(mismatched_chunks),
+        ))
@@ -24,6 +24,33 @@ class MemcachedHelper:
         cache.set(key, obj)
         return obj
 
+    @classmethod
+    def get_objects_through_cache(cls, model_class, object_ids):
+        """
+        batch version of get_object_through_cache, returns {object_id: object}
+        with one get_many and at most one query for the cache misses
+        """
+        keys = {
+            cls.get_key(model_class, object_id): object_id
+            for object_id in object_ids
+            if object_id is not None
+        }
+        objects = {
+            keys[key]: obj
+            for key, obj in cache.get_many(list(keys)).items()
+        }
+
+        # cache miss
+        missing_ids = [object_id for object_id in keys.values() if object_id not in objects]
+        if missing_ids:
+            missing_objects = model_class.objects.in_bulk(missing_ids)
+            cache.set_many({
+                cls.get_key(model_class, object_id): obj
+                for object_id, obj in missing_objects.items()
+            })
+            objects.update(missing_objects)
+        return objects
+
     @classmethod
     def invalidate_cached_object(cls, model_class, object_id):
         key = cls.get_key(model_class, object_id)
@@ -1,9 +1,13 @@
 from dateutil import parser
 from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
 from rest_framework.pagination import BasePagination
 from rest_framework.response import Response
 from utils.time_constants import MAX_TIMESTAMP
 
+import sys
+
 
 class EndlessPagination(BasePagination):
     page_size = 20
@@ -105,8 +109,107 @@ class EndlessPagination(BasePagination):
             return paginated_list
         return None
 
+    def get_ranked_cursor(self, request):
+        """
+        the score and member of the last item, score__lt=...&member__lt=...
+        scores are not unique, the member breaks the ties
+        """
+        score = request.query_params.get('score__lt')
+        if score is None:
+            return None
+        try:
+            score = float(score)
+        except ValueError:
+            raise ValidationError({'score__lt': 'invalid cursor'})
+        return score, request.query_params.get('member__lt')
+
+    def paginate_ranked_list(self, load_ranked_objects, request):
+        cursor = self.get_ranked_cursor(request)
+        objects = load_ranked_objects(cursor, self.page_size + 1)
+        self.has_next_page = len(objects) > self.page_size
+        return objects[:self.page_size]
+
     def get_paginated_response(self, data):
         return Response({
             'has_next_page': self.has_next_page,
             'results': data,
         })
+
+
+class KeysetPagination(EndlessPagination):
+    """
+    endless pagination ordered by (timestamp, id) descending, for lists whose
+    timestamp is neither unique nor fixed, e.g. aggregated notifications.
+    the cursor of the next page is the timestamp and id of the last item,
+    timestamp__lt=...&id__lt=..., newer items are timestamp__gt=...&id__gt=...
+    without id the cursor only compares the timestamp.
+    """
+
+    def get_cursor(self, request, lookup):
+        timestamp = request.query_params.get('timestamp__{}'.format(lookup))
+        if timestamp is None:
+            return None
+        object_id = request.query_params.get('id__{}'.format(lookup))
+        try:
+            timestamp = parser.isoparse(timestamp)
+            if object_id is None:
+                object_id = 0 if lookup == 'lt' else sys.maxsize
+            return timestamp, int(object_id)
+        except ValueError:
+            raise ValidationError({
+                'timestamp__{}'.format(lookup): 'invalid cursor',
+            })
+
+    def paginate_ordered_list(self, reverse_ordered_list, request):
+        cursor = self.get_cursor(request, 'gt')
+        if cursor is not None:
+            objects = []
+            for obj in reverse_ordered_list:
+                if (obj.timestamp, obj.id) > cursor:
+                    objects.append(obj)
+                else:
+                    break
+            self.has_next_page = False
+            return objects
+
+        index = 0
+        cursor = self.get_cursor(request, 'lt')
+        if cursor is not None:
+            for index, obj in enumerate(reverse_ordered_list):
+                if (obj.timestamp, obj.id) < cursor:
+                    break
+            else:
+                reverse_ordered_list = []
+        self.has_next_page = len(reverse_ordered_list) > index + self.page_size
+        return reverse_ordered_list[index: index + self.page_size]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor = self.get_cursor(request, 'gt')
+        if cursor is not None:
+            timestamp, object_id = cursor
+            queryset = queryset.filter(
+                Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=object_id)
+            )
+            self.has_next_page = False
+            return queryset.order_by('-timestamp', '-id')
+
+        cursor = self.get_cursor(request, 'lt')
+        if cursor is not None:
+            timestamp, object_id = cursor
+            queryset = queryset.filter(
+                Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=object_id)
+            )
+
+        queryset = queryset.order_by('-timestamp', '-id')[:self.page_size + 1]
+        self.has_next_page = len(queryset) > self.page_size
+        return queryset[:self.page_size]
+
+    def paginate_cached_list(self, cached_list, request):
+        paginated_list = self.paginate_ordered_list(cached_list, request)
+        if 'timestamp__gt' in request.query_params:
+            return paginated_list
+        if self.has_next_page:
+            return paginated_list
+        if len(cached_list) < settings.REDIS_LIST_LENGTH_LIMIT:
+            return paginated_list
+        return None
@@ -1,7 +1,13 @@
 from django.conf import settings
+from django.db.models import Case, F, When
 from django_hbase.models import HBaseModel
 from utils.redis_client import RedisClient
 from utils.redis_serializers import DjangoModelSerializer, HBaseModelSerializer
+from utils.time_constants import ONE_HOUR
+
+import json
+import time
+import uuid
 
 
 class RedisHelper:
@@ -55,39 +61,452 @@ class RedisHelper:
         cls._load_objects_to_cache(key, objects, serializer)
         # print(f'push cache miss {key}, len={len(objects)}')
 
+    @classmethod
+    def push_objects(cls, key, objects, lazy_load_objects):
+        """
+        push several objects with one multi-element lpush,
+        objects should be in ascending order so that the latest one is at the head
+        """
+        if not objects:
+            return
+        if isinstance(objects[0], HBaseModel):
+            serializer = HBaseModelSerializer
+        else:
+            serializer = DjangoModelSerializer
+
+        conn = RedisClient.get_connection()
+        if conn.exists(key):
+            serialized_list = [serializer.serialize(obj) for obj in objects]
+            pipe = conn.pipeline()
+            pipe.lpush(key, *serialized_list)
+            pipe.ltrim(key, 0, settings.REDIS_LIST_LENGTH_LIMIT - 1)
+            pipe.execute()
+            return
+
+        objects = lazy_load_objects(settings.REDIS_LIST_LENGTH_LIMIT)
+        cls._load_objects_to_cache(key, objects, serializer)
+
+    @classmethod
+    def push_cached_object(cls, key, obj, stale_data=None, serializer=DjangoModelSerializer):
+        """
+        push obj to the head of the cached list and remove stale_data, its
+        previous copy as serialized, with one LREM. a list that is not cached
+        is left alone.
+        """
+        cls.run_script(
+            cls.PUSH_CACHED_OBJECT_SCRIPT,
+            keys=[key],
+            args=[
+                serializer.serialize(obj),
+                settings.REDIS_LIST_LENGTH_LIMIT,
+                '' if stale_data is None else stale_data,
+            ],
+        )
+
+    @classmethod
+    def replace_cached_object(cls, key, stale_data, obj, serializer=DjangoModelSerializer):
+        """
+        replace stale_data, the copy of obj as serialized when it was cached,
+        with obj at the same position of the cached list, if it is there
+        """
+        return bool(cls.run_script(
+            cls.REPLACE_CACHED_OBJECT_SCRIPT,
+            keys=[key],
+            args=[stale_data, serializer.serialize(obj)],
+        ))
+
+    @classmethod
+    def push_to_queue(cls, key, value):
+        """
+        append a json serializable value to a pending queue,
+        the queue is consumed as a whole by claim_queue
+        """
+        conn = RedisClient.get_connection()
+        pipe = conn.pipeline()
+        pipe.rpush(key, json.dumps(value))
+        pipe.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+        length, _ = pipe.execute()
+        return length
+
+    # KEYS: queue, processing queue, zset of processing queues, ARGV: now
+    CLAIM_QUEUE_SCRIPT = """
+        redis.call('ZREM', KEYS[3], KEYS[1])
+        if redis.call('EXISTS', KEYS[1]) == 0 then
+            return {}
+        end
+        redis.call('RENAME', KEYS[1], KEYS[2])
+        redis.call('ZADD', KEYS[3], ARGV[1], KEYS[2])
+        return redis.call('LRANGE', KEYS[2], 0, -1)
+    """
+
+    # KEYS: cached list, ARGV: object, max length, stale copy to remove or ''.
+    # a list that is not cached is left alone, it will be lazy loaded.
+    PUSH_CACHED_OBJECT_SCRIPT = """
+        if redis.call('EXISTS', KEYS[1]) == 0 then
+            return 0
+        end
+        if ARGV[3] ~= '' then
+            redis.call('LREM', KEYS[1], 1, ARGV[3])
+        end
+        redis.call('LPUSH', KEYS[1], ARGV[1])
+        redis.call('LTRIM', KEYS[1], 0, ARGV[2] - 1)
+        return 1
+    """
+
+    # KEYS: cached list, ARGV: stale copy, object. replaced where it is.
+    REPLACE_CACHED_OBJECT_SCRIPT = """
+        if redis.call('LINSERT', KEYS[1], 'BEFORE', ARGV[1], ARGV[2]) <= 0 then
+            return 0
+        end
+        redis.call('LREM', KEYS[1], 1, ARGV[1])
+        return 1
+    """
+
+    # KEYS: set, its version, the set loaded aside, ARGV: version read before
+    # loading the members, expire. the loaded set replaces the missing one,
+    # unless an update found it missing since the version was read, '*'
+    # skips the check.
+    LOAD_SET_SCRIPT = """
+        if redis.call('EXISTS', KEYS[1]) == 1 then
+            redis.call('DEL', KEYS[3])
+            return 1
+        end
+        if ARGV[1] ~= '*' and (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+            redis.call('DEL', KEYS[3])
+            return 0
+        end
+        if redis.call('EXISTS', KEYS[3]) == 0 then
+            return 1
+        end
+        redis.call('RENAME', KEYS[3], KEYS[1])
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+        return 1
+    """
+
+    # KEYS: set, its version, ARGV: version expire, command, its arguments.
+    # a missing set is left alone and its version bumped instead.
+    UPDATE_SET_SCRIPT = """
+        if redis.call('EXISTS', KEYS[1]) == 0 then
+            redis.call('INCR', KEYS[2])
+            redis.call('EXPIRE', KEYS[2], ARGV[1])
+            return 0
+        end
+        redis.call(ARGV[2], KEYS[1], unpack(ARGV, 3))
+        return 1
+    """
+
+    # a set whose loads keep racing with updates is cached this long (in seconds)
+    RACING_LOAD_EXPIRE_TIME = 60
+    LOAD_SET_ATTEMPTS = 3
+    # arguments of each SADD or ZADD loading a set, even for the ZADD pairs
+    LOAD_SET_CHUNK_SIZE = 5000
+
+    @classmethod
+    def run_script(cls, script, keys, args=(), client=None):
+        conn = RedisClient.get_connection()
+        return conn.register_script(script)(keys=keys, args=args, client=client)
+
+    @classmethod
+    def get_version_key(cls, key):
+        return key + ':version'
+
+    @classmethod
+    def _load_set_aside(cls, key, command, args):
+        """
+        write the members to a key of their own with one command per
+        LOAD_SET_CHUNK_SIZE arguments, so that redis serves other clients in
+        between and a big set is never visible half loaded
+        """
+        conn = RedisClient.get_connection()
+        loading_key = '{}:loading:{}'.format(key, uuid.uuid4().hex)
+        pipe = conn.pipeline(transaction=False)
+        for index in range(0, len(args), cls.LOAD_SET_CHUNK_SIZE):
+            pipe.execute_command(command, loading_key, *args[index: index + cls.LOAD_SET_CHUNK_SIZE])
+            # left behind if the loader dies before the set replaces key
+            pipe.expire(loading_key, cls.RACING_LOAD_EXPIRE_TIME)
+        pipe.execute()
+        return loading_key
+
+    @classmethod
+    def load_set(cls, key, load_args, command='SADD'):
+        """
+        make sure the set (or sorted set with ZADD) at key is cached,
+        load_args returns the arguments of command and is only called if
+        it is not. a load that raced with an update_set is retried, the
+        update may have been committed after load_args read the database.
+        """
+        conn = RedisClient.get_connection()
+        version_key = cls.get_version_key(key)
+        for _ in range(cls.LOAD_SET_ATTEMPTS):
+            pipe = conn.pipeline()
+            pipe.exists(key)
+            pipe.get(version_key)
+            exists, version = pipe.execute()
+            if exists:
+                return key
+            loading_key = cls._load_set_aside(key, command, list(load_args()))
+            version = version.decode('utf-8') if version is not None else ''
+            if cls.run_script(
+                cls.LOAD_SET_SCRIPT,
+                keys=[key, version_key, loading_key],
+                args=[version, settings.REDIS_KEY_EXPIRE_TIME],
+            ):
+                return key
+
+        loading_key = cls._load_set_aside(key, command, list(load_args()))
+        cls.run_script(
+            cls.LOAD_SET_SCRIPT,
+            keys=[key, version_key, loading_key],
+            args=['*', cls.RACING_LOAD_EXPIRE_TIME],
+        )
+        return key
+
+    @classmethod
+    def update_set(cls, key, command, args, pipe):
+        """
+        queue command (SADD, SREM, ZADD, ZREM) on pipe, applied only if the
+        set at key is cached, otherwise a load in flight is invalidated
+        """
+        cls.run_script(
+            cls.UPDATE_SET_SCRIPT,
+            keys=[key, cls.get_version_key(key)],
+            args=[ONE_HOUR, command] + list(args),
+            client=pipe,
+        )
+
+    @classmethod
+    def claim_queue(cls, key, processing_key, processing_set_key):
+        """
+        move the queue (or a stale processing queue) to processing_key and
+        record it in processing_set_key, returns its values. the values are
+        only gone once release_queue runs, a consumer that dies before can
+        be recovered from processing_set_key.
+        """
+        serialized_list = cls.run_script(
+            cls.CLAIM_QUEUE_SCRIPT,
+            keys=[key, processing_key, processing_set_key],
+            args=[time.time()],
+        )
+        return [json.loads(serialized_data) for serialized_data in serialized_list]
+
+    @classmethod
+    def release_queue(cls, processing_key, processing_set_key, pipe):
+        """
+        queue the removal of a claimed queue on pipe, run it in the same
+        transaction as the writes that consumed the queue
+        """
+        pipe.delete(processing_key)
+        pipe.zrem(processing_set_key, processing_key)
+
+    @classmethod
+    def get_stale_processing_queues(cls, processing_set_key, timeout):
+        conn = RedisClient.get_connection()
+        return [
+            key.decode('utf-8')
+            for key in conn.zrangebyscore(processing_set_key, 0, time.time() - timeout)
+        ]
+
+    @classmethod
+    def rewrite_objects(cls, key, rewrite_func, serializer=DjangoModelSerializer):
+        """
+        replace the cached list with rewrite_func(objects) in one transaction,
+        do nothing if the list is not cached, it will be lazy loaded later
+        """
+        conn = RedisClient.get_connection()
+
+        def _rewrite(pipe):
+            if not pipe.exists(key):
+                return
+            objects = [
+                serializer.deserialize(serialized_data)
+                for serialized_data in pipe.lrange(key, 0, -1)
+            ]
+            serialized_list = [
+                serializer.serialize(obj)
+                for obj in rewrite_func(objects)
+            ]
+            pipe.multi()
+            pipe.delete(key)
+            if serialized_list:
+                pipe.rpush(key, *serialized_list)
+                pipe.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+
+        conn.transaction(_rewrite, key)
+
     @classmethod
     def get_count_key(cls, obj, attr):
         return '{}.{}:{}'.format(obj.__class__.__name__, attr, obj.id)
 
     @classmethod
-    def incr_count(cls, obj, attr):
-        conn = RedisClient.get_connection()
-        key = cls.get_count_key(obj, attr)
-        if not conn.exists(key):
-            conn.set(key, getattr(obj, attr))
-            conn.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
-            return getattr(obj, attr)
-        return conn.incr(key)
+    def get_pending_counts_key(cls, model_class, attr):
+        return 'pending_counts:{}.{}'.format(model_class.__name__, attr)
+
+    @classmethod
+    def get_flushing_counts_key(cls, model_class, attr):
+        return cls.get_pending_counts_key(model_class, attr) + ':flushing'
+
+    @classmethod
+    def get_flush_lock_key(cls, model_class, attr):
+        return cls.get_pending_counts_key(model_class, attr) + ':lock'
+
+    @classmethod
+    def incr_count(cls, obj, attr, delta=1, pipe=None):
+        """
+        buffer the delta in redis, flush_pending_counts writes it to the
+        database later so that hot rows are not locked by every update.
+        with pipe the increment is only queued on it.
+        """
+        if pipe is None:
+            pipe = RedisClient.get_connection()
+        pipe.hincrby(cls.get_pending_counts_key(obj.__class__, attr), obj.id, delta)
 
     @classmethod
     def decr_count(cls, obj, attr):
-        conn = RedisClient.get_connection()
-        key = cls.get_count_key(obj, attr)
-        if not conn.exists(key):
-            conn.set(key, getattr(obj, attr))
-            conn.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
-            return getattr(obj, attr)
-        return conn.decr(key)
+        return cls.incr_count(obj, attr, delta=-1)
 
     @classmethod
     def get_count(cls, obj, attr):
+        return cls.get_counts([obj], [attr])[obj.id][attr]
+
+    # KEYS: cached count, version of its attr, ARGV: version read before the
+    # count was loaded, count, expire. a flush since then may have deleted
+    # the key after updating the row, the loaded count is not cached then.
+    SET_COUNT_SCRIPT = """
+        if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+            return 0
+        end
+        if redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3], 'NX') then
+            return 1
+        end
+        return 0
+    """
+
+    @classmethod
+    def get_counts_version_key(cls, model_class, attr):
+        return cls.get_version_key(cls.get_pending_counts_key(model_class, attr))
+
+    @classmethod
+    def get_counts(cls, objects, attrs):
+        """
+        {object_id: {attr: count}} for objects of one model class with one
+        pipelined round trip, a count is the cached database value plus the
+        deltas that are not flushed yet. the cached values that are missing
+        are loaded with one query and written back in one pipeline, unless
+        a flush ran meanwhile.
+        """
+        if not objects:
+            return {}
+
+        model_class = objects[0].__class__
+        object_ids = [obj.id for obj in objects]
+        conn = RedisClient.get_connection()
+        pipe = conn.pipeline()
+        pipe.mget([cls.get_count_key(obj, attr) for obj in objects for attr in attrs])
+        for attr in attrs:
+            pipe.hmget(cls.get_pending_counts_key(model_class, attr), object_ids)
+            pipe.hmget(cls.get_flushing_counts_key(model_class, attr), object_ids)
+        for attr in attrs:
+            pipe.get(cls.get_counts_version_key(model_class, attr))
+        results = pipe.execute()
+        versions = {
+            attr: version.decode('utf-8') if version is not None else ''
+            for attr, version in zip(attrs, results[1 + 2 * len(attrs):])
+        }
+
+        base_counts = iter(results[0])
+        counts = {
+            obj.id: {attr: next(base_counts) for attr in attrs}
+            for obj in objects
+        }
+        missing_ids = [
+            object_id
+            for object_id, object_counts in counts.items()
+            if None in object_counts.values()
+        ]
+        if missing_ids:
+            pipe = conn.pipeline()
+            for row in model_class.objects.filter(id__in=missing_ids).values('id', *attrs):
+                for attr in attrs:
+                    if counts[row['id']][attr] is not None:
+                        continue
+                    counts[row['id']][attr] = row[attr]
+                    cls.run_script(
+                        cls.SET_COUNT_SCRIPT,
+                        keys=[
+                            cls.get_count_key(model_class(id=row['id']), attr),
+                            cls.get_counts_version_key(model_class, attr),
+                        ],
+                        args=[versions[attr], row[attr], settings.REDIS_KEY_EXPIRE_TIME],
+                        client=pipe,
+                    )
+            pipe.execute()
+
+        for index, attr in enumerate(attrs):
+            pending_deltas = results[1 + 2 * index]
+            flushing_deltas = results[2 + 2 * index]
+            for object_id, pending, flushing in zip(object_ids, pending_deltas, flushing_deltas):
+                counts[object_id][attr] = (
+                    int(counts[object_id][attr] or 0)
+                    + int(pending or 0)
+                    + int(flushing or 0)
+                )
+        return counts
+
+    @classmethod
+    def flush_pending_counts(cls, model_class, attr, batch_size=500):
+        """
+        apply the buffered deltas of attr with batched CASE WHEN updates,
+        returns the number of rows updated.
+
+        the pending hash is renamed first so new deltas go to a fresh one.
+        the cached counts of the flushed rows are deleted afterwards, a read
+        in between may count a delta twice until then. a flush that dies
+        after its update may apply its deltas twice, a flush that dies
+        before it is retried by the next one.
+
+        only one flush of attr runs at a time, a flush started while another
+        one holds the lock does nothing. the lock expires with the task time
+        limit so a killed flush does not block the next ones.
+        """
         conn = RedisClient.get_connection()
-        key = cls.get_count_key(obj, attr)
-        count = conn.get(key)
-        if count is not None:
-            return int(count)
-
-        obj.refresh_from_db()
-        count = getattr(obj, attr)
-        conn.set(key, count)
-        return count
+        lock = conn.lock(cls.get_flush_lock_key(model_class, attr), timeout=ONE_HOUR)
+        if not lock.acquire(blocking=False):
+            return 0
+        try:
+            return cls._flush_pending_counts(model_class, attr, batch_size)
+        finally:
+            lock.release()
+
+    @classmethod
+    def _flush_pending_counts(cls, model_class, attr, batch_size):
+        conn = RedisClient.get_connection()
+        pending_key = cls.get_pending_counts_key(model_class, attr)
+        flushing_key = cls.get_flushing_counts_key(model_class, attr)
+        if not conn.exists(flushing_key):
+            if not conn.exists(pending_key):
+                return 0
+            conn.rename(pending_key, flushing_key)
+
+        deltas = {
+            int(object_id): int(delta)
+            for object_id, delta in conn.hgetall(flushing_key).items()
+            if int(delta)
+        }
+        object_ids = sorted(deltas)
+        for i in range(0, len(object_ids), batch_size):
+            batch_ids = object_ids[i:i + batch_size]
+            model_class.objects.filter(id__in=batch_ids).update(**{
+                attr: Case(
+                    *[When(id=object_id, then=F(attr) + deltas[object_id]) for object_id in batch_ids],
+                    default=F(attr),
+                ),
+            })
+
+        # the version bump keeps the counts loaded before the update out
+        pipe = conn.pipeline()
+        pipe.incr(cls.get_counts_version_key(model_class, attr))
+        pipe.delete(flushing_key)
+        for object_id in object_ids:
+            pipe.delete(cls.get_count_key(model_class(id=object_id), attr))
+        pipe.execute()
+        return len(object_ids)
@@ -1,5 +1,7 @@
 from testing.testcases import TestCase
+from unittest import mock
 from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
 
 
 class UtilsTests(TestCase):
@@ -17,3 +19,24 @@ class UtilsTests(TestCase):
         RedisClient.clear()
         cached_list = conn.lrange('redis_key', 0, -1)
         self.assertEqual(cached_list, [])
+
+    @mock.patch.object(RedisHelper, 'LOAD_SET_CHUNK_SIZE', 2)
+    def test_load_set(self):
+        conn = RedisClient.get_connection()
+        RedisHelper.load_set('set_key', lambda: [0, 1, 2, 3, 4])
+        self.assertEqual(conn.smembers('set_key'), {b'0', b'1', b'2', b'3', b'4'})
+        self.assertEqual(conn.ttl('set_key') > 0, True)
+        RedisHelper.load_set('zset_key', lambda: [0, 0, 1, 'a', 2, 'b'], command='ZADD')
+        self.assertEqual(conn.zrange('zset_key', 0, -1), [b'0', b'a', b'b'])
+
+        # a load that raced with an update is not cached
+        def _load_args():
+            pipe = conn.pipeline()
+            RedisHelper.update_set('racing_key', 'SADD', [2], pipe)
+            pipe.execute()
+            return [0, 1]
+
+        with mock.patch.object(RedisHelper, 'LOAD_SET_ATTEMPTS', 1):
+            RedisHelper.load_set('racing_key', _load_args)
+        self.assertEqual(conn.ttl('racing_key') <= RedisHelper.RACING_LOAD_EXPIRE_TIME, True)
+        self.assertEqual(conn.keys('*:loading:*'), [])
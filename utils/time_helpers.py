@@ -3,4 +3,13 @@ import pytz
 
 
 def utc_now():
-    return datetime.now().replace(tzinfo=pytz.utc)
\ No newline at end of file
+    return datetime.now().replace(tzinfo=pytz.utc)
+
+
+def to_timestamp(dt):
+    # in micro seconds, the same unit as the created_at of hbase models
+    return int(dt.timestamp() * 1000000)
+
+
+def from_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp / 1000000, tz=pytz.utc)